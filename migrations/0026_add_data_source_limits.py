@@ -0,0 +1,11 @@
+from redash.models import db, DataSource
+from playhouse.migrate import PostgresqlMigrator, migrate
+
+if __name__ == '__main__':
+    migrator = PostgresqlMigrator(db.database)
+
+    with db.database.transaction():
+        migrate(
+            migrator.add_column('data_sources', 'max_concurrent_queries', DataSource.max_concurrent_queries),
+            migrator.add_column('data_sources', 'max_queries_per_minute', DataSource.max_queries_per_minute),
+        )
@@ -0,0 +1,17 @@
+import json
+
+from redash import redis_connection
+from redash.tasks.queries import QueryTaskTracker
+
+if __name__ == '__main__':
+    # Query task trackers used to be stored as JSON strings:
+    for list_name in (QueryTaskTracker.ALL_TRACKERS,) + QueryTaskTracker.ALL_LISTS:
+        for key_name in redis_connection.zrange(list_name, 0, -1):
+            if redis_connection.type(key_name) != 'string':
+                continue
+
+            data = json.loads(redis_connection.get(key_name))
+            pipe = redis_connection.pipeline()
+            pipe.delete(key_name)
+            pipe.hmset(key_name, dict((name, json.dumps(value)) for name, value in data.iteritems()))
+            pipe.execute()
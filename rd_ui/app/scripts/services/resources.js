@@ -371,7 +371,15 @@
     }
 
     var refreshStatus = function (queryResult, query) {
-      Job.get({'id': queryResult.job.id}, function (response) {
+      // With long polling the server holds the request until the job changes, so there's no need to wait between
+      // requests.
+      var longPoll = clientConfig.jobLongPollTimeout > 0;
+      var params = {'id': queryResult.job.id};
+      if (longPoll) {
+        params.wait = clientConfig.jobLongPollTimeout;
+      }
+
+      Job.get(params, function (response) {
         queryResult.update(response);
 
         if (queryResult.getStatus() == "processing" && queryResult.job.query_result_id && queryResult.job.query_result_id != "None") {
@@ -381,7 +389,7 @@
         } else if (queryResult.getStatus() != "failed") {
           $timeout(function () {
             refreshStatus(queryResult, query);
-          }, 3000);
+          }, longPoll ? 0 : 3000);
         }
       }, function(error) {
         console.log("Connection error", error);
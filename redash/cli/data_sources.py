@@ -123,9 +123,14 @@ def update_attr(obj, attr, new_value):
 @manager.option('--name', dest='new_name', default=None, help="new name for the data source")
 @manager.option('--options', dest='options', default=None, help="updated options for the data source")
 @manager.option('--type', dest='type', default=None, help="new type for the data source")
+@manager.option('--max-concurrent-queries', dest='max_concurrent_queries', default=None, type=int,
+                help="max number of queries running at once against the data source (0 for no limit)")
+@manager.option('--max-queries-per-minute', dest='max_queries_per_minute', default=None, type=int,
+                help="max number of queries started per minute against the data source (0 for no limit)")
 @manager.option('--org', dest='organization', default='default', help="The organization the user belongs to (leave blank for 'default').")
-def edit(name, new_name=None, options=None, type=None, organization='default'):
-    """Edit data source settings (name, options, type)."""
+def edit(name, new_name=None, options=None, type=None, max_concurrent_queries=None, max_queries_per_minute=None,
+         organization='default'):
+    """Edit data source settings (name, options, type, limits)."""
     try:
         if type is not None:
             validate_data_source_type(type)
@@ -144,6 +149,8 @@ def edit(name, new_name=None, options=None, type=None, organization='default'):
         update_attr(data_source, "name", new_name)
         update_attr(data_source, "type", type)
         update_attr(data_source, "options", options)
+        update_attr(data_source, "max_concurrent_queries", max_concurrent_queries)
+        update_attr(data_source, "max_queries_per_minute", max_queries_per_minute)
         data_source.save()
 
     except models.DataSource.DoesNotExist:
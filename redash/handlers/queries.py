@@ -12,6 +12,7 @@ from redash import models
 from redash.permissions import require_permission, require_access, require_admin_or_owner, not_view_only, view_only
 from redash.handlers.base import BaseResource, get_object_or_404
 from redash.utils import collect_parameters_from_request
+from redash.tasks.queries import PRIORITY_DASHBOARD, PRIORITY_BACKFILL
 
 
 @routes.route(org_scoped_rule('/api/queries/format'), methods=['POST'])
@@ -122,6 +123,12 @@ class QueryRefreshResource(BaseResource):
 
         parameter_values = collect_parameters_from_request(request.args)
 
-        return run_query(query.data_source, parameter_values, query.query, query.id)
+        # Refreshes (i.e. of dashboards) run after interactive executions, or after scheduled ones for backfills:
+        if request.args.get('priority') == PRIORITY_BACKFILL:
+            priority = PRIORITY_BACKFILL
+        else:
+            priority = PRIORITY_DASHBOARD
+
+        return run_query(query.data_source, parameter_values, query.query, query.id, priority=priority)
 
 
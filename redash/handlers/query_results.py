@@ -13,14 +13,14 @@ from redash.tasks import QueryTask, record_event
 from redash.permissions import require_permission, not_view_only, has_access, require_access, view_only
 from redash.handlers.base import BaseResource, get_object_or_404
 from redash.utils import collect_query_parameters, collect_parameters_from_request
-from redash.tasks.queries import enqueue_query
+from redash.tasks.queries import enqueue_query, PRIORITY_INTERACTIVE
 
 
 def error_response(message):
     return {'job': {'status': 4, 'error': message}}, 400
 
 
-def run_query(data_source, parameter_values, query_text, query_id, max_age=0):
+def run_query(data_source, parameter_values, query_text, query_id, max_age=0, priority=PRIORITY_INTERACTIVE):
     query_parameters = set(collect_query_parameters(query_text))
     missing_params = set(query_parameters) - set(parameter_values.keys())
     if missing_params:
@@ -45,7 +45,8 @@ def run_query(data_source, parameter_values, query_text, query_id, max_age=0):
     if query_result:
         return {'query_result': query_result.to_dict()}
     else:
-        job = enqueue_query(query_text, data_source, metadata={"Username": current_user.name, "Query ID": query_id})
+        job = enqueue_query(query_text, data_source, metadata={"Username": current_user.name, "Query ID": query_id},
+                            priority=priority)
         return {'job': job.to_dict()}
 
 
@@ -204,6 +205,12 @@ class QueryResultResource(BaseResource):
 class JobResource(BaseResource):
     def get(self, job_id):
         job = QueryTask(job_id=job_id)
+
+        # With ?wait=<seconds> the response is held until the job changes (up to JOB_LONG_POLL_TIMEOUT seconds):
+        wait = min(request.args.get('wait', 0, type=float), settings.JOB_LONG_POLL_TIMEOUT)
+        if wait > 0:
+            job.wait_for_update(wait)
+
         return {'job': job.to_dict()}
 
     def delete(self, job_id):
@@ -1,3 +1,4 @@
+import calendar
 import json
 from flask_login import UserMixin, AnonymousUserMixin
 import hashlib
@@ -46,6 +47,16 @@ class Database(object):
         if not self.database.is_closed():
             self.database.close()
 
+    def reset_connection(self):
+        """Forget the current connection without closing it.
+
+        Used in forked processes: closing the connection inherited from the parent process would close the parent's
+        connection as well.
+        """
+        self.pid = os.getpid()
+        self.database._conn_lock = threading.Lock()
+        self.database._Database__local = type(self.database._Database__local)()
+
     def _check_pid(self):
         current_pid = os.getpid()
         if self.pid != current_pid:
@@ -361,6 +372,9 @@ class DataSource(BelongsToOrgMixin, BaseModel):
     options = ConfigurationField()
     queue_name = peewee.CharField(default="queries")
     scheduled_queue_name = peewee.CharField(default="scheduled_queries")
+    # Limits for queries running against this data source (None means the defaults from settings are used):
+    max_concurrent_queries = peewee.IntegerField(null=True)
+    max_queries_per_minute = peewee.IntegerField(null=True)
     created_at = DateTimeTZField(default=datetime.datetime.now)
 
     class Meta:
@@ -386,6 +400,8 @@ class DataSource(BelongsToOrgMixin, BaseModel):
             d['options'] = self.options.to_dict(mask_secrets=True)
             d['queue_name'] = self.queue_name
             d['scheduled_queue_name'] = self.scheduled_queue_name
+            d['max_concurrent_queries'] = self.max_concurrent_queries
+            d['max_queries_per_minute'] = self.max_queries_per_minute
             d['groups'] = self.groups
 
         if with_permissions:
@@ -430,6 +446,17 @@ class DataSource(BelongsToOrgMixin, BaseModel):
     def pause_reason(self):
         return redis_connection.get(self._pause_key())
 
+    @classmethod
+    def get_pause_reasons(cls, data_sources):
+        """Returns the pause reason of each paused data source of the given ones (by id), in one round trip."""
+        data_sources = list(data_sources)
+        pipe = redis_connection.pipeline(transaction=False)
+        for data_source in data_sources:
+            pipe.get(data_source._pause_key())
+
+        return dict((data_source.id, reason) for data_source, reason in zip(data_sources, pipe.execute())
+                    if reason is not None)
+
     def pause(self, reason=None):
         redis_connection.set(self._pause_key(), reason)
 
@@ -536,8 +563,10 @@ class QueryResult(BaseModel, BelongsToOrgMixin):
 
         logging.info("Inserted query (%s) data; id=%s", query_hash, query_result.id)
 
-        sql = "UPDATE queries SET latest_query_data_id = %s WHERE query_hash = %s AND data_source_id = %s RETURNING id"
-        query_ids = [row[0] for row in db.database.execute_sql(sql, params=(query_result.id, query_hash, data_source_id))]
+        sql = "UPDATE queries SET latest_query_data_id = %s WHERE query_hash = %s AND data_source_id = %s RETURNING id, schedule"
+        updated_queries = db.database.execute_sql(sql, params=(query_result.id, query_hash, data_source_id)).fetchall()
+        query_ids = [row[0] for row in updated_queries]
+        Query.index_schedules([(query_id, schedule, retrieved_at) for query_id, schedule in updated_queries])
 
         # TODO: when peewee with update & returning support is released, we can get back to using this code:
         # updated_count = Query.update(latest_query_data=query_result).\
@@ -556,25 +585,42 @@ class QueryResult(BaseModel, BelongsToOrgMixin):
         return self.data_source.groups
 
 
-def should_schedule_next(previous_iteration, now, schedule):
+def next_iteration(previous_iteration, schedule):
     if schedule.isdigit():
         ttl = int(schedule)
-        next_iteration = previous_iteration + datetime.timedelta(seconds=ttl)
-    else:
-        hour, minute = schedule.split(':')
-        hour, minute = int(hour), int(minute)
+        return previous_iteration + datetime.timedelta(seconds=ttl)
+
+    hour, minute = schedule.split(':')
+    hour, minute = int(hour), int(minute)
+
+    # The following logic is needed for cases like the following:
+    # - The query scheduled to run at 23:59.
+    # - The scheduler wakes up at 00:01.
+    # - Using naive implementation of comparing timestamps, it will skip the execution.
+    normalized_previous_iteration = previous_iteration.replace(hour=hour, minute=minute)
+    if normalized_previous_iteration > previous_iteration:
+        previous_iteration = normalized_previous_iteration - datetime.timedelta(days=1)
 
-        # The following logic is needed for cases like the following:
-        # - The query scheduled to run at 23:59.
-        # - The scheduler wakes up at 00:01.
-        # - Using naive implementation of comparing timestamps, it will skip the execution.
-        normalized_previous_iteration = previous_iteration.replace(hour=hour, minute=minute)
-        if normalized_previous_iteration > previous_iteration:
-            previous_iteration = normalized_previous_iteration - datetime.timedelta(days=1)
+    return (previous_iteration + datetime.timedelta(days=1)).replace(hour=hour, minute=minute)
 
-        next_iteration = (previous_iteration + datetime.timedelta(days=1)).replace(hour=hour, minute=minute)
 
-    return now > next_iteration
+def schedule_jitter(query_id, schedule):
+    """Returns a fixed offset (in seconds) for the query's refreshes, to spread queries with the same schedule.
+
+    For interval based schedules the offset is capped at 10% of the interval, as it's added to every iteration.
+    """
+    window = settings.SCHEDULE_JITTER_WINDOW
+    if schedule.isdigit():
+        window = min(window, int(schedule) / 10)
+
+    if window <= 0:
+        return 0
+
+    return int(hashlib.md5(str(query_id)).hexdigest(), 16) % window
+
+
+def should_schedule_next(previous_iteration, now, schedule):
+    return now > next_iteration(previous_iteration, schedule)
 
 
 class Query(ModelTimestampsMixin, BaseModel, BelongsToOrgMixin):
@@ -593,6 +639,12 @@ class Query(ModelTimestampsMixin, BaseModel, BelongsToOrgMixin):
     schedule = peewee.CharField(max_length=10, null=True)
     options = JSONField(default={})
 
+    # Sorted set of scheduled query ids, scored by the (epoch) time of their next refresh.
+    SCHEDULE_KEY = 'query_schedule'
+    # Set once the index was built from the database. Saving or running a query indexes it on its own, so the index
+    # existing doesn't mean it has all scheduled queries (i.e. after Redis got flushed).
+    SCHEDULE_INDEXED_KEY = 'query_schedule:indexed'
+
     class Meta:
         db_table = 'queries'
 
@@ -659,21 +711,84 @@ class Query(ModelTimestampsMixin, BaseModel, BelongsToOrgMixin):
 
         return q
 
+    @classmethod
+    def index_schedules(cls, queries):
+        """Updates the next refresh time of the given (id, schedule, retrieved_at) tuples in the schedule index.
+
+        Queries without a schedule or without a result yet are removed from it.
+        """
+        pipe = redis_connection.pipeline()
+        for query_id, schedule, retrieved_at in queries:
+            if schedule and retrieved_at is not None:
+                next_run = calendar.timegm(next_iteration(retrieved_at, schedule).utctimetuple())
+                pipe.zadd(cls.SCHEDULE_KEY, next_run + schedule_jitter(query_id, schedule), query_id)
+            else:
+                pipe.zrem(cls.SCHEDULE_KEY, query_id)
+        pipe.execute()
+
+    @classmethod
+    def postpone_schedules(cls, query_hash, data_source_id, delay):
+        """Moves the next refresh of the scheduled queries with the given hash to `delay` seconds from now (or to their
+        next iteration, when it's sooner), i.e. after a failed refresh, which doesn't update their results.
+        """
+        now = utils.utcnow()
+        queries = cls.select(cls.id, cls.schedule)\
+            .where(cls.query_hash == query_hash, cls.data_source == data_source_id, cls.schedule != None)
+
+        pipe = redis_connection.pipeline()
+        for query_id, schedule in queries.tuples():
+            next_run = min(now + datetime.timedelta(seconds=delay), next_iteration(now, schedule))
+            pipe.zadd(cls.SCHEDULE_KEY, calendar.timegm(next_run.utctimetuple()) + schedule_jitter(query_id, schedule),
+                      query_id)
+        pipe.execute()
+
+    @classmethod
+    def update_schedule(cls, query_ids=None):
+        """Re-indexes the given queries, or all scheduled queries when no ids are given."""
+        queries = cls.select(cls.id, cls.schedule, QueryResult.retrieved_at)\
+            .join(QueryResult, join_type=peewee.JOIN_LEFT_OUTER)
+
+        if query_ids is None:
+            queries = queries.where(cls.schedule != None)
+        else:
+            queries = queries.where(cls.id << query_ids)
+
+        cls.index_schedules(queries.tuples())
+
     @classmethod
     def outdated_queries(cls):
+        """Returns the queries due for a refresh, the longest overdue first."""
+        if not redis_connection.exists(cls.SCHEDULE_INDEXED_KEY):
+            cls.update_schedule()
+            redis_connection.set(cls.SCHEDULE_INDEXED_KEY, 1)
+
+        now = utils.utcnow()
+        due_ids = [int(query_id) for query_id in
+                   redis_connection.zrangebyscore(cls.SCHEDULE_KEY, '-inf', calendar.timegm(now.utctimetuple()))]
+
+        if not due_ids:
+            return []
+
         queries = cls.select(cls, QueryResult.retrieved_at, DataSource)\
             .join(QueryResult)\
             .switch(Query).join(DataSource)\
-            .where(cls.schedule != None)
+            .where(cls.schedule != None, cls.id << due_ids)
 
-        now = utils.utcnow()
         outdated_queries = {}
+        found_ids = set()
         for query in queries:
+            found_ids.add(query.id)
             if should_schedule_next(query.latest_query_data.retrieved_at, now, query.schedule):
                 key = "{}:{}".format(query.query_hash, query.data_source.id)
                 outdated_queries[key] = query
 
-        return outdated_queries.values()
+        # Ids of deleted or no longer scheduled queries:
+        stale_ids = set(due_ids) - found_ids
+        if stale_ids:
+            redis_connection.zrem(cls.SCHEDULE_KEY, *stale_ids)
+
+        due_order = {query_id: i for i, query_id in enumerate(due_ids)}
+        return sorted(outdated_queries.values(), key=lambda q: due_order[q.id])
 
     @classmethod
     def search(cls, term, groups):
@@ -727,6 +842,8 @@ class Query(ModelTimestampsMixin, BaseModel, BelongsToOrgMixin):
         if created:
             self._create_default_visualizations()
 
+        Query.update_schedule([self.id])
+
     def _create_default_visualizations(self):
         table_visualization = Visualization(query=self, name="Table",
                                             description='',
@@ -1,4 +1,25 @@
+from kombu.transport.redis import Channel, PRIORITY_STEPS
+
 from redash import redis_connection, models, __version__
+from redash.tasks.fair_queue import FairQueue
+from redash.tasks.queries import PRIORITIES
+
+
+def _priority_queue_names(queue):
+    # Kombu's Redis transport keeps the messages of each priority step in a list of its own (see Channel._q_for_pri).
+    return [queue if priority == 0 else '{}{}{}'.format(queue, Channel.sep, priority) for priority in PRIORITY_STEPS]
+
+
+def get_queue_sizes(queues):
+    """Returns the number of messages waiting in each of the given Celery queues, of all priorities."""
+    pipe = redis_connection.pipeline(transaction=False)
+    for queue in queues:
+        for name in _priority_queue_names(queue):
+            pipe.llen(name)
+    sizes = pipe.execute()
+
+    steps = len(PRIORITY_STEPS)
+    return [sum(sizes[i * steps:(i + 1) * steps]) for i in range(len(queues))]
 
 
 def get_status():
@@ -25,10 +46,16 @@ def get_status():
             queues[queue].add(ds.name)
 
     status['manager']['queues'] = {}
-    for queue, sources in queues.iteritems():
+    for (queue, sources), size in zip(queues.items(), get_queue_sizes(queues.keys())):
         status['manager']['queues'][queue] = {
             'data_sources': ', '.join(sources),
-            'size': redis_connection.llen(queue)
+            'size': size
         }
 
+    status['manager']['fair_queues'] = {}
+    for fair_queue in FairQueue.all(len(PRIORITIES)):
+        queue_status = fair_queue.status()
+        queue_status['lanes'] = dict(zip(PRIORITIES, queue_status['lanes']))
+        status['manager']['fair_queues'][fair_queue.name] = queue_status
+
     return status
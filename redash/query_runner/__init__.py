@@ -1,7 +1,9 @@
 import logging
 import json
+import multiprocessing
 
 from redash import settings
+from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +18,8 @@ __all__ = [
     'TYPE_DATE',
     'TYPE_FLOAT',
     'SUPPORTED_COLUMN_TYPES',
+    'ResultWriter',
+    'interruptible_map',
     'register',
     'get_query_runner',
     'import_query_runners'
@@ -43,7 +47,95 @@ class InterruptException(Exception):
     pass
 
 
+# Seconds between wake ups of a thread waiting for a pool's results, so it gets to handle signals (i.e. the SIGINT sent
+# to cancel a query).
+INTERRUPT_CHECK_INTERVAL = 1
+
+
+def interruptible_map(pool, func, iterable):
+    """pool.map that can be interrupted. In Python 2 waiting without a timeout blocks signal handling until the whole
+    map is done."""
+    result = pool.map_async(func, iterable)
+    while True:
+        try:
+            return result.get(INTERRUPT_CHECK_INTERVAL)
+        except multiprocessing.TimeoutError:
+            pass
+
+
+class ResultWriter(object):
+    """Incrementally builds the JSON result (columns and rows) returned by query runners.
+
+    Rows are encoded as they are added, so a runner can stream rows from its cursor without holding both the rows and
+    their JSON representation in memory. Columns are kept in a name index, to make column discovery O(1). A result cut
+    at max_rows has "truncated": true in its JSON.
+    """
+    def __init__(self, encoder=JSONEncoder, max_rows=None):
+        self.columns = []
+        self.row_count = 0
+        self.max_rows = max_rows
+        self.truncated = False
+        self._columns_index = {}
+        self._encoder = encoder()
+        self._rows = []
+
+    def has_column(self, name):
+        return name in self._columns_index
+
+    def get_column(self, name):
+        return self._columns_index.get(name)
+
+    def add_column(self, name, type=None, friendly_name=None):
+        column = self._columns_index.get(name)
+        if column is None:
+            column = {'name': name, 'friendly_name': friendly_name or name, 'type': type}
+            self._columns_index[name] = column
+            self.columns.append(column)
+
+        return column
+
+    def set_columns(self, columns):
+        self.columns = []
+        self._columns_index = {}
+        for column in columns:
+            self._columns_index[column['name']] = column
+            self.columns.append(column)
+
+    @property
+    def full(self):
+        return self.max_rows is not None and self.row_count >= self.max_rows
+
+    def add_row(self, row):
+        """Encodes a single row. Returns False (and marks the result as truncated) once max_rows is reached."""
+        if self.full:
+            self.truncated = True
+            return False
+
+        self._rows.append(self._encoder.encode(row))
+        self.row_count += 1
+        return True
+
+    def add_rows(self, rows):
+        for row in rows:
+            if not self.add_row(row):
+                return False
+
+        return True
+
+    def to_json(self, **fields):
+        """Returns the result's JSON, with the given fields added to the columns and rows."""
+        if self.truncated:
+            fields['truncated'] = True
+
+        extra = ''.join(', %s: %s' % (self._encoder.encode(name), self._encoder.encode(value))
+                        for name, value in sorted(fields.items()))
+        return '{"columns": %s, "rows": [%s]%s}' % (self._encoder.encode(self.columns), ', '.join(self._rows), extra)
+
+
 class BaseQueryRunner(object):
+    # Set by the query executor to receive progress reports of the running query (see report_progress).
+    progress_callback = None
+
     def __init__(self, configuration):
         self.syntax = 'sql'
         self.configuration = configuration
@@ -71,6 +163,14 @@ class BaseQueryRunner(object):
     def run_query(self, query):
         raise NotImplementedError()
 
+    def report_progress(self, **progress):
+        """Reports the progress of the running query (i.e. state, completed splits or processed rows).
+
+        Runners that can tell how far along a query is call this while it's running.
+        """
+        if self.progress_callback is not None:
+            self.progress_callback(progress)
+
     def fetch_columns(self, columns):
         column_names = []
         duplicates_counter = 1
@@ -92,8 +192,19 @@ class BaseQueryRunner(object):
     def get_schema(self, get_stats=False):
         return []
 
+    def run_query_data(self, query):
+        """Runs the query and returns its result as a Python object (instead of JSON).
+
+        Runners that build their result in memory can override this to skip encoding and then decoding it.
+        """
+        json_data, error = self.run_query(query)
+        if error is not None:
+            return None, error
+
+        return json.loads(json_data), None
+
     def _run_query_internal(self, query):
-        results, error = self.run_query(query)
+        results, error = self.run_query_data(query)
 
         if error is not None:
             raise Exception("Failed running query [%s]." % query)
@@ -1,18 +1,38 @@
-import json
+import atexit
+import os
 import sys
 import logging
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
 try:
     from cassandra.cluster import Cluster
+    from cassandra.query import SimpleStatement
     enabled = True
 except ImportError:
     enabled = False
 
+DEFAULT_FETCH_SIZE = 5000
+
+# Cluster bootstrap (topology discovery, control connection) is expensive, so clusters and sessions are kept for the
+# lifetime of the worker process, per connection settings. Connections created before a fork belong to the parent
+# process and are discarded by the child.
+_sessions = {}
+
+
+def _shutdown_sessions():
+    for pid, cluster, session in _sessions.values():
+        if pid == os.getpid():
+            cluster.shutdown()
+
+    _sessions.clear()
+
+
+atexit.register(_shutdown_sessions)
+
+
 class Cassandra(BaseQueryRunner):
     @classmethod
     def enabled(cls):
@@ -41,6 +61,15 @@ class Cassandra(BaseQueryRunner):
                 'password': {
                     'type': 'string',
                     'title': 'Password'
+                },
+                'fetchSize': {
+                    'type': 'number',
+                    'title': 'Page Size (rows fetched per round trip)',
+                    'default': DEFAULT_FETCH_SIZE
+                },
+                'maxRows': {
+                    'type': 'number',
+                    'title': 'Maximum Rows'
                 }
             },
             'required': ['keyspace', 'host']
@@ -58,30 +87,48 @@ class Cassandra(BaseQueryRunner):
         results = self.run_query(query)
         return results, error
 
+    def _create_cluster(self):
+        if self.configuration.get('username', '') and self.configuration.get('password', ''):
+            from cassandra.auth import PlainTextAuthProvider
+            auth_provider = PlainTextAuthProvider(username='{}'.format(self.configuration.get('username', '')),
+                                                  password='{}'.format(self.configuration.get('password', '')))
+            return Cluster([self.configuration.get('host', '')], port=self.configuration.get('port', 9042),
+                           auth_provider=auth_provider)
+
+        return Cluster([self.configuration.get('host', '')], port=self.configuration.get('port', 9042))
+
+    def _get_session(self):
+        key = (self.configuration.get('host', ''), self.configuration.get('port', 9042),
+               self.configuration.get('username', ''), self.configuration.get('password', ''))
+
+        if key in _sessions and _sessions[key][0] != os.getpid():
+            del _sessions[key]
+
+        if key not in _sessions:
+            cluster = self._create_cluster()
+            _sessions[key] = (os.getpid(), cluster, cluster.connect())
+
+        return _sessions[key][2]
+
     def run_query(self, query):
-        from cassandra.cluster import Cluster
-        connection = None
+        json_data = None
         try:
-            if self.configuration.get('username', '') and self.configuration.get('password', ''):
-                from cassandra.auth import PlainTextAuthProvider
-                auth_provider = PlainTextAuthProvider(username='{}'.format(self.configuration.get('username', '')),
-                                                      password='{}'.format(self.configuration.get('password', '')))
-                connection = Cluster([self.configuration.get('host', '')], auth_provider=auth_provider)
-            else:
-                connection = Cluster([self.configuration.get('host', '')])
-
-            session = connection.connect()
+            session = self._get_session()
             logger.debug("Cassandra running query: %s", query)
-            result = session.execute(query)
+            statement = SimpleStatement(query, fetch_size=self.configuration.get('fetchSize', DEFAULT_FETCH_SIZE))
+            result = session.execute(statement)
 
             column_names = result.column_names
 
-            columns = self.fetch_columns(map(lambda c: (c, 'string'), column_names))
+            writer = ResultWriter(max_rows=self.configuration.get('maxRows'))
+            writer.set_columns(self.fetch_columns(map(lambda c: (c, 'string'), column_names)))
 
-            rows = [dict(zip(column_names, row)) for row in result]
+            # Iterating the result set fetches the next pages as needed; stop once the row cap is reached.
+            for row in result:
+                if not writer.add_row(dict(zip(column_names, row))):
+                    break
 
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
+            json_data = writer.to_json()
 
             error = None
 
@@ -1,7 +1,9 @@
-import json
 import logging
+import re
 import sys
-
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 
 from redash.query_runner import *
 from redash.utils import JSONEncoder
@@ -33,6 +35,34 @@ types_map = {
 }
 
 
+# Full table scans without conditions (i.e. "SCAN * FROM table LIMIT 100") can run as a parallel scan.
+FULL_SCAN_REGEX = re.compile(r'^\s*SCAN\s+\*\s+FROM\s+([\w.-]+)(?:\s+LIMIT\s+(\d+))?\s*;?\s*$', re.IGNORECASE)
+
+
+def _get_type(value):
+    return types_map.get(str(type(value)).upper(), None)
+
+
+class ReadCapacityThrottle(object):
+    """Keeps the read capacity units consumed by concurrent scan segments under a given rate (units per second)."""
+    def __init__(self, units_per_second):
+        self.units_per_second = units_per_second
+        self.consumed = 0
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, units):
+        if not self.units_per_second:
+            return
+
+        with self._lock:
+            self.consumed += units
+            wait = self.consumed / float(self.units_per_second) - (time.time() - self.started_at)
+
+        if wait > 0:
+            time.sleep(wait)
+
+
 class DynamoDBSQL(BaseSQLQueryRunner):
     @classmethod
     def configuration_schema(cls):
@@ -60,6 +90,19 @@ class DynamoDBSQL(BaseSQLQueryRunner):
                 "is_secure": {
                     "type": "boolean",
                     "default": False,
+                },
+                "scan_segments": {
+                    "type": "number",
+                    "title": "Parallel scan segments (for full table scans)",
+                    "default": 1
+                },
+                "read_capacity_limit": {
+                    "type": "number",
+                    "title": "Read capacity units per second to use for parallel scans"
+                },
+                "max_rows": {
+                    "type": "number",
+                    "title": "Maximum Rows"
                 }
             },
             "required": ["access_key", "secret_key"],
@@ -83,7 +126,9 @@ class DynamoDBSQL(BaseSQLQueryRunner):
 
     def _connect(self):
         engine = FragmentEngine()
-        config = self.configuration.to_dict()
+        config = self.configuration.to_dict().copy()
+        for key in ('scan_segments', 'read_capacity_limit', 'max_rows'):
+            config.pop(key, None)
 
         if not config.get('region'):
             config['region'] = 'us-east-1'
@@ -105,28 +150,72 @@ class DynamoDBSQL(BaseSQLQueryRunner):
             logging.exception(e)
             raise sys.exc_info()[1], None, sys.exc_info()[2]
 
+    def _parallel_scan(self, connection, table_name, limit):
+        """Scans the table with Segment/TotalSegments, one thread per segment."""
+        segments = self.configuration.get('scan_segments', 1)
+        max_rows = min(filter(None, [limit, self.configuration.get('max_rows')]) or [None])
+        throttle = ReadCapacityThrottle(self.configuration.get('read_capacity_limit'))
+        writer = ResultWriter(encoder=JSONEncoder, max_rows=max_rows)
+        writer_lock = threading.Lock()
+        done = threading.Event()
+
+        def scan_segment(segment):
+            results = connection.scan2(table_name, segment=segment, total_segments=segments, return_capacity='TOTAL')
+            consumed = 0
+            for item in results:
+                if done.is_set():
+                    break
+
+                if results.capacity != consumed:
+                    throttle.consume(results.capacity - consumed)
+                    consumed = results.capacity
+
+                with writer_lock:
+                    for k, v in item.iteritems():
+                        if not writer.has_column(k):
+                            writer.add_column(k, _get_type(v))
+
+                    if not writer.add_row(item):
+                        done.set()
+
+        pool = ThreadPool(segments)
+        try:
+            interruptible_map(pool, scan_segment, range(segments))
+        finally:
+            # Stops the segments that are still scanning (i.e. when the query got cancelled):
+            done.set()
+            pool.terminate()
+
+        # Stopping at the query's own LIMIT doesn't truncate the result:
+        if limit is not None and max_rows == limit:
+            writer.truncated = False
+
+        return writer.to_json()
+
     def run_query(self, query):
         connection = None
         try:
             engine, connection = self._connect()
 
+            full_scan = FULL_SCAN_REGEX.match(query)
+            if full_scan and self.configuration.get('scan_segments', 1) > 1:
+                limit = int(full_scan.group(2)) if full_scan.group(2) else None
+                json_data = self._parallel_scan(engine.connection, full_scan.group(1), limit)
+                return json_data, None
+
             res_dict = engine.execute(query if str(query).endswith(';') else str(query)+';')
 
-            columns = []
-            rows = []
+            writer = ResultWriter(encoder=JSONEncoder, max_rows=self.configuration.get('max_rows'))
             for item in res_dict:
 
-                if not columns:
+                if not writer.columns:
                     for k, v in item.iteritems():
-                        columns.append({
-                            'name': k,
-                            'friendly_name': k,
-                            'type': types_map.get(str(type(v)).upper(), None)
-                        })
-                rows.append(item)
-
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
+                        writer.add_column(k, _get_type(v))
+
+                if not writer.add_row(item):
+                    break
+
+            json_data = writer.to_json()
             error = None
         except ParseException as e:
             error = u"Error parsing query at line {} (column {}):\n{}".format(e.lineno, e.column, e.line)
@@ -134,7 +223,7 @@ class DynamoDBSQL(BaseSQLQueryRunner):
         except (SyntaxError, RuntimeError) as e:
             error = e.message
             json_data = None
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, InterruptException):
             if connection:
                 connection.cancel()
             error = "Query cancelled by user."
@@ -1,6 +1,7 @@
 from base64 import b64decode
 import json
 import logging
+import re
 from dateutil import parser
 from redash.query_runner import *
 from redash.utils import JSONEncoder
@@ -20,62 +21,119 @@ def _load_key(filename):
         return json.loads(f.read())
 
 
+INTEGER_REGEX = re.compile(r'^\s*[-+]?\d+\s*$')
+FLOAT_REGEX = re.compile(r'^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$')
+BOOLEAN_VALUES = ('true', 'false')
+# dateutil will happily turn almost any string into a date (i.e. "March" or "4th"), and it's slow at it. Only hand it
+# values that contain a digit and nothing but characters that show up in common date formats.
+DATETIME_REGEX = re.compile(r'^(?=.*\d)[\w\s,:./+\-]{4,40}$', re.UNICODE)
+
+# Number of non empty values used to infer the type of a column.
+TYPE_INFERENCE_SAMPLE_SIZE = 100
+
+
+def _is_empty(value):
+    return value == '' or value is None
+
+
+def _parse_datetime(value):
+    if not DATETIME_REGEX.match(value):
+        raise ValueError("Not a date: {}".format(value))
+
+    try:
+        return parser.parse(value)
+    except (OverflowError, TypeError):
+        raise ValueError("Not a date: {}".format(value))
+
+
+def _parse_boolean(value):
+    value = unicode(value).lower()
+    if value not in BOOLEAN_VALUES:
+        raise ValueError("Not a boolean: {}".format(value))
+
+    return value == 'true'
+
+
 def _guess_type(value):
     if value == '':
         return TYPE_STRING
-    try:
-        val = int(value)
+    if INTEGER_REGEX.match(value):
         return TYPE_INTEGER
-    except ValueError:
-        pass
-    try:
-        val = float(value)
+    if FLOAT_REGEX.match(value):
         return TYPE_FLOAT
-    except ValueError:
-        pass
-    if unicode(value).lower() in ('true', 'false'):
+    if unicode(value).lower() in BOOLEAN_VALUES:
         return TYPE_BOOLEAN
     try:
-        val = parser.parse(value)
+        _parse_datetime(value)
         return TYPE_DATETIME
     except ValueError:
         pass
     return TYPE_STRING
 
 
+def _value_eval(value):
+    if _is_empty(value):
+        return None
+
+    value_type = _guess_type(value)
+    if value_type == TYPE_STRING:
+        return value
+
+    return CONVERTERS[value_type](value)
+
+
 def _value_eval_list(value):
-    value_list = []
-    for member in value:
-        if member == '' or member is None:
-            val = None
-            value_list.append(val)
-            continue
-        try:
-            val = int(member)
-            value_list.append(val)
-            continue
-        except ValueError:
-            pass
-        try:
-            val = float(member)
-            value_list.append(val)
-            continue
-        except ValueError:
-            pass
-        if unicode(member).lower() in ('true', 'false'):
-            if unicode(member).lower() == 'true':
-                value_list.append(True)
-            else:
-                value_list.append(False)
+    return [_value_eval(member) for member in value]
+
+
+def _guess_column_type(values):
+    """Infer a column type from a sample of its values.
+
+    Returns the narrowest type all of the sampled (non empty) values agree on, falling back to string."""
+    types = set()
+    for value in values:
+        if _is_empty(value):
             continue
+
+        types.add(_guess_type(value))
+        if len(types) > 1 and not types.issubset((TYPE_INTEGER, TYPE_FLOAT)):
+            return TYPE_STRING
+
+    if not types:
+        return TYPE_STRING
+
+    if types == set([TYPE_INTEGER, TYPE_FLOAT]):
+        return TYPE_FLOAT
+
+    return types.pop()
+
+
+def _column_converter(column_type):
+    """Returns a function converting a single value of a column of the given type.
+
+    Values that don't fit the inferred type (the sample might have missed them) are evaluated individually."""
+    if column_type == TYPE_STRING:
+        return lambda value: None if _is_empty(value) else value
+
+    convert = CONVERTERS[column_type]
+
+    def converter(value):
+        if _is_empty(value):
+            return None
         try:
-            val = parser.parse(member)
-            value_list.append(val)
-            continue
+            return convert(value)
         except ValueError:
-            pass
-        value_list.append(member)
-    return value_list
+            return _value_eval(value)
+
+    return converter
+
+
+CONVERTERS = {
+    TYPE_INTEGER: int,
+    TYPE_FLOAT: float,
+    TYPE_BOOLEAN: _parse_boolean,
+    TYPE_DATETIME: _parse_datetime
+}
 
 
 HEADER_INDEX = 0
@@ -87,6 +145,18 @@ class WorksheetNotFoundError(Exception):
         super(WorksheetNotFoundError, self).__init__(message)
 
 
+def _column_sample(rows, j):
+    """Returns up to TYPE_INFERENCE_SAMPLE_SIZE non empty values of the j-th column, from its first rows."""
+    sample = []
+    for row in rows:
+        if j < len(row) and not _is_empty(row[j]):
+            sample.append(row[j])
+            if len(sample) == TYPE_INFERENCE_SAMPLE_SIZE:
+                break
+
+    return sample
+
+
 def parse_worksheet(worksheet):
     if not worksheet:
         return {'columns': [], 'rows': []}
@@ -102,11 +172,13 @@ def parse_worksheet(worksheet):
             'type': TYPE_STRING
         })
 
-    if len(worksheet) > 1:
-        for j, value in enumerate(worksheet[HEADER_INDEX+1]):
-            columns[j]['type'] = _guess_type(value)
+    data_rows = worksheet[HEADER_INDEX + 1:]
+    converters = []
+    for j, column in enumerate(columns):
+        column['type'] = _guess_column_type(_column_sample(data_rows, j))
+        converters.append(_column_converter(column['type']))
 
-    rows = [dict(zip(column_names, _value_eval_list(row))) for row in worksheet[HEADER_INDEX + 1:]]
+    rows = [dict(zip(column_names, [convert(value) for convert, value in zip(converters, row)])) for row in data_rows]
     data = {'columns': columns, 'rows': rows}
 
     return data
@@ -1,27 +1,58 @@
-import json
 import datetime
 import requests
 import logging
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
+# One session (and connection pool) per Graphite server, kept for the lifetime of the worker process.
+_sessions = {}
 
-def _transform_result(response):
-    columns = ({'name': 'Time::x', 'type': TYPE_DATETIME},
-               {'name': 'value::y', 'type': TYPE_FLOAT},
-               {'name': 'name::series', 'type': TYPE_STRING})
 
-    rows = []
+def _get_session(url, pool_size):
+    if url not in _sessions:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _sessions[url] = session
 
-    for series in response.json():
-        for values in series['datapoints']:
-            timestamp = datetime.datetime.fromtimestamp(int(values[1]))
-            rows.append({'Time::x': timestamp, 'name::series': series['target'], 'value::y': values[0]})
+    return _sessions[url]
 
-    data = {'columns': columns, 'rows': rows}
-    return json.dumps(data, cls=JSONEncoder)
+
+def _transform_result(responses):
+    """Merges the series of all the given responses into a single result."""
+    writer = ResultWriter()
+    writer.add_column('Time::x', TYPE_DATETIME)
+    writer.add_column('value::y', TYPE_FLOAT)
+    writer.add_column('name::series', TYPE_STRING)
+
+    for response in responses:
+        for series in response.json():
+            for values in series['datapoints']:
+                timestamp = datetime.datetime.fromtimestamp(int(values[1]))
+                writer.add_row({'Time::x': timestamp, 'name::series': series['target'], 'value::y': values[0]})
+
+    return writer.to_json()
+
+
+def _split_query(query):
+    """Splits the query lines into target parameters and the parameters common to all of them."""
+    targets = []
+    params = []
+    for line in query.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith("target="):
+            targets.append(line)
+        else:
+            params.append(line)
+
+    return targets, params
 
 
 class Graphite(BaseQueryRunner):
@@ -42,6 +73,15 @@ class Graphite(BaseQueryRunner):
                 'verify': {
                     'type': 'boolean',
                     'title': 'Verify SSL certificate'
+                },
+                'concurrency': {
+                    'type': 'number',
+                    'title': 'Concurrent requests (fetch each target separately when more than 1)',
+                    'default': 1
+                },
+                'maxDataPoints': {
+                    'type': 'number',
+                    'title': 'Max data points per series (consolidated by Graphite)'
                 }
             },
             'required': ['url'],
@@ -61,20 +101,47 @@ class Graphite(BaseQueryRunner):
             self.auth = None
 
         self.verify = self.configuration.get("verify", True)
+        self.concurrency = self.configuration.get("concurrency", 1)
+        self.max_data_points = self.configuration.get("maxDataPoints", None)
         self.base_url = "%s/render?format=json&" % self.configuration['url']
 
+    def _build_urls(self, query):
+        targets, params = _split_query(query)
+
+        if self.max_data_points and not any(p.startswith("maxDataPoints=") for p in params):
+            params.append("maxDataPoints=%d" % self.max_data_points)
+
+        if self.concurrency > 1 and len(targets) > 1:
+            return ["%s%s" % (self.base_url, "&".join([target] + params)) for target in targets]
+
+        return ["%s%s" % (self.base_url, "&".join(targets + params))]
+
     def run_query(self, query):
-        url = "%s%s" % (self.base_url, "&".join(query.split("\n")))
+        urls = self._build_urls(query)
+        session = _get_session(self.configuration['url'], self.concurrency)
         error = None
         data = None
 
+        def fetch(url):
+            return session.get(url, auth=self.auth, verify=self.verify)
+
         try:
-            response = requests.get(url, auth=self.auth, verify=self.verify)
+            if len(urls) > 1:
+                pool = ThreadPool(min(self.concurrency, len(urls)))
+                try:
+                    responses = interruptible_map(pool, fetch, urls)
+                finally:
+                    pool.terminate()
+            else:
+                responses = [fetch(urls[0])]
 
-            if response.status_code == 200:
-                data = _transform_result(response)
+            failed = [r for r in responses if r.status_code != 200]
+            if failed:
+                error = "Failed getting results (%d)" % failed[0].status_code
             else:
-                error = "Failed getting results (%d)" % response.status_code
+                data = _transform_result(responses)
+        except (KeyboardInterrupt, InterruptException):
+            error = "Query cancelled by user."
         except Exception, ex:
             data = None
             error = ex.message
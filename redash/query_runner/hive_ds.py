@@ -1,9 +1,7 @@
-import json
 import logging
 import sys
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -102,25 +100,20 @@ class Hive(BaseSQLQueryRunner):
             cursor.execute(query)
 
             column_names = []
-            columns = []
+            writer = ResultWriter()
 
             for column in cursor.description:
                 column_name = column[COLUMN_NAME]
                 column_names.append(column_name)
+                writer.add_column(column_name, types_map.get(column[COLUMN_TYPE], None))
 
-                columns.append({
-                    'name': column_name,
-                    'friendly_name': column_name,
-                    'type': types_map.get(column[COLUMN_TYPE], None)
-                })
+            for row in cursor:
+                writer.add_row(dict(zip(column_names, row)))
 
-            rows = [dict(zip(column_names, row)) for row in cursor]
-
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
+            json_data = writer.to_json()
             error = None
-        except KeyboardInterrupt:
-            connection.cancel()
+        except (KeyboardInterrupt, InterruptException):
+            # The pinned PyHive (0.1.6) can't cancel a query; closing the connection (below) ends it.
             error = "Query cancelled by user."
             json_data = None
         except Exception as e:
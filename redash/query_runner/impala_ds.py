@@ -1,9 +1,7 @@
-import json
 import logging
 import sys
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +15,9 @@ except ImportError, e:
 COLUMN_NAME = 0
 COLUMN_TYPE = 1
 
+# Rows fetched per Thrift round trip (the driver's default is tiny for large results).
+DEFAULT_FETCH_SIZE = 10000
+
 types_map = {
     'BIGINT': TYPE_INTEGER,
     'TINYINT': TYPE_INTEGER,
@@ -64,6 +65,11 @@ class Impala(BaseSQLQueryRunner):
                 },
                 "timeout": {
                     "type": "number"
+                },
+                "fetch_size": {
+                    "type": "number",
+                    "title": "Rows per fetch",
+                    "default": DEFAULT_FETCH_SIZE
                 }
             },
             "required": ["host"],
@@ -96,30 +102,32 @@ class Impala(BaseSQLQueryRunner):
     def run_query(self, query):
 
         connection = None
+        cursor = None
         try:
-            connection = connect(**self.configuration.to_dict())
+            config = self.configuration.to_dict().copy()
+            fetch_size = config.pop('fetch_size', DEFAULT_FETCH_SIZE)
+            connection = connect(**config)
 
             cursor = connection.cursor()
+            # Also sets the number of rows fetched per round trip (buffersize):
+            cursor.arraysize = fetch_size
 
             cursor.execute(query)
 
             column_names = []
-            columns = []
+            writer = ResultWriter()
 
             for column in cursor.description:
                 column_name = column[COLUMN_NAME]
                 column_names.append(column_name)
+                writer.add_column(column_name, types_map.get(column[COLUMN_TYPE], None))
 
-                columns.append({
-                    'name': column_name,
-                    'friendly_name': column_name,
-                    'type': types_map.get(column[COLUMN_TYPE], None)
-                })
-
-            rows = [dict(zip(column_names, row)) for row in cursor]
+            rows = cursor.fetchmany(fetch_size)
+            while rows:
+                writer.add_rows([dict(zip(column_names, row)) for row in rows])
+                rows = cursor.fetchmany(fetch_size)
 
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
+            json_data = writer.to_json()
             error = None
             cursor.close()
         except DatabaseError as e:
@@ -130,8 +138,9 @@ class Impala(BaseSQLQueryRunner):
             logging.exception(e)
             json_data = None
             error = "Metastore Error [%s]" % e.message
-        except KeyboardInterrupt:
-            connection.cancel()
+        except (KeyboardInterrupt, InterruptException):
+            if cursor:
+                cursor.cancel_operation()
             error = "Query cancelled by user."
             json_data = None
         except Exception as e:
@@ -1,7 +1,5 @@
-import json
 import logging
 
-from redash.utils import JSONEncoder
 from redash.query_runner import *
 
 logger = logging.getLogger(__name__)
@@ -15,37 +13,38 @@ except ImportError:
 
 
 def _transform_result(results):
-    result_columns = []
-    result_rows = []
+    writer = ResultWriter()
 
     for result in results:
         for series in result.raw.get('series', []):
             for column in series['columns']:
-                if column not in result_columns:
-                    result_columns.append(column)
+                writer.add_column(column)
             tags = series.get('tags', {})
             for key in tags.keys():
-                if key not in result_columns:
-                    result_columns.append(key)
+                writer.add_column(key)
 
     for result in results:
         for series in result.raw.get('series', []):
+            columns = series['columns']
+            tags = series.get('tags', {})
             for point in series['values']:
-                result_row = {}
-                for column in result_columns:
-                    tags = series.get('tags', {})
-                    if column in tags:
-                        result_row[column] = tags[column]
-                    elif column in series['columns']:
-                        index = series['columns'].index(column)
-                        value = point[index]
-                        result_row[column] = value
-                result_rows.append(result_row)
-
-    return json.dumps({
-        "columns": [{'name': c} for c in result_columns],
-        "rows": result_rows
-    }, cls=JSONEncoder)
+                result_row = dict(zip(columns, point))
+                # Tags take precedence over columns with the same name:
+                result_row.update(tags)
+                writer.add_row(result_row)
+
+    return writer.to_json()
+
+
+# Clients are kept for the lifetime of the worker process, to reuse their connections.
+_clients = {}
+
+
+def _get_client(url):
+    if url not in _clients:
+        _clients[url] = InfluxDBClusterClient.from_DSN(url)
+
+    return _clients[url]
 
 
 class InfluxDB(BaseQueryRunner):
@@ -77,7 +76,7 @@ class InfluxDB(BaseQueryRunner):
         super(InfluxDB, self).__init__(configuration)
 
     def run_query(self, query):
-        client = InfluxDBClusterClient.from_DSN(self.configuration['url'])
+        client = _get_client(self.configuration['url'])
 
         logger.debug("influxdb url: %s", self.configuration['url'])
         logger.debug("influxdb got query: %s", query)
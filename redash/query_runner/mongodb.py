@@ -1,9 +1,12 @@
 import json
 import datetime
+import hashlib
 import logging
 import re
+from multiprocessing.pool import ThreadPool
 from dateutil.parser import parse
 
+from redash import redis_connection
 from redash.utils import JSONEncoder, parse_human_time
 from redash.query_runner import *
 
@@ -15,6 +18,7 @@ try:
     from bson.timestamp import Timestamp
     from bson.son import SON
     from bson.json_util import object_hook as bson_object_hook
+    from pymongo.errors import OperationFailure
     enabled = True
 
 except ImportError:
@@ -32,6 +36,13 @@ TYPES_MAP = {
 }
 
 
+# Inferred collection fields are cached along with the collection stats they were inferred from, so unchanged
+# collections aren't sampled again on the next schema refresh.
+SCHEMA_CACHE_EXPIRY = 7 * 24 * 3600
+DEFAULT_SCHEMA_SAMPLE_SIZE = 1000
+DEFAULT_SCHEMA_PARALLELISM = 4
+
+
 class MongoDBJSONEncoder(JSONEncoder):
     def default(self, o):
         if isinstance(o, ObjectId):
@@ -81,6 +92,16 @@ class MongoDB(BaseQueryRunner):
                     'type': 'string',
                     'title': 'Replica Set Name'
                 },
+                'schemaSampleSize': {
+                    'type': 'number',
+                    'title': 'Schema Sample Size (documents per collection)',
+                    'default': DEFAULT_SCHEMA_SAMPLE_SIZE
+                },
+                'schemaParallelism': {
+                    'type': 'number',
+                    'title': 'Schema Refresh Parallelism',
+                    'default': DEFAULT_SCHEMA_PARALLELISM
+                },
             },
             'required': ['connectionString', 'dbName']
         }
@@ -102,13 +123,6 @@ class MongoDB(BaseQueryRunner):
 
         self.is_replica_set = True if "replicaSetName" in self.configuration and self.configuration["replicaSetName"] else False
 
-    def _get_column_by_name(self, columns, column_name):
-        for c in columns:
-            if "name" in c and c["name"] == column_name:
-                return c
-
-        return None
-
     def _get_db(self):
         if self.is_replica_set:
             db_connection = pymongo.MongoReplicaSetClient(self.configuration["connectionString"], replicaSet=self.configuration["replicaSetName"])
@@ -122,16 +136,13 @@ class MongoDB(BaseQueryRunner):
               if property not in columns:
                   columns.append(property)
 
-    def _get_collection_fields(self, db, collection_name):
-        # Since MongoDB is a document based database and each document doesn't have
-        # to have the same fields as another documet in the collection its a bit hard to
-        # show these attributes as fields in the schema.
+    def _get_natural_order_fields(self, db, collection_name):
+        # Fallback for servers without $sample (MongoDB < 3.2).
         #
-        # For now, the logic is to take the first and last documents (last is determined
-        # by the Natural Order (http://www.mongodb.org/display/DOCS/Sorting+and+Natural+Order)
-        # as we don't know the correct order. In most single server installations it would be
-        # find. In replicaset when reading from non master it might not return the really last
-        # document written.
+        # Take the first and last documents (last is determined by the Natural Order
+        # (http://www.mongodb.org/display/DOCS/Sorting+and+Natural+Order) as we don't know the correct order. In most
+        # single server installations it would be fine. In replicaset when reading from non master it might not return
+        # the really last document written.
         first_document = None
         last_document = None
 
@@ -147,11 +158,70 @@ class MongoDB(BaseQueryRunner):
 
         return columns
 
+    def _get_sampled_fields(self, db, collection_name):
+        sample_size = self.configuration.get('schemaSampleSize', DEFAULT_SCHEMA_SAMPLE_SIZE)
+
+        columns = []
+        for d in db[collection_name].aggregate([{"$sample": {"size": sample_size}}]):
+            self._merge_property_names(columns, d)
+
+        return columns
+
+    def _get_collection_stats(self, db, collection_name):
+        try:
+            stats = db.command("collstats", collection_name)
+        except OperationFailure:
+            return None
+
+        return {'count': stats.get('count'), 'avgObjSize': stats.get('avgObjSize')}
+
+    def _schema_cache_key(self, collection_name):
+        db_hash = hashlib.md5(u"{}:{}".format(self.configuration['connectionString'], self.db_name).encode('utf-8'))
+        return u"mongodb:schema:{}:{}".format(db_hash.hexdigest(), collection_name)
+
+    def _get_collection_fields(self, db, collection_name):
+        # Since MongoDB is a document based database and each document doesn't have
+        # to have the same fields as another documet in the collection its a bit hard to
+        # show these attributes as fields in the schema.
+        #
+        # The fields are inferred from a random sample of the collection's documents, and cached along with the
+        # collection stats (count & average document size). As long as those didn't change, the cached fields are used.
+        stats = self._get_collection_stats(db, collection_name)
+        key = self._schema_cache_key(collection_name)
+
+        if stats is not None:
+            cached = redis_connection.get(key)
+            if cached is not None:
+                cached = json.loads(cached)
+                if cached['stats'] == stats:
+                    return cached['columns']
+
+        try:
+            columns = self._get_sampled_fields(db, collection_name)
+        except OperationFailure:
+            columns = self._get_natural_order_fields(db, collection_name)
+
+        if stats is not None:
+            redis_connection.setex(key, SCHEMA_CACHE_EXPIRY, json.dumps({'stats': stats, 'columns': columns}))
+
+        return columns
+
     def get_schema(self, get_stats=False):
-        schema = {}
         db = self._get_db()
-        for collection_name in db.collection_names():
-            columns = self._get_collection_fields(db, collection_name)
+        collection_names = db.collection_names()
+        if not collection_names:
+            return []
+
+        parallelism = self.configuration.get('schemaParallelism', DEFAULT_SCHEMA_PARALLELISM)
+        pool = ThreadPool(max(1, min(parallelism, len(collection_names))))
+        try:
+            collections_columns = pool.map(lambda name: self._get_collection_fields(db, name), collection_names)
+        finally:
+            pool.close()
+            pool.join()
+
+        schema = {}
+        for collection_name, columns in zip(collection_names, collections_columns):
             schema[collection_name] = { "name" : collection_name, "columns" : sorted(columns) }
 
         return schema.values()
@@ -201,8 +271,11 @@ class MongoDB(BaseQueryRunner):
             for field_data in query_data["sort"]:
                 s.append((field_data["name"], field_data["direction"]))
 
-        columns = []
-        rows = []
+        # $out and $merge must be the last stage, so for them the fields are only picked from the result:
+        if f and aggregate and not any(stage in aggregate[-1] for stage in ("$out", "$merge")):
+            aggregate.append({"$project": f})
+
+        writer = ResultWriter(encoder=MongoDBJSONEncoder)
 
         cursor = None
         if q or (not q and not aggregate):
@@ -217,11 +290,17 @@ class MongoDB(BaseQueryRunner):
             if "limit" in query_data:
                 cursor = cursor.limit(query_data["limit"])
 
+            if "batchSize" in query_data:
+                cursor = cursor.batch_size(query_data["batchSize"])
+
             if "count" in query_data:
                 cursor = cursor.count()
 
         elif aggregate:
-            r = db[collection].aggregate(aggregate)
+            if "batchSize" in query_data:
+                r = db[collection].aggregate(aggregate, batchSize=query_data["batchSize"])
+            else:
+                r = db[collection].aggregate(aggregate)
 
             # Backwards compatibility with older pymongo versions.
             #
@@ -234,38 +313,26 @@ class MongoDB(BaseQueryRunner):
                 cursor = r
 
         if "count" in query_data:
-            columns.append({
-                "name" : "count",
-                "friendly_name" : "count",
-                "type" : TYPE_INTEGER
-            })
-
-            rows.append({ "count" : cursor })
+            writer.add_column("count", TYPE_INTEGER)
+            writer.add_row({"count": cursor})
         else:
             for r in cursor:
                 for k in r:
-                    if self._get_column_by_name(columns, k) is None:
-                        columns.append({
-                            "name": k,
-                            "friendly_name": k,
-                            "type": TYPES_MAP.get(type(r[k]), TYPE_STRING)
-                        })
+                    if not writer.has_column(k):
+                        writer.add_column(k, TYPES_MAP.get(type(r[k]), TYPE_STRING))
 
-                rows.append(r)
+                writer.add_row(r)
 
         if f:
             ordered_columns = []
             for k in sorted(f, key=f.get):
-                ordered_columns.append(self._get_column_by_name(columns, k))
+                if writer.has_column(k):
+                    ordered_columns.append(writer.get_column(k))
 
-            columns = ordered_columns
+            writer.set_columns(ordered_columns)
 
-        data = {
-            "columns": columns,
-            "rows": rows
-        }
         error = None
-        json_data = json.dumps(data, cls=MongoDBJSONEncoder)
+        json_data = writer.to_json()
 
         return json_data, error
 
@@ -3,7 +3,6 @@ import logging
 import sys
 
 from redash.query_runner import *
-from redash.utils import JSONEncoder
 
 try:
     import cx_Oracle
@@ -35,6 +34,16 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_ARRAYSIZE = 1000
+# Characters (or bytes, for BLOBs) read from a LOB per round trip.
+LOB_CHUNK_SIZE = 65536
+# Characters kept of each LOB value when lobMode is "truncate".
+DEFAULT_LOB_MAX_SIZE = 4000
+
+LOB_MODE_STREAM = 'stream'
+LOB_MODE_TRUNCATE = 'truncate'
+
+
 class Oracle(BaseSQLQueryRunner):
 
     @classmethod
@@ -68,6 +77,25 @@ class Oracle(BaseSQLQueryRunner):
                 "servicename": {
                     "type": "string",
                     "title": "DSN Service Name"
+                },
+                "arraysize": {
+                    "type": "number",
+                    "title": "Rows per fetch",
+                    "default": DEFAULT_ARRAYSIZE
+                },
+                "prefetchrows": {
+                    "type": "number",
+                    "title": "Rows prefetched with the query execution"
+                },
+                "lobMode": {
+                    "type": "string",
+                    "title": "LOB columns: stream (read whole values in chunks) or truncate",
+                    "default": LOB_MODE_STREAM
+                },
+                "lobMaxSize": {
+                    "type": "number",
+                    "title": "Max LOB size kept when truncating",
+                    "default": DEFAULT_LOB_MAX_SIZE
                 }
             },
             "required": ["servicename", "user", "password", "host", "port"],
@@ -127,9 +155,8 @@ class Oracle(BaseSQLQueryRunner):
 
     @classmethod
     def output_handler(cls, cursor, name, default_type, length, precision, scale):
-        if default_type in (cx_Oracle.CLOB, cx_Oracle.LOB):
-            return cursor.var(cx_Oracle.LONG_STRING, 80000, cursor.arraysize)
-
+        # LOB columns are left as locators and read by the column's converter (see _lob_converter),
+        # instead of being fetched into fixed size buffers allocated for every row of the fetch.
         if default_type in (cx_Oracle.STRING, cx_Oracle.FIXED_CHAR):
             return cursor.var(unicode, length, cursor.arraysize)
 
@@ -137,22 +164,80 @@ class Oracle(BaseSQLQueryRunner):
             if scale <= 0:
                 return cursor.var(cx_Oracle.STRING, 255, outconverter=Oracle._convert_number, arraysize=cursor.arraysize)
 
+    def _lob_converter(self):
+        if self.configuration.get('lobMode', LOB_MODE_STREAM) == LOB_MODE_TRUNCATE:
+            max_size = int(self.configuration.get('lobMaxSize', DEFAULT_LOB_MAX_SIZE))
+        else:
+            max_size = None
+
+        def read_lob(lob):
+            if lob is None:
+                return None
+
+            size = lob.size()
+            if max_size is not None:
+                size = min(size, max_size)
+
+            # LOB offsets are 1-based.
+            chunks = []
+            offset = 1
+            while offset <= size:
+                amount = min(LOB_CHUNK_SIZE, size - offset + 1)
+                chunks.append(lob.read(offset, amount))
+                offset += amount
+
+            return ''.join(chunks)
+
+        return read_lob
+
+    def _column_converters(self, description):
+        """Returns a converter per column (None if the value is used as is), computed once per cursor."""
+        lob_types = (cx_Oracle.CLOB, cx_Oracle.BLOB, getattr(cx_Oracle, 'NCLOB', cx_Oracle.CLOB))
+        lob_converter = None
+        converters = []
+
+        for column in description:
+            if column[1] in lob_types:
+                lob_converter = lob_converter or self._lob_converter()
+                converters.append(lob_converter)
+            else:
+                converters.append(None)
+
+        return converters
+
     def run_query(self, query):
         connection = cx_Oracle.connect(self.connection_string)
         connection.outputtypehandler = Oracle.output_handler
 
         cursor = connection.cursor()
+        cursor.arraysize = int(self.configuration.get('arraysize', DEFAULT_ARRAYSIZE))
+        # prefetchrows is only available since cx_Oracle 8.
+        if self.configuration.get('prefetchrows') and hasattr(cursor, 'prefetchrows'):
+            cursor.prefetchrows = int(self.configuration['prefetchrows'])
 
         try:
             cursor.execute(query)
 
             if cursor.description is not None:
-                columns = self.fetch_columns([(i[0], Oracle.get_col_type(i[1], i[5])) for i in cursor.description])
-                rows = [dict(zip((c['name'] for c in columns), row)) for row in cursor]
+                writer = ResultWriter()
+                writer.set_columns(self.fetch_columns([(i[0], Oracle.get_col_type(i[1], i[5])) for i in cursor.description]))
+                column_names = [c['name'] for c in writer.columns]
+                converters = self._column_converters(cursor.description)
+                converted = [(i, converter) for i, converter in enumerate(converters) if converter is not None]
+
+                # LOB locators have to be read before the next fetch, so rows are converted batch by batch.
+                rows = cursor.fetchmany()
+                while rows:
+                    for row in rows:
+                        if converted:
+                            row = list(row)
+                            for i, converter in converted:
+                                row[i] = converter(row[i])
+                        writer.add_row(dict(zip(column_names, row)))
+                    rows = cursor.fetchmany()
 
-                data = {'columns': columns, 'rows': rows}
                 error = None
-                json_data = json.dumps(data, cls=JSONEncoder)
+                json_data = writer.to_json()
             else:
                 error = 'Query completed but it returned no data.'
                 json_data = None
@@ -160,7 +245,7 @@ class Oracle(BaseSQLQueryRunner):
             logging.exception(err.message)
             error = "Query failed. {}.".format(err.message)
             json_data = None
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, InterruptException):
             connection.cancel()
             error = "Query cancelled by user."
             json_data = None
@@ -1,6 +1,7 @@
 import json
 
-from redash.utils import JSONEncoder
+import requests
+
 from redash.query_runner import *
 
 import logging
@@ -30,6 +31,11 @@ PRESTO_TYPES_MAPPING = {
 }
 
 
+# Number of rows moved from the cursor to the result at a time. Presto returns results in pages, which the cursor
+# fetches as needed.
+FETCH_SIZE = 1000
+
+
 class Presto(BaseQueryRunner):
     @classmethod
     def configuration_schema(cls):
@@ -103,20 +109,54 @@ class Presto(BaseQueryRunner):
                 schema=self.configuration.get('schema', 'default'))
 
         cursor = connection.cursor()
-
+        self._track_progress(cursor)
 
         try:
             cursor.execute(query)
             column_tuples = [(i[0], PRESTO_TYPES_MAPPING.get(i[1], None)) for i in cursor.description]
-            columns = self.fetch_columns(column_tuples)
-            rows = [dict(zip(([c['name'] for c in columns]), r)) for i, r in enumerate(cursor.fetchall())]
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
+            writer = ResultWriter()
+            writer.set_columns(self.fetch_columns(column_tuples))
+            column_names = [c['name'] for c in writer.columns]
+
+            rows = cursor.fetchmany(FETCH_SIZE)
+            while rows:
+                writer.add_rows([dict(zip(column_names, r)) for r in rows])
+                rows = cursor.fetchmany(FETCH_SIZE)
+
+            json_data = writer.to_json()
             error = None
+        except (KeyboardInterrupt, InterruptException):
+            self._cancel(cursor)
+            error = "Query cancelled by user."
+            json_data = None
         except Exception, ex:
             json_data = None
             error = ex.message
 
         return json_data, error
 
+    def _track_progress(self, cursor):
+        # The cursor processes a response from Presto for each status (and page of results) it gets, both while the
+        # query runs and while we fetch results. Wrap it to report the stats each response carries.
+        process_response = cursor._process_response
+
+        def process_response_and_report(response):
+            process_response(response)
+            stats = response.json().get('stats')
+            if stats:
+                self.report_progress(state=stats.get('state'),
+                                     completed_splits=stats.get('completedSplits'),
+                                     total_splits=stats.get('totalSplits'),
+                                     processed_rows=stats.get('processedRows'),
+                                     processed_bytes=stats.get('processedBytes'))
+
+        cursor._process_response = process_response_and_report
+
+    def _cancel(self, cursor):
+        if hasattr(cursor, 'cancel'):
+            cursor.cancel()
+        # Older PyHive versions can't cancel queries: deleting the query's next URI makes Presto cancel it.
+        elif cursor._nextUri:
+            requests.delete(cursor._nextUri)
+
 register(Presto)
@@ -1,10 +1,22 @@
 import datetime
+import hashlib
 import json
 import logging
+import os
+import resource
+import signal
 import sys
+import threading
+from collections import OrderedDict
+from itertools import izip
+from multiprocessing.pool import ThreadPool
+
+import billiard
+from billiard.exceptions import TimeoutError as PoolTimeoutError
 
 from redash.query_runner import *
-from redash import models
+from redash import models, settings
+from redash.utils import JSONEncoder
 
 import importlib
 
@@ -14,6 +26,102 @@ from RestrictedPython import compile_restricted
 from RestrictedPython.Guards import safe_builtins
 
 
+class CompiledCodeCache(object):
+    """LRU cache of restricted code objects, keyed by the hash of the script source."""
+    def __init__(self, size):
+        self.size = size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, source):
+        if isinstance(source, unicode):
+            key = hashlib.sha1(source.encode('utf-8')).hexdigest()
+        else:
+            key = hashlib.sha1(source).hexdigest()
+
+        with self._lock:
+            code = self._cache.pop(key, None)
+
+        if code is None:
+            code = compile_restricted(source, '<string>', 'exec')
+
+        with self._lock:
+            self._cache[key] = code
+            if len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+
+        return code
+
+
+TYPES_MAP = {
+    str: TYPE_STRING,
+    unicode: TYPE_STRING,
+    int: TYPE_INTEGER,
+    long: TYPE_INTEGER,
+    float: TYPE_FLOAT,
+    bool: TYPE_BOOLEAN,
+    datetime.datetime: TYPE_DATETIME,
+    datetime.date: TYPE_DATE,
+}
+
+# numpy dtype kinds, as found on pandas DataFrame columns:
+DTYPE_KINDS_MAP = {
+    'i': TYPE_INTEGER,
+    'u': TYPE_INTEGER,
+    'f': TYPE_FLOAT,
+    'b': TYPE_BOOLEAN,
+    'M': TYPE_DATETIME,
+}
+
+# Maximum number of queries execute_queries runs concurrently.
+EXECUTE_QUERIES_MAX_WORKERS = 8
+
+compiled_code_cache = CompiledCodeCache(settings.PYTHON_RUNNER_CODE_CACHE_SIZE)
+
+# Scripts run in a pool of processes, created on first use and kept for the lifetime of the worker process. The pool
+# is terminated (and recreated on next use) when a script times out or gets cancelled. It's a billiard pool, as
+# Celery's prefork workers are daemonic processes, which multiprocessing doesn't allow to have children.
+_script_pool = None
+_script_pool_pid = None
+
+
+def _init_script_process():
+    # Cancelling is handled by the parent process, which terminates the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    models.db.reset_connection()
+
+    if settings.PYTHON_RUNNER_MEMORY_LIMIT:
+        limit = settings.PYTHON_RUNNER_MEMORY_LIMIT * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _execute_script(configuration, query):
+    try:
+        return Python(configuration).run_script(query)
+    finally:
+        models.db.close_db(None)
+
+
+def _get_script_pool():
+    global _script_pool, _script_pool_pid
+    # A pool created before a fork belongs to the parent process.
+    if _script_pool is None or _script_pool_pid != os.getpid():
+        _script_pool = billiard.Pool(settings.PYTHON_RUNNER_POOL_SIZE,
+                                     initializer=_init_script_process,
+                                     maxtasksperchild=settings.PYTHON_RUNNER_MAX_TASKS_PER_PROCESS)
+        _script_pool_pid = os.getpid()
+
+    return _script_pool
+
+
+def _terminate_script_pool():
+    global _script_pool
+    if _script_pool is not None and _script_pool_pid == os.getpid():
+        _script_pool.terminate()
+
+    _script_pool = None
+
+
 class CustomPrint(object):
     """CustomPrint redirect "print" calls to be sent as "log" on the result object."""
     def __init__(self):
@@ -69,6 +177,10 @@ class Python(BaseQueryRunner):
         self._script_locals = {"result": {"rows": [], "columns": [], "log": []}}
         self._enable_print_log = True
         self._custom_print = CustomPrint()
+        # Results of execute_query/get_query_result calls, so a script asking for the same data twice gets it once.
+        self._results_cache = {}
+        # Rows added through the bulk helpers are kept encoded, in a writer per result dict (by its id).
+        self._result_writers = {}
 
         if self.configuration.get("allowedImportModules", None):
             for item in self.configuration["allowedImportModules"].split(","):
@@ -138,13 +250,115 @@ class Python(BaseQueryRunner):
 
         result["rows"].append(values)
 
+    def _result_writer(self, result):
+        """Returns the writer holding the given result's encoded rows.
+
+        The rows already in result["rows"] are moved to the writer first, so rows keep the order they were added in.
+        """
+        if id(result) not in self._result_writers:
+            self._result_writers[id(result)] = (result, ResultWriter(encoder=JSONEncoder))
+
+        writer = self._result_writers[id(result)][1]
+        if result.get("rows"):
+            writer.add_rows(result["rows"])
+        result["rows"] = []
+
+        return writer
+
+    def _finish_result(self, result):
+        """Returns the writer with all the rows and columns of the given result (see _result_writer)."""
+        writer = self._result_writer(result)
+        writer.set_columns(result.get("columns", []))
+        self._result_writers.pop(id(result))
+        return writer
+
+    def add_result_rows(self, result, rows):
+        """Helper function to add many rows to results set at once.
+
+        The rows are encoded as they're added, so they don't show up in result["rows"].
+
+        Parameters:
+        :result dict: The result dict
+        :rows list: List of rows, each a tuple (or list) of values in the order of the result columns.
+        """
+        names = [c['name'] for c in result.get("columns", [])]
+        writer = self._result_writer(result)
+
+        for row in rows:
+            writer.add_row(dict(izip(names, row)))
+
+    def set_result_columns(self, result, columns, types=None):
+        """Helper function to set the results set from column oriented data. Replaces existing columns and rows.
+
+        Parameters:
+        :result dict: The result dict
+        :columns list|OrderedDict: List of pairs (or ordered mapping) of column name to the list of its values. All
+                                   lists must be of the same length. The columns of a plain dict are sorted by name.
+        :types dict: Optional mapping of column name to its type. When missing, the type is guessed from the values.
+        """
+        if isinstance(columns, OrderedDict):
+            columns = columns.items()
+        elif hasattr(columns, 'items'):
+            columns = sorted(columns.items())
+
+        types = types or {}
+        names = [name for name, values in columns]
+        values = [values for name, values in columns]
+
+        if len(set(len(v) for v in values)) > 1:
+            raise Exception("All columns must have the same number of values.")
+
+        result["columns"] = []
+        for name, column_values in columns:
+            column_type = types.get(name) or self._guess_column_type(column_values)
+            self.add_result_column(result, name, name, column_type)
+
+        result["rows"] = []
+        self._result_writers.pop(id(result), None)
+        self.add_result_rows(result, izip(*values))
+
+    def add_result_dataframe(self, result, df):
+        """Helper function to set the results set from a pandas DataFrame. Replaces existing columns and rows.
+
+        Parameters:
+        :result dict: The result dict
+        :df DataFrame: The DataFrame to use. Its columns become the result columns, with types based on their dtypes.
+        """
+        columns = []
+        types = {}
+        for name in df.columns:
+            series = df[name]
+            column_values = series.tolist()
+            if series.isnull().any():
+                column_values = [None if isnull else v for v, isnull in izip(column_values, series.isnull().tolist())]
+
+            columns.append((unicode(name), column_values))
+            types[unicode(name)] = DTYPE_KINDS_MAP.get(series.dtype.kind, TYPE_STRING)
+
+        self.set_result_columns(result, columns, types)
+
+    @staticmethod
+    def _guess_column_type(values):
+        for value in values:
+            if value is not None:
+                return TYPES_MAP.get(type(value), TYPE_STRING)
+
+        return TYPE_STRING
+
     def execute_query(self, data_source_name_or_id, query):
         """Run query from specific data source.
 
+        The result is cached for the rest of the script run, so calling it again with the same arguments returns the
+        same object.
+
         Parameters:
         :data_source_name_or_id string|integer: Name or ID of the data source
         :query string: Query to run
         """
+        key = ('query', data_source_name_or_id, query)
+        if key in self._results_cache:
+            return self._results_cache[key]
+
         try:
             if type(data_source_name_or_id) == int:
                 data_source = models.DataSource.get_by_id(data_source_name_or_id)
@@ -153,12 +367,34 @@ class Python(BaseQueryRunner):
         except models.DataSource.DoesNotExist:
             raise Exception("Wrong data source name/id: %s." % data_source_name_or_id)
 
-        data, error = data_source.query_runner.run_query(query)
+        data, error = data_source.query_runner.run_query_data(query)
         if error is not None:
             raise Exception(error)
 
-        # TODO: allow avoiding the json.dumps/loads in same process
-        return json.loads(data)
+        self._results_cache[key] = data
+        return data
+
+    def execute_queries(self, queries):
+        """Run several queries concurrently and return their results, in the same order.
+
+        Parameters:
+        :queries list: List of (data_source_name_or_id, query) pairs
+        """
+        if not queries:
+            return []
+
+        def execute(args):
+            try:
+                return self.execute_query(*args)
+            finally:
+                # Each thread gets its own database connection.
+                models.db.close_db(None)
+
+        pool = ThreadPool(min(len(queries), EXECUTE_QUERIES_MAX_WORKERS))
+        try:
+            return interruptible_map(pool, execute, queries)
+        finally:
+            pool.terminate()
 
     def get_query_result(self, query_id):
         """Get result of an existing query.
@@ -174,32 +410,89 @@ class Python(BaseQueryRunner):
         if query.latest_query_data is None:
             raise Exception("Query does not have results yet.")
 
+        key = ('query_result', query.latest_query_data_id)
+        if key in self._results_cache:
+            return self._results_cache[key]
+
         if query.latest_query_data.data is None:
             raise Exception("Query does not have results yet.")
 
-        return json.loads(query.latest_query_data.data)
+        data = json.loads(query.latest_query_data.data)
+        self._results_cache[key] = data
+        return data
 
     def run_query(self, query):
+        if not settings.PYTHON_RUNNER_POOL_SIZE:
+            return self.run_script(query)
+
+        try:
+            pool = _get_script_pool()
+            async_result = pool.apply_async(_execute_script, (self.configuration, query))
+            json_data, error = async_result.get(settings.PYTHON_RUNNER_TIMEOUT)
+        except PoolTimeoutError:
+            _terminate_script_pool()
+            error = "Script exceeded the time limit ({} seconds).".format(settings.PYTHON_RUNNER_TIMEOUT)
+            json_data = None
+        except (KeyboardInterrupt, InterruptException):
+            _terminate_script_pool()
+            error = "Query cancelled by user."
+            json_data = None
+        except Exception as e:
+            error = str(e)
+            json_data = None
+
+        return json_data, error
+
+    def run_query_data(self, query):
+        # Used when another script runs a query against this data source: we're already inside a script process, so
+        # run in-process and hand back the result object (only decoding the rows added by the bulk helpers).
+        data, error = self._run_script(query)
+        if data is not None and id(data) in self._result_writers:
+            data["rows"] = json.loads(self._finish_result(data).to_json())["rows"]
+
+        return data, error
+
+    def run_script(self, query):
+        data, error = self._run_script(query)
+        if error is not None:
+            return None, error
+
+        try:
+            writer = self._finish_result(data)
+            json_data = writer.to_json(**dict((k, v) for k, v in data.iteritems() if k not in ("columns", "rows")))
+        except Exception as e:
+            error = str(e)
+            json_data = None
+
+        return json_data, error
+
+    def _run_script(self, query):
         try:
             error = None
 
-            code = compile_restricted(query, '<string>', 'exec')
+            code = compiled_code_cache.get(query)
 
-            safe_builtins["_write_"] = self.custom_write
-            safe_builtins["__import__"] = self.custom_import
-            safe_builtins["_getattr_"] = getattr
-            safe_builtins["getattr"] = getattr
-            safe_builtins["_setattr_"] = setattr
-            safe_builtins["setattr"] = setattr
-            safe_builtins["_getitem_"] = self.custom_get_item
-            safe_builtins["_getiter_"] = self.custom_get_iter
-            safe_builtins["_print_"] = self._custom_print
+            builtins = dict(safe_builtins)
+            builtins["_write_"] = self.custom_write
+            builtins["__import__"] = self.custom_import
+            builtins["_getattr_"] = getattr
+            builtins["getattr"] = getattr
+            builtins["_setattr_"] = setattr
+            builtins["setattr"] = setattr
+            builtins["_getitem_"] = self.custom_get_item
+            builtins["_getiter_"] = self.custom_get_iter
+            builtins["_print_"] = self._custom_print
 
-            restricted_globals = dict(__builtins__=safe_builtins)
+            restricted_globals = dict(__builtins__=builtins)
             restricted_globals["get_query_result"] = self.get_query_result
             restricted_globals["execute_query"] = self.execute_query
+            restricted_globals["execute_queries"] = self.execute_queries
             restricted_globals["add_result_column"] = self.add_result_column
             restricted_globals["add_result_row"] = self.add_result_row
+            restricted_globals["add_result_rows"] = self.add_result_rows
+            restricted_globals["set_result_columns"] = self.set_result_columns
+            if "pandas" in self._allowed_modules:
+                restricted_globals["add_result_dataframe"] = self.add_result_dataframe
             restricted_globals["disable_print_log"] = self._custom_print.disable
             restricted_globals["enable_print_log"] = self._custom_print.enable
 
@@ -216,23 +509,18 @@ class Python(BaseQueryRunner):
             restricted_globals["min"] = min
             restricted_globals["max"] = max
 
-            # TODO: Figure out the best way to have a timeout on a script
-            #       One option is to use ETA with Celery + timeouts on workers
-            #       And replacement of worker process every X requests handled.
-
             exec(code) in restricted_globals, self._script_locals
 
             result = self._script_locals['result']
             result['log'] = self._custom_print.lines
-            json_data = json.dumps(result)
         except KeyboardInterrupt:
             error = "Query cancelled by user."
-            json_data = None
+            result = None
         except Exception as e:
             error = str(e)
-            json_data = None
+            result = None
 
-        return json_data, error
+        return result, error
 
 
 register(Python)
@@ -1,6 +1,5 @@
-import json
+import time
 
-from redash.utils import JSONEncoder
 from redash.query_runner import *
 
 import logging
@@ -32,6 +31,11 @@ TD_TYPES_MAPPING = {
     'varchar': TYPE_STRING,
 }
 
+JOB_FINISHED_STATUSES = ('success', 'error', 'killed')
+# Job status polling starts at POLL_INTERVAL seconds and backs off up to MAX_POLL_INTERVAL.
+POLL_INTERVAL = 1
+MAX_POLL_INTERVAL = 30
+
 
 class TreasureData(BaseQueryRunner):
     @classmethod
@@ -92,30 +96,59 @@ class TreasureData(BaseQueryRunner):
                 raise Exception("Failed getting schema")
         return schema.values()
 
-    def run_query(self, query):
-        connection = tdclient.connect(
-                endpoint=self.configuration.get('endpoint', 'https://api.treasuredata.com'),
-                apikey=self.configuration.get('apikey'),
-                type=self.configuration.get('type', 'hive').lower(),
-                db=self.configuration.get('db'))
+    def _wait_for_job(self, client, job_id):
+        """Polls the job with an exponential backoff until it finishes and returns its details."""
+        interval = POLL_INTERVAL
+        job = client.api.show_job(job_id)
+
+        while job['status'] not in JOB_FINISHED_STATUSES:
+            cmdout = [line for line in (job.get('debug') or {}).get('cmdout', '').splitlines() if line.strip()]
+            self.report_progress(job_id=job_id, state=job['status'], log=cmdout[-1] if cmdout else None)
+
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+            job = client.api.show_job(job_id)
+
+        return job
 
-        cursor = connection.cursor()
+    def run_query(self, query):
+        client = tdclient.Client(self.configuration.get('apikey'),
+                                 endpoint=self.configuration.get('endpoint', 'https://api.treasuredata.com'))
+        job_id = None
 
         try:
-            cursor.execute(query)
-            columns_data = [(row[0], cursor.show_job()['hive_result_schema'][i][1]) for i,row in enumerate(cursor.description)]
+            job_id = client.query(self.configuration.get('db'), query,
+                                  type=self.configuration.get('type', 'hive').lower()).job_id
+            job = self._wait_for_job(client, job_id)
+
+            if job['status'] != 'success':
+                stderr = (job.get('debug') or {}).get('stderr')
+                raise Exception("Job {} {}. {}".format(job_id, job['status'], stderr or ''))
+
+            # The schema is read once from the job details, not once per column.
+            columns_data = job.get('hive_result_schema') or []
+            column_names = [column[0] for column in columns_data]
 
-            columns = [{'name': col[0],
-                'friendly_name': col[0],
-                'type': TD_TYPES_MAPPING.get(col[1], None)} for col in columns_data]
+            writer = ResultWriter()
+            for name, td_type in columns_data:
+                writer.add_column(name, TD_TYPES_MAPPING.get(td_type, None))
 
-            rows = [dict(zip(([c[0] for c in columns_data]), r)) for i, r in enumerate(cursor.fetchall())]
-            data = {'columns': columns, 'rows': rows}
-            json_data = json.dumps(data, cls=JSONEncoder)
+            # Streams the result as msgpack instead of downloading and parsing it at once.
+            for row in client.job_result_format_each(job_id, 'msgpack'):
+                writer.add_row(dict(zip(column_names, row)))
+
+            json_data = writer.to_json()
             error = None
+        except (KeyboardInterrupt, InterruptException):
+            if job_id is not None:
+                client.kill(job_id)
+            json_data = None
+            error = "Query cancelled by user."
         except Exception, ex:
             json_data = None
             error = ex.message
+        finally:
+            client.close()
 
         return json_data, error
 
@@ -1,8 +1,90 @@
+import hashlib
+import json
+import re
 import sys
-import urllib2
+import time
 
+import requests
+from requests.adapters import HTTPAdapter
+
+from redash import redis_connection
 from redash.query_runner import *
 
+DEFAULT_TIMEOUT = 60
+
+# Cached responses are kept for a day, to allow revalidating them with the upstream (304 Not Modified) after their
+# max-age passed. Large responses aren't cached.
+CACHE_EXPIRY = 24 * 3600
+MAX_CACHED_RESPONSE_SIZE = 5 * 1024 * 1024
+
+MAX_AGE_REGEX = re.compile(r'max-age=(\d+)')
+
+# One session (and connection pool) per URL base path, kept for the lifetime of the worker process.
+_sessions = {}
+
+
+def _get_session(base_url):
+    if base_url not in _sessions:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _sessions[base_url] = session
+
+    return _sessions[base_url]
+
+
+def _cache_key(url):
+    return "url_runner:response:{}".format(hashlib.md5(url.encode('utf-8')).hexdigest())
+
+
+def _get_cached_response(url):
+    cached = redis_connection.get(_cache_key(url))
+    if cached is None:
+        return None
+
+    return json.loads(cached)
+
+
+def _cache_response(url, response, body):
+    cache_control = response.headers.get('Cache-Control', '').lower()
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+
+    if 'no-store' in cache_control or len(body) > MAX_CACHED_RESPONSE_SIZE:
+        return
+
+    max_age = MAX_AGE_REGEX.search(cache_control)
+    if max_age and 'no-cache' not in cache_control:
+        fresh_until = time.time() + int(max_age.group(1))
+    else:
+        fresh_until = 0
+
+    # Without a validator or a max-age, there is nothing to reuse the response with.
+    if not etag and not last_modified and not fresh_until:
+        return
+
+    cached = {
+        'etag': etag,
+        'last_modified': last_modified,
+        'fresh_until': fresh_until,
+        'body': body
+    }
+
+    try:
+        cached = json.dumps(cached)
+    except UnicodeDecodeError:
+        return
+
+    redis_connection.setex(_cache_key(url), CACHE_EXPIRY, cached)
+
+
+def _refresh_cached_response(url, response, cached):
+    # A 304 response may carry updated caching headers, which apply to the response we already have.
+    response.headers.setdefault('ETag', cached['etag'])
+    response.headers.setdefault('Last-Modified', cached['last_modified'])
+    _cache_response(url, response, cached['body'])
+
 
 class Url(BaseQueryRunner):
     @classmethod
@@ -13,6 +95,11 @@ class Url(BaseQueryRunner):
                 'url': {
                     'type': 'string',
                     'title': 'URL base path'
+                },
+                'timeout': {
+                    'type': 'number',
+                    'title': 'Request Timeout (seconds)',
+                    'default': DEFAULT_TIMEOUT
                 }
             }
         }
@@ -21,6 +108,33 @@ class Url(BaseQueryRunner):
     def annotate_query(cls):
         return False
 
+    def _fetch(self, session, url):
+        timeout = self.configuration.get('timeout', DEFAULT_TIMEOUT)
+        cached = _get_cached_response(url)
+
+        if cached and cached['fresh_until'] > time.time():
+            return cached['body']
+
+        headers = {}
+        if cached and cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+
+        response = session.get(url, headers=headers, timeout=timeout)
+
+        if response.status_code == 304 and cached:
+            _refresh_cached_response(url, response, cached)
+            return cached['body']
+
+        if response.status_code != 200:
+            raise requests.HTTPError("HTTP Error {}: {}".format(response.status_code, response.reason))
+
+        body = response.content.strip()
+        _cache_response(url, response, body)
+
+        return body
+
     def run_query(self, query):
         base_url = self.configuration.get("url", None)
 
@@ -37,14 +151,14 @@ class Url(BaseQueryRunner):
 
             url = base_url + query
 
-            json_data = urllib2.urlopen(url).read().strip()
+            json_data = self._fetch(_get_session(base_url), url)
 
             if not json_data:
                 error = "Error reading data from '%s'" % url
 
             return json_data, error
 
-        except urllib2.URLError as e:
+        except requests.RequestException as e:
             return None, str(e)
         except KeyboardInterrupt:
             error = "Query cancelled by user."
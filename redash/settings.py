@@ -67,6 +67,7 @@ DATABASE_CONFIG = parse_db_url(os.environ.get("REDASH_DATABASE_URL", os.environ.
 
 # Celery related settings
 CELERY_BROKER = os.environ.get("REDASH_CELERY_BROKER", REDIS_URL)
+# Query jobs keep their status in Redis, so the result backend can be disabled (by setting it to an empty value).
 CELERY_BACKEND = os.environ.get("REDASH_CELERY_BACKEND", CELERY_BROKER)
 
 # The following enables periodic job (every 5 minutes) of removing unused query results.
@@ -74,6 +75,16 @@ QUERY_RESULTS_CLEANUP_ENABLED = parse_boolean(os.environ.get("REDASH_QUERY_RESUL
 QUERY_RESULTS_CLEANUP_COUNT = int(os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_COUNT", "100"))
 QUERY_RESULTS_CLEANUP_MAX_AGE = int(os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_MAX_AGE", "7"))
 
+# Spreading of scheduled refreshes: each query's refresh is delayed by a fixed (per query) offset of up to
+# SCHEDULE_JITTER_WINDOW seconds (up to 10% of the interval for interval based schedules), and every refresh tick
+# enqueues at most SCHEDULE_MAX_QUERIES_PER_DATA_SOURCE new jobs per data source (the rest wait for the next tick).
+# 0 disables either of them.
+SCHEDULE_JITTER_WINDOW = int(os.environ.get("REDASH_SCHEDULE_JITTER_WINDOW", "0"))
+SCHEDULE_MAX_QUERIES_PER_DATA_SOURCE = int(os.environ.get("REDASH_SCHEDULE_MAX_QUERIES_PER_DATA_SOURCE", "0"))
+# A failed scheduled refresh is retried after SCHEDULE_FAILURE_RETRY_DELAY seconds (or on the query's next iteration,
+# when it's sooner), instead of on every tick.
+SCHEDULE_FAILURE_RETRY_DELAY = int(os.environ.get("REDASH_SCHEDULE_FAILURE_RETRY_DELAY", "300"))
+
 AUTH_TYPE = os.environ.get("REDASH_AUTH_TYPE", "api_key")
 PASSWORD_LOGIN_ENABLED = parse_boolean(os.environ.get("REDASH_PASSWORD_LOGIN_ENABLED", "true"))
 ENFORCE_HTTPS = parse_boolean(os.environ.get("REDASH_ENFORCE_HTTPS", "false"))
@@ -122,6 +133,27 @@ REMOTE_USER_HEADER = os.environ.get("REDASH_REMOTE_USER_HEADER", "X-Forwarded-Re
 STATIC_ASSETS_PATHS = [fix_assets_path(path) for path in os.environ.get("REDASH_STATIC_ASSETS_PATH", "../rd_ui/app/").split(',')]
 
 JOB_EXPIRY_TIME = int(os.environ.get("REDASH_JOB_EXPIRY_TIME", 3600 * 6))
+
+# Default limits for queries running against a data source, for data sources that don't set their own (0 means no
+# limit). Queries over the limits are deferred, with a backoff starting at QUERY_ADMISSION_BACKOFF seconds.
+DATA_SOURCE_MAX_CONCURRENT_QUERIES = int(os.environ.get("REDASH_DATA_SOURCE_MAX_CONCURRENT_QUERIES", "0"))
+DATA_SOURCE_MAX_QUERIES_PER_MINUTE = int(os.environ.get("REDASH_DATA_SOURCE_MAX_QUERIES_PER_MINUTE", "0"))
+QUERY_ADMISSION_BACKOFF = int(os.environ.get("REDASH_QUERY_ADMISSION_BACKOFF", "5"))
+QUERY_ADMISSION_MAX_BACKOFF = int(os.environ.get("REDASH_QUERY_ADMISSION_MAX_BACKOFF", "300"))
+
+# Fair dispatching of queries: when FAIR_QUEUE_MAX_IN_FLIGHT is set, queries wait in a sub-queue per user (of each
+# org) and at most that many queries per Celery queue are handed to Celery at once, picked by weighted fair queuing
+# over the users. Weights are given as "username:weight" pairs (the default weight is 1). A query waiting longer than
+# FAIR_QUEUE_MAX_WAIT seconds is dispatched next, regardless of its user's share. The per user sub-queues are picked
+# inside a Redis script, which only works with a single Redis instance (not with Redis Cluster).
+FAIR_QUEUE_MAX_IN_FLIGHT = int(os.environ.get("REDASH_FAIR_QUEUE_MAX_IN_FLIGHT", "0"))
+FAIR_QUEUE_MAX_WAIT = int(os.environ.get("REDASH_FAIR_QUEUE_MAX_WAIT", "300"))
+# With the fair queue, a query waits in the lane of its priority (interactive, dashboard, scheduled, backfill), and
+# jobs of each lower priority are preferred over new jobs of the one above it once they waited QUERY_PRIORITY_AGING
+# seconds longer. Without it, the priority is passed to Celery as the message priority.
+QUERY_PRIORITY_AGING = int(os.environ.get("REDASH_QUERY_PRIORITY_AGING", "60"))
+FAIR_QUEUE_WEIGHTS = dict((username, float(weight)) for username, weight in
+                          (item.rsplit(':', 1) for item in array_from_string(os.environ.get("REDASH_FAIR_QUEUE_WEIGHTS", ""))))
 COOKIE_SECRET = os.environ.get("REDASH_COOKIE_SECRET", "c292a0a3aa32397cdb050e233733900f")
 SESSION_COOKIE_SECURE = parse_boolean(os.environ.get("REDASH_SESSION_COOKIE_SECURE") or str(ENFORCE_HTTPS))
 
@@ -213,6 +245,14 @@ VERSION_CHECK = parse_boolean(os.environ.get("REDASH_VERSION_CHECK", "true"))
 # BigQuery
 BIGQUERY_HTTP_TIMEOUT = int(os.environ.get("REDASH_BIGQUERY_HTTP_TIMEOUT", "600"))
 
+# Python query runner: scripts run in a pool of processes (per worker process), with a time limit and an optional
+# memory limit (in MB). With a pool size of 0 scripts run inside the worker process, without the limits.
+PYTHON_RUNNER_POOL_SIZE = int(os.environ.get("REDASH_PYTHON_RUNNER_POOL_SIZE", "1"))
+PYTHON_RUNNER_TIMEOUT = int(os.environ.get("REDASH_PYTHON_RUNNER_TIMEOUT", "600"))
+PYTHON_RUNNER_MEMORY_LIMIT = int(os.environ.get("REDASH_PYTHON_RUNNER_MEMORY_LIMIT", "0"))
+PYTHON_RUNNER_MAX_TASKS_PER_PROCESS = int(os.environ.get("REDASH_PYTHON_RUNNER_MAX_TASKS_PER_PROCESS", "100"))
+PYTHON_RUNNER_CODE_CACHE_SIZE = int(os.environ.get("REDASH_PYTHON_RUNNER_CODE_CACHE_SIZE", "100"))
+
 # Enhance schema fetching
 SCHEMA_RUN_TABLE_SIZE_CALCULATIONS = parse_boolean(os.environ.get("REDASH_SCHEMA_RUN_TABLE_SIZE_CALCULATIONS", "false"))
 
@@ -221,11 +261,16 @@ SCHEMA_RUN_TABLE_SIZE_CALCULATIONS = parse_boolean(os.environ.get("REDASH_SCHEMA
 ALLOW_PARAMETERS_IN_EMBEDS = parse_boolean(os.environ.get("REDASH_ALLOW_PARAMETERS_IN_EMBEDS", "false"))
 
 ### Common Client config
+# Max seconds a request for a job's status waits for the job to change (long polling). As each waiting request holds
+# a web worker, only enable this with asynchronous (i.e. gevent) web workers. 0 disables it.
+JOB_LONG_POLL_TIMEOUT = int(os.environ.get("REDASH_JOB_LONG_POLL_TIMEOUT", "0"))
+
 COMMON_CLIENT_CONFIG = {
     'allowScriptsInUserInput': ALLOW_SCRIPTS_IN_USER_INPUT,
     'dateFormat': DATE_FORMAT,
     'dateTimeFormat': "{0} HH:mm".format(DATE_FORMAT),
     'allowAllToEditQueries': FEATURE_ALLOW_ALL_TO_EDIT_QUERIES,
     'mailSettingsMissing': MAIL_DEFAULT_SENDER is None,
-    'logoUrl': LOGO_URL
+    'logoUrl': LOGO_URL,
+    'jobLongPollTimeout': JOB_LONG_POLL_TIMEOUT
 }
@@ -0,0 +1,165 @@
+import json
+import time
+
+from redash import redis_connection, settings
+
+# Names of the Celery queues that have a fair queue in front of them.
+FAIR_QUEUES_SET = 'fair_queues'
+
+# Keys of each priority lane, in the order the scripts expect them.
+LANE_KEYS = ('tenants', 'heads', 'vtime', 'finish', 'weights')
+
+# Adds a job to its tenant's sub-queue. A tenant that becomes active starts at the current virtual time (or its own
+# previous finish time, if later), so idle time isn't banked as credit.
+_push_script = redis_connection.register_script("""
+local tenants, heads, vtime, finish, weights, tenant_queue = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6]
+local tenant, payload, enqueued_at, weight = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+
+redis.call('HSET', weights, tenant, weight)
+if redis.call('RPUSH', tenant_queue, payload) == 1 then
+    local start = tonumber(redis.call('GET', vtime) or '0')
+    local previous_finish = tonumber(redis.call('HGET', finish, tenant) or '0')
+    redis.call('ZADD', tenants, math.max(start, previous_finish), tenant)
+    redis.call('ZADD', heads, enqueued_at, tenant)
+end
+""")
+
+# Pops the next job to dispatch, unless max_in_flight jobs are dispatched already. The lane is the one with the lowest
+# rank * aging - (wait time of its oldest job), so a lower priority lane gets its turn once its oldest job waited long
+# enough. Within the lane it's the head job of the tenant with the lowest virtual time, or of the tenant whose head job
+# waited longer than max_wait. KEYS[1] is the in flight set, followed by the keys of each lane (see LANE_KEYS). The
+# tenants' sub-queues are looked up by name (ARGV[1] is their prefix), as the tenant is only known in the script.
+_pop_script = redis_connection.register_script("""
+local in_flight = KEYS[1]
+local prefix, lanes = ARGV[1], tonumber(ARGV[2])
+local now, max_in_flight, max_wait, in_flight_expiry = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+local aging = tonumber(ARGV[7])
+
+-- Jobs that were lost without being released:
+redis.call('ZREMRANGEBYSCORE', in_flight, '-inf', now - in_flight_expiry)
+if redis.call('ZCARD', in_flight) >= max_in_flight then
+    return nil
+end
+
+local function lane_key(rank, i)
+    return KEYS[2 + rank * 5 + i]
+end
+
+local lane, lane_score
+for rank = 0, lanes - 1 do
+    local oldest = redis.call('ZRANGE', lane_key(rank, 1), 0, 0, 'WITHSCORES')
+    if oldest[1] then
+        local score = rank * aging - (now - tonumber(oldest[2]))
+        if not lane or score < lane_score then
+            lane, lane_score = rank, score
+        end
+    end
+end
+
+if not lane then
+    return nil
+end
+
+local tenants, heads, vtime = lane_key(lane, 0), lane_key(lane, 1), lane_key(lane, 2)
+local finish, weights = lane_key(lane, 3), lane_key(lane, 4)
+
+local tenant
+local oldest = redis.call('ZRANGE', heads, 0, 0, 'WITHSCORES')
+if now - tonumber(oldest[2]) >= max_wait then
+    tenant = oldest[1]
+else
+    tenant = redis.call('ZRANGE', tenants, 0, 0)[1]
+end
+
+local tenant_queue = prefix .. lane .. ':tenant:' .. tenant
+local payload = redis.call('LPOP', tenant_queue)
+local virtual_time = tonumber(redis.call('ZSCORE', tenants, tenant))
+local next_virtual_time = virtual_time + 1 / tonumber(redis.call('HGET', weights, tenant) or '1')
+
+redis.call('SET', vtime, virtual_time)
+redis.call('HSET', finish, tenant, next_virtual_time)
+
+local head = redis.call('LINDEX', tenant_queue, 0)
+if head then
+    redis.call('ZADD', tenants, next_virtual_time, tenant)
+    redis.call('ZADD', heads, cjson.decode(head)['enqueued_at'], tenant)
+else
+    redis.call('ZREM', tenants, tenant)
+    redis.call('ZREM', heads, tenant)
+end
+
+redis.call('ZADD', in_flight, now, cjson.decode(payload)['job_id'])
+return payload
+""")
+
+
+class FairQueue(object):
+    """Weighted fair queue of jobs in front of a Celery queue.
+
+    Jobs wait in priority lanes (0 being the highest priority), and within each lane in a sub-queue per tenant. At
+    most FAIR_QUEUE_MAX_IN_FLIGHT of them are handed to Celery at once. Each dispatched job advances its tenant's
+    virtual time by 1/weight, and the tenant with the lowest virtual time goes next, so a tenant with many queued jobs
+    can't starve the others.
+    """
+    def __init__(self, name, lanes=1):
+        self.name = name
+        self.lanes = lanes
+
+    def _key(self, suffix):
+        return 'fair_queue:{}:{}'.format(self.name, suffix)
+
+    def _lane_key(self, lane, suffix):
+        return self._key('{}:{}'.format(lane, suffix))
+
+    def push(self, job_id, tenant, payload, weight=1, lane=0, connection=None):
+        if connection is None:
+            connection = redis_connection
+
+        payload = dict(payload, job_id=job_id, tenant=tenant, lane=lane, enqueued_at=time.time())
+        connection.sadd(FAIR_QUEUES_SET, self.name)
+        keys = [self._lane_key(lane, suffix) for suffix in LANE_KEYS]
+        _push_script(keys=keys + [self._lane_key(lane, 'tenant:' + tenant)],
+                     args=[tenant, json.dumps(payload), payload['enqueued_at'], weight],
+                     client=connection)
+
+    def pop(self, max_in_flight, max_wait, aging=0):
+        """Returns the next job to dispatch (and counts it as in flight), or None.
+
+        A job in lane n is picked before newer jobs of higher priority lanes once it waited n * aging seconds longer.
+        """
+        keys = [self._key('in_flight')] + [self._lane_key(lane, suffix)
+                                           for lane in range(self.lanes) for suffix in LANE_KEYS]
+        payload = _pop_script(keys=keys,
+                              args=[self._key(''), self.lanes, time.time(), max_in_flight, max_wait,
+                                    settings.JOB_EXPIRY_TIME, aging])
+        if payload is None:
+            return None
+
+        return json.loads(payload)
+
+    def release(self, job_id):
+        redis_connection.zrem(self._key('in_flight'), job_id)
+
+    def _lane_status(self, lane, now):
+        tenants = redis_connection.zrange(self._lane_key(lane, 'tenants'), 0, -1, withscores=True)
+        heads = dict(redis_connection.zrange(self._lane_key(lane, 'heads'), 0, -1, withscores=True))
+
+        pipe = redis_connection.pipeline(transaction=False)
+        for tenant, virtual_time in tenants:
+            pipe.llen(self._lane_key(lane, 'tenant:' + tenant))
+        queued_counts = pipe.execute()
+
+        return dict((tenant, {'queued': queued, 'virtual_time': virtual_time,
+                              'oldest_wait': now - heads[tenant] if tenant in heads else None})
+                    for (tenant, virtual_time), queued in zip(tenants, queued_counts))
+
+    def status(self):
+        now = time.time()
+        return {
+            'in_flight': redis_connection.zcard(self._key('in_flight')),
+            'lanes': [self._lane_status(lane, now) for lane in range(self.lanes)]
+        }
+
+    @classmethod
+    def all(cls, lanes=1):
+        return [cls(name, lanes) for name in sorted(redis_connection.smembers(FAIR_QUEUES_SET))]
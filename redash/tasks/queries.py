@@ -1,9 +1,10 @@
 import json
 import time
 import logging
+import random
 import signal
-import redis
-from celery.result import AsyncResult
+import uuid
+from celery.signals import task_failure
 from celery.utils.log import get_task_logger
 from redash import redis_connection, models, statsd_client, settings, utils
 from redash.utils import gen_query_hash
@@ -11,10 +12,38 @@ from redash.worker import celery
 from redash.query_runner import InterruptException
 from .base import BaseTask
 from .alerts import check_alerts_for_query
+from .fair_queue import FairQueue
 
 logger = get_task_logger(__name__)
 
 
+# Priorities of query executions, highest first. With the fair queue each has its own lane (see FairQueue), otherwise
+# they're passed to Celery as message priorities (for the Redis transport 0 is the highest).
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_DASHBOARD = 'dashboard'
+PRIORITY_SCHEDULED = 'scheduled'
+PRIORITY_BACKFILL = 'backfill'
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_DASHBOARD, PRIORITY_SCHEDULED, PRIORITY_BACKFILL)
+CELERY_PRIORITIES = {
+    PRIORITY_INTERACTIVE: 0,
+    PRIORITY_DASHBOARD: 3,
+    PRIORITY_SCHEDULED: 6,
+    PRIORITY_BACKFILL: 9
+}
+
+
+def _default_priority(scheduled):
+    return PRIORITY_SCHEDULED if scheduled else PRIORITY_INTERACTIVE
+
+
+# Job statuses, as reported to the client (they map to the statuses of the old Job class).
+JOB_PENDING = 1
+JOB_STARTED = 2
+JOB_FINISHED = 3
+JOB_FAILED = 4
+JOB_DONE_STATUSES = (JOB_FINISHED, JOB_FAILED)
+
+
 def _job_lock_id(query_hash, data_source_id):
     return "query_hash_job:%s:%s" % (data_source_id, query_hash)
 
@@ -23,10 +52,86 @@ def _unlock(query_hash, data_source_id):
     redis_connection.delete(_job_lock_id(query_hash, data_source_id))
 
 
+def _job_updates_channel(job_id):
+    return "query_task_updates:%s" % job_id
+
+
+def _job_status_key(job_id):
+    return "query_task_status:%s" % job_id
+
+
+def _update_job_status(job_id, connection=None, **fields):
+    """Updates the job's status hash (the source of truth for the API and the cleanup task) and notifies the clients
+    waiting on the job (see QueryTask.wait_for_update), in a single transaction.
+
+    When given a pipeline as connection, the commands are only added to it.
+    """
+    fields['updated_at'] = time.time()
+    pipe = redis_connection.pipeline() if connection is None else connection
+
+    key = _job_status_key(job_id)
+    pipe.hmset(key, dict((name, json.dumps(value)) for name, value in fields.iteritems()))
+    pipe.expire(key, settings.JOB_EXPIRY_TIME)
+    pipe.publish(_job_updates_channel(job_id), json.dumps(fields))
+
+    if connection is None:
+        pipe.execute()
+
+
+def _get_job_statuses(job_ids):
+    """Returns the status of each of the jobs (None for jobs without a status hash, i.e. expired ones)."""
+    pipe = redis_connection.pipeline(transaction=False)
+    for job_id in job_ids:
+        pipe.hget(_job_status_key(job_id), 'status')
+
+    return [status and json.loads(status) for status in pipe.execute()]
+
+
+# Writes the given fields of a tracker (KEYS[1], a hash) and moves it to its current list (KEYS[3]), removing it from the
+# other lists (KEYS[4..]). KEYS[2] is the set of all trackers.
+_save_tracker_script = redis_connection.register_script("""
+local tracker, all_trackers, list = KEYS[1], KEYS[2], KEYS[3]
+local now = ARGV[1]
+
+redis.call('HMSET', tracker, unpack(ARGV, 2))
+redis.call('ZADD', all_trackers, now, tracker)
+for i = 4, #KEYS do
+    if KEYS[i] ~= list then
+        redis.call('ZREM', KEYS[i], tracker)
+    end
+end
+redis.call('ZADD', list, now, tracker)
+""")
+
+# Removes the oldest trackers of a list (KEYS[1]) and their hashes, keeping the newest ARGV[1] ones. KEYS[2] is the set
+# of all trackers. Returns the number of removed trackers.
+_prune_trackers_script = redis_connection.register_script("""
+local list, all_trackers = KEYS[1], KEYS[2]
+local remove_count = redis.call('ZCARD', list) - tonumber(ARGV[1])
+if remove_count <= 0 then
+    return 0
+end
+
+local trackers = redis.call('ZRANGE', list, 0, remove_count - 1)
+-- In batches, to stay below Lua's limit of unpack()ed values:
+for i = 1, #trackers, 1000 do
+    local batch = {unpack(trackers, i, math.min(i + 999, #trackers))}
+    redis.call('DEL', unpack(batch))
+    redis.call('ZREM', all_trackers, unpack(batch))
+end
+redis.call('ZREMRANGEBYRANK', list, 0, remove_count - 1)
+
+return remove_count
+""")
+
+
 # TODO:
 # There is some duplication between this class and QueryTask, but I wanted to implement the monitoring features without
 # much changes to the existing code, so ended up creating another object. In the future we can merge them.
 class QueryTaskTracker(object):
+    """Monitoring record of a query job, stored as a Redis hash (each field JSON encoded) and listed in the waiting,
+    in progress or done list, by its state."""
+    ALL_TRACKERS = 'query_task_trackers'
     DONE_LIST = 'query_task_trackers:done'
     WAITING_LIST = 'query_task_trackers:waiting'
     IN_PROGRESS_LIST = 'query_task_trackers:in_progress'
@@ -36,10 +141,11 @@ class QueryTaskTracker(object):
         self.data = data
 
     @classmethod
-    def create(cls, task_id, state, query_hash, data_source_id, scheduled, metadata):
+    def create(cls, task_id, state, query_hash, data_source_id, scheduled, metadata, priority=None):
         data = dict(task_id=task_id, state=state,
                     query_hash=query_hash, data_source_id=data_source_id,
                     scheduled=scheduled,
+                    priority=priority or _default_priority(scheduled),
                     username=metadata.get('Username', 'unknown'),
                     query_id=metadata.get('Query ID', 'unknown'),
                     retries=0,
@@ -51,24 +157,28 @@ class QueryTaskTracker(object):
         return cls(data)
 
     def save(self, connection=None):
+        self._save(self.data, connection)
+
+    def update(self, **kwargs):
+        """Updates the given fields only (along with the lists, if the state changed), in a single round trip."""
+        self.data.update(kwargs)
+        self._save(kwargs)
+
+    def _save(self, fields, connection=None):
         if connection is None:
             connection = redis_connection
 
-        self.data['updated_at'] = time.time()
-        key_name = self._key_name(self.data['task_id'])
-        connection.set(key_name, utils.json_dumps(self.data))
-        connection.zadd('query_task_trackers', time.time(), key_name)
-
-        connection.zadd(self._get_list(), time.time(), key_name)
+        now = time.time()
+        self.data['updated_at'] = now
+        fields = dict(fields, updated_at=now)
 
-        for l in self.ALL_LISTS:
-            if l != self._get_list():
-                connection.zrem(l, key_name)
+        args = [now]
+        for name, value in fields.iteritems():
+            args += [name, utils.json_dumps(value)]
 
-    # TOOD: this is not thread/concurrency safe. In current code this is not an issue, but better to fix this.
-    def update(self, **kwargs):
-        self.data.update(kwargs)
-        self.save()
+        key_name = self._key_name(self.data['task_id'])
+        _save_tracker_script(keys=[key_name, self.ALL_TRACKERS, self._get_list()] + list(self.ALL_LISTS), args=args,
+                             client=connection)
 
     @staticmethod
     def _key_name(task_id):
@@ -78,7 +188,7 @@ class QueryTaskTracker(object):
         if self.state in ('finished', 'failed', 'cancelled'):
             return self.DONE_LIST
 
-        if self.state in ('created'):
+        if self.state in ('created', 'deferred'):
             return self.WAITING_LIST
 
         return self.IN_PROGRESS_LIST
@@ -89,13 +199,13 @@ class QueryTaskTracker(object):
             connection = redis_connection
 
         key_name = cls._key_name(task_id)
-        data = connection.get(key_name)
+        data = connection.hgetall(key_name)
         return cls.create_from_data(data)
 
     @classmethod
     def create_from_data(cls, data):
         if data:
-            data = json.loads(data)
+            data = dict((name, json.loads(value)) for name, value in data.iteritems())
             return cls(data)
 
         return None
@@ -109,25 +219,16 @@ class QueryTaskTracker(object):
             offset -= 1
 
         ids = redis_connection.zrevrange(list_name, offset, limit)
-        pipe = redis_connection.pipeline()
+        pipe = redis_connection.pipeline(transaction=False)
         for id in ids:
-            pipe.get(id)
+            pipe.hgetall(id)
 
         tasks = [cls.create_from_data(data) for data in pipe.execute()]
         return tasks
 
     @classmethod
     def prune(cls, list_name, keep_count):
-        count = redis_connection.zcard(list_name)
-        if count <= keep_count:
-            return 0
-
-        remove_count = count - keep_count
-        keys = redis_connection.zrange(list_name, 0, remove_count - 1)
-        redis_connection.delete(*keys)
-        redis_connection.zremrangebyrank(list_name, 0, remove_count - 1)
-
-        return remove_count
+        return _prune_trackers_script(keys=[list_name, cls.ALL_TRACKERS], args=[keep_count])
 
     def __getattr__(self, item):
         return self.data[item]
@@ -137,117 +238,203 @@ class QueryTaskTracker(object):
 
 
 class QueryTask(object):
-    # TODO: this is mapping to the old Job class statuses. Need to update the client side and remove this
-    STATUSES = {
-        'PENDING': 1,
-        'STARTED': 2,
-        'SUCCESS': 3,
-        'FAILURE': 4,
-        'REVOKED': 4
-    }
-
-    def __init__(self, job_id=None, async_result=None):
-        if async_result:
-            self._async_result = async_result
-        else:
-            self._async_result = AsyncResult(job_id, app=celery)
+    def __init__(self, job_id):
+        self.id = job_id
 
-    @property
-    def id(self):
-        return self._async_result.id
+    def _get_status(self):
+        data = redis_connection.hgetall(_job_status_key(self.id))
+        return dict((name, json.loads(value)) for name, value in data.iteritems())
 
     def to_dict(self):
-        if self._async_result.status == 'STARTED':
-            updated_at = self._async_result.result.get('start_time', 0)
-        else:
-            updated_at = 0
+        # Jobs without a status hash didn't start yet (or expired):
+        status = self._get_status()
+        return {
+            'id': self.id,
+            'updated_at': status.get('updated_at', 0),
+            'status': status.get('status', JOB_PENDING),
+            'error': status.get('error', ''),
+            'query_result_id': status.get('query_result_id'),
+            'progress': status.get('progress') if status.get('status') == JOB_STARTED else None,
+        }
 
-        status = self.STATUSES[self._async_result.status]
+    def ready(self):
+        return self._get_status().get('status') in JOB_DONE_STATUSES
 
-        if isinstance(self._async_result.result, Exception):
-            error = self._async_result.result.message
-            status = 4
-        elif self._async_result.status == 'REVOKED':
-            error = 'Query execution cancelled.'
-        else:
-            error = ''
+    def wait_for_update(self, timeout):
+        """Blocks until the worker publishes an update of the job, for up to timeout seconds.
 
-        if self._async_result.successful() and not error:
-            query_result_id = self._async_result.result
-        else:
-            query_result_id = None
+        Returns right away if the job is done already.
+        """
+        pubsub = redis_connection.pubsub(ignore_subscribe_messages=True)
+        # Subscribing before checking the job, so an update published in between isn't missed:
+        pubsub.subscribe(_job_updates_channel(self.id))
 
-        return {
-            'id': self._async_result.id,
-            'updated_at': updated_at,
-            'status': status,
-            'error': error,
-            'query_result_id': query_result_id,
-        }
+        try:
+            if self.ready():
+                return
 
-    @property
-    def is_cancelled(self):
-        return self._async_result.status == 'REVOKED'
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                if pubsub.get_message(timeout=deadline - time.time()):
+                    return
+        finally:
+            pubsub.close()
 
-    @property
-    def celery_status(self):
-        return self._async_result.status
+    def cancel(self):
+        if self.ready():
+            return
+
+        # A job revoked before it started never runs, so it's marked as done here:
+        _update_job_status(self.id, status=JOB_FAILED, error='Query execution cancelled.')
+        celery.control.revoke(self.id, terminate=True, signal='SIGINT')
+
+
+# Takes the query's job lock for the new job, unless it's held by a job that isn't done yet (ARGV[4] lists the done
+# statuses). Returns [1, new job id] when the lock was taken or [0, existing job id] otherwise.
+_acquire_job_lock_script = redis_connection.register_script("""
+local job_id = redis.call('GET', KEYS[1])
+if job_id then
+    local status = redis.call('HGET', ARGV[3] .. job_id, 'status')
+    if not status or not string.find(ARGV[4], ',' .. status .. ',', 1, true) then
+        return {0, job_id}
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return {1, ARGV[1]}
+""")
+
+
+def _acquire_job_lock(query_hash, data_source_id, job_id, connection=None):
+    if connection is None:
+        connection = redis_connection
+
+    return _acquire_job_lock_script(keys=[_job_lock_id(query_hash, data_source_id)],
+                                    args=[job_id, settings.JOB_EXPIRY_TIME, _job_status_key(''),
+                                          ',{},'.format(','.join(map(str, JOB_DONE_STATUSES)))],
+                                    client=connection)
+
+
+def _job_failed_to_publish(job_id):
+    tracker = QueryTaskTracker.get_by_task_id(job_id)
+    _unlock(tracker.query_hash, tracker.data_source_id)
+    tracker.update(state='failed', error='Failed enqueuing job.')
+    _update_job_status(job_id, status=JOB_FAILED, error='Failed enqueuing job.')
+
+
+def _publish_job(job_id, query, query_hash, data_source, scheduled, metadata, priority, producer=None):
+    queue_name = data_source.scheduled_queue_name if scheduled else data_source.queue_name
+
+    if settings.FAIR_QUEUE_MAX_IN_FLIGHT:
+        username = metadata.get('Username', 'unknown')
+        FairQueue(queue_name, len(PRIORITIES)).push(job_id, '{}:{}'.format(data_source.org_id, username),
+                                                    {'query': query, 'data_source_id': data_source.id,
+                                                     'metadata': metadata},
+                                                    weight=settings.FAIR_QUEUE_WEIGHTS.get(username, 1),
+                                                    lane=PRIORITIES.index(priority))
+        logging.info("[%s] Queued new job: %s", query_hash, job_id)
+        dispatch_queued_queries(queue_name)
+        return QueryTask(job_id)
+
+    try:
+        execute_query.apply_async(args=(query, data_source.id, metadata), queue=queue_name,
+                                           task_id=job_id, priority=CELERY_PRIORITIES[priority], producer=producer)
+    except Exception:
+        logging.exception("[Manager][%s] Failed adding job for query.", query_hash)
+        _job_failed_to_publish(job_id)
+        return None
 
-    def ready(self):
-        return self._async_result.ready()
+    logging.info("[%s] Created new job: %s", query_hash, job_id)
+    return QueryTask(job_id)
 
-    def cancel(self):
-        return self._async_result.revoke(terminate=True, signal='SIGINT')
+
+def dispatch_queued_queries(queue_name):
+    """Hands the jobs waiting in the fair queue of the given Celery queue to Celery, as long as it has room for them."""
+    fair_queue = FairQueue(queue_name, len(PRIORITIES))
+
+    while True:
+        job = fair_queue.pop(settings.FAIR_QUEUE_MAX_IN_FLIGHT, settings.FAIR_QUEUE_MAX_WAIT,
+                             aging=settings.QUERY_PRIORITY_AGING)
+        if job is None:
+            break
+
+        # Cancelled while waiting in the fair queue:
+        if QueryTask(job['job_id']).ready():
+            fair_queue.release(job['job_id'])
+            continue
+
+        try:
+            execute_query.apply_async(args=(job['query'], job['data_source_id'], job['metadata']), queue=queue_name,
+                                      task_id=job['job_id'], priority=CELERY_PRIORITIES[PRIORITIES[job['lane']]])
+        except Exception:
+            logging.exception("[Manager] Failed dispatching job %s.", job['job_id'])
+            fair_queue.release(job['job_id'])
+            _job_failed_to_publish(job['job_id'])
 
 
-def enqueue_query(query, data_source, scheduled=False, metadata={}):
+def enqueue_query(query, data_source, scheduled=False, metadata={}, priority=None):
     query_hash = gen_query_hash(query)
+    priority = priority or _default_priority(scheduled)
     logging.info("Inserting job for %s with metadata=%s", query_hash, metadata)
-    try_count = 0
-    job = None
 
-    while try_count < 5:
-        try_count += 1
+    acquired, job_id = _acquire_job_lock(query_hash, data_source.id, str(uuid.uuid4()))
+    if not acquired:
+        logging.info("[%s] Found existing job: %s", query_hash, job_id)
+        return QueryTask(job_id)
 
-        pipe = redis_connection.pipeline()
-        try:
-            pipe.watch(_job_lock_id(query_hash, data_source.id))
-            job_id = pipe.get(_job_lock_id(query_hash, data_source.id))
-            if job_id:
-                logging.info("[%s] Found existing job: %s", query_hash, job_id)
-
-                job = QueryTask(job_id=job_id)
-
-                if job.ready():
-                    logging.info("[%s] job found is ready (%s), removing lock", query_hash, job.celery_status)
-                    redis_connection.delete(_job_lock_id(query_hash, data_source.id))
-                    job = None
-
-            if not job:
-                pipe.multi()
-
-                if scheduled:
-                    queue_name = data_source.scheduled_queue_name
-                else:
-                    queue_name = data_source.queue_name
-
-                result = execute_query.apply_async(args=(query, data_source.id, metadata), queue=queue_name)
-                job = QueryTask(async_result=result)
-                tracker = QueryTaskTracker.create(result.id, 'created', query_hash, data_source.id, scheduled, metadata)
-                tracker.save(connection=pipe)
-
-                logging.info("[%s] Created new job: %s", query_hash, job.id)
-                pipe.set(_job_lock_id(query_hash, data_source.id), job.id, settings.JOB_EXPIRY_TIME)
-                pipe.execute()
-            break
+    # The tracker is saved before the task is published, so the worker finds it.
+    QueryTaskTracker.create(job_id, 'created', query_hash, data_source.id, scheduled, metadata, priority).save()
 
-        except redis.WatchError:
-            continue
+    return _publish_job(job_id, query, query_hash, data_source, scheduled, metadata, priority)
+
+
+def _has_running_job(queries):
+    """Returns whether each of the given queries holds a job lock of a job that isn't done yet (see
+    _acquire_job_lock_script)."""
+    pipe = redis_connection.pipeline(transaction=False)
+    for query in queries:
+        pipe.get(_job_lock_id(query.query_hash, query.data_source.id))
+    job_ids = pipe.execute()
+
+    statuses = iter(_get_job_statuses([job_id for job_id in job_ids if job_id]))
+    return [job_id is not None and next(statuses) not in JOB_DONE_STATUSES for job_id in job_ids]
+
+
+def enqueue_queries(queries, scheduled=False, priority=None):
+    """Bulk version of enqueue_query, for a list of (query, data_source, metadata) tuples.
+
+    The job locks and the trackers are each handled in a single pipeline, and the tasks are published with a shared
+    producer. Returns the QueryTask of each query (None where no job could be created).
+    """
+    if not queries:
+        return []
+
+    priority = priority or _default_priority(scheduled)
+    query_hashes = [gen_query_hash(query) for query, data_source, metadata in queries]
+
+    pipe = redis_connection.pipeline(transaction=False)
+    for query_hash, (query, data_source, metadata) in zip(query_hashes, queries):
+        _acquire_job_lock(query_hash, data_source.id, str(uuid.uuid4()), connection=pipe)
+    locks = pipe.execute()
 
-    if not job:
-        logging.error("[Manager][%s] Failed adding job for query.", query_hash)
+    jobs = [None if acquired else QueryTask(job_id) for acquired, job_id in locks]
+    acquired = [i for i, (lock_acquired, job_id) in enumerate(locks) if lock_acquired]
 
-    return job
+    # Trackers are saved before the tasks are published, so the workers find them.
+    pipe = redis_connection.pipeline()
+    for i in acquired:
+        query, data_source, metadata = queries[i]
+        tracker = QueryTaskTracker.create(locks[i][1], 'created', query_hashes[i], data_source.id, scheduled, metadata,
+                                          priority)
+        tracker.save(connection=pipe)
+    pipe.execute()
+
+    with celery.producer_or_acquire() as producer:
+        for i in acquired:
+            query, data_source, metadata = queries[i]
+            jobs[i] = _publish_job(locks[i][1], query, query_hashes[i], data_source, scheduled, metadata, priority,
+                                   producer=producer)
+
+    return jobs
 
 
 @celery.task(name="redash.tasks.refresh_queries", base=BaseTask)
@@ -255,21 +442,46 @@ def refresh_queries():
     logger.info("Refreshing queries...")
 
     outdated_queries_count = 0
+    deferred_queries_count = 0
     query_ids = []
+    enqueued_per_data_source = {}
 
     with statsd_client.timer('manager.outdated_queries_lookup'):
-        for query in models.Query.outdated_queries():
-            if query.data_source.paused:
-                logging.info("Skipping refresh of %s because datasource - %s is paused (%s).", query.id, query.data_source.name, query.data_source.pause_reason)
+        outdated_queries = models.Query.outdated_queries()
+        data_sources = dict((query.data_source.id, query.data_source) for query in outdated_queries)
+        pause_reasons = models.DataSource.get_pause_reasons(data_sources.values())
+        queries_to_enqueue = []
+
+        # Only new jobs count towards the per data source cap, so queries of paused data sources and queries which
+        # are still running don't take the slots of the others.
+        for query, has_running_job in zip(outdated_queries, _has_running_job(outdated_queries)):
+            if query.data_source.id in pause_reasons:
+                logging.info("Skipping refresh of %s because datasource - %s is paused (%s).", query.id, query.data_source.name, pause_reasons[query.data_source.id])
+            elif has_running_job:
+                logging.info("Skipping refresh of %s because its job is still running.", query.id)
             else:
-                enqueue_query(query.query, query.data_source,
-                              scheduled=True,
-                              metadata={'Query ID': query.id, 'Username': 'Scheduled'})
+                enqueued_count = enqueued_per_data_source.get(query.data_source.id, 0)
+                if settings.SCHEDULE_MAX_QUERIES_PER_DATA_SOURCE and enqueued_count >= settings.SCHEDULE_MAX_QUERIES_PER_DATA_SOURCE:
+                    # Stays due, so it will be enqueued in one of the next ticks.
+                    deferred_queries_count += 1
+                    continue
+
+                enqueued_per_data_source[query.data_source.id] = enqueued_count + 1
+                queries_to_enqueue.append((query.query, query.data_source,
+                                           {'Query ID': query.id, 'Username': 'Scheduled'}))
 
             query_ids.append(query.id)
             outdated_queries_count += 1
 
+        enqueue_queries(queries_to_enqueue, scheduled=True)
+
+    # Picks up jobs left waiting in fair queues (i.e. when a worker died before dispatching the next ones):
+    if settings.FAIR_QUEUE_MAX_IN_FLIGHT:
+        for fair_queue in FairQueue.all(len(PRIORITIES)):
+            dispatch_queued_queries(fair_queue.name)
+
     statsd_client.gauge('manager.outdated_queries', outdated_queries_count)
+    statsd_client.gauge('manager.deferred_queries', deferred_queries_count)
 
     logger.info("Done refreshing queries. Found %d outdated queries: %s" % (outdated_queries_count, query_ids))
 
@@ -278,6 +490,7 @@ def refresh_queries():
 
     redis_connection.hmset('redash:status', {
         'outdated_queries_count': outdated_queries_count,
+        'deferred_queries_count': deferred_queries_count,
         'last_refresh_at': now,
         'query_ids': json.dumps(query_ids)
     })
@@ -288,27 +501,22 @@ def refresh_queries():
 @celery.task(name="redash.tasks.cleanup_tasks", base=BaseTask)
 def cleanup_tasks():
     in_progress = QueryTaskTracker.all(QueryTaskTracker.IN_PROGRESS_LIST)
-    for tracker in in_progress:
-        result = AsyncResult(tracker.task_id)
-
-        # If the AsyncResult status is PENDING it means there is no celery task object for this tracker, and we can
-        # mark it as "dead":
-        if result.status == 'PENDING':
+    for tracker, status in zip(in_progress, _get_job_statuses([t.task_id for t in in_progress])):
+        # A started job without a status is no longer known to the workers, and we can mark it as "dead":
+        if status is None:
             logging.info("In progress tracker for %s is no longer enqueued, cancelling (task: %s).",
                          tracker.query_hash, tracker.task_id)
             _unlock(tracker.query_hash, tracker.data_source_id)
             tracker.update(state='cancelled')
 
-        if result.ready():
+        if status in JOB_DONE_STATUSES:
             logging.info("in progress tracker %s finished", tracker.query_hash)
             _unlock(tracker.query_hash, tracker.data_source_id)
             tracker.update(state='finished')
 
     waiting = QueryTaskTracker.all(QueryTaskTracker.WAITING_LIST)
-    for tracker in waiting:
-        result = AsyncResult(tracker.task_id)
-
-        if result.ready():
+    for tracker, status in zip(waiting, _get_job_statuses([t.task_id for t in waiting])):
+        if status in JOB_DONE_STATUSES:
             logging.info("waiting tracker %s finished", tracker.query_hash)
             _unlock(tracker.query_hash, tracker.data_source_id)
             tracker.update(state='finished')
@@ -361,6 +569,90 @@ class QueryExecutionError(Exception):
     pass
 
 
+# Minimal interval (in seconds) between saving progress reports of a running query to its tracker.
+PROGRESS_REPORT_INTERVAL = 1
+
+
+# Admits a job to run against a data source, if it has both a free slot (KEYS[1] is a sorted set of the running jobs,
+# scored by their start time) and a token in its bucket (KEYS[2], refilled at the per minute rate).
+# Returns "0" when admitted, "-1" when there's no free slot, or the number of seconds until there's a token.
+_admit_query_script = redis_connection.register_script("""
+local job_id = ARGV[1]
+local now = tonumber(ARGV[2])
+local max_concurrent = tonumber(ARGV[3])
+local per_minute = tonumber(ARGV[4])
+local slot_expiry = tonumber(ARGV[5])
+
+if max_concurrent > 0 then
+    -- Slots of jobs that were lost without releasing them:
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - slot_expiry)
+    if not redis.call('ZSCORE', KEYS[1], job_id) and redis.call('ZCARD', KEYS[1]) >= max_concurrent then
+        return '-1'
+    end
+end
+
+if per_minute > 0 then
+    local bucket = redis.call('HMGET', KEYS[2], 'tokens', 'updated_at')
+    local tokens = tonumber(bucket[1]) or per_minute
+    local updated_at = tonumber(bucket[2]) or now
+    tokens = math.min(per_minute, tokens + (now - updated_at) * per_minute / 60)
+    if tokens < 1 then
+        return tostring((1 - tokens) * 60 / per_minute)
+    end
+    redis.call('HMSET', KEYS[2], 'tokens', tokens - 1, 'updated_at', now)
+    redis.call('EXPIRE', KEYS[2], 60)
+end
+
+if max_concurrent > 0 then
+    redis.call('ZADD', KEYS[1], now, job_id)
+    redis.call('EXPIRE', KEYS[1], slot_expiry)
+end
+
+return '0'
+""")
+
+
+def _running_queries_key(data_source_id):
+    return 'ds:{}:running_queries'.format(data_source_id)
+
+
+def _query_tokens_key(data_source_id):
+    return 'ds:{}:query_tokens'.format(data_source_id)
+
+
+def _admit_query(data_source, job_id):
+    """Takes a slot and a token of the data source for the job. Returns None when admitted, otherwise the number of
+    seconds to wait for a token (0 when waiting for a free slot)."""
+    max_concurrent = data_source.max_concurrent_queries
+    if max_concurrent is None:
+        max_concurrent = settings.DATA_SOURCE_MAX_CONCURRENT_QUERIES
+
+    per_minute = data_source.max_queries_per_minute
+    if per_minute is None:
+        per_minute = settings.DATA_SOURCE_MAX_QUERIES_PER_MINUTE
+
+    if not max_concurrent and not per_minute:
+        return None
+
+    result = float(_admit_query_script(keys=[_running_queries_key(data_source.id), _query_tokens_key(data_source.id)],
+                                       args=[job_id, time.time(), max_concurrent, per_minute,
+                                             settings.JOB_EXPIRY_TIME]))
+    if result == 0:
+        return None
+
+    return max(result, 0)
+
+
+def _release_query_slot(data_source, job_id):
+    redis_connection.zrem(_running_queries_key(data_source.id), job_id)
+
+
+def _admission_backoff(retries, wait_time):
+    """Exponential backoff (with jitter) for a deferred job, but not sooner than its data source has a token."""
+    backoff = min(settings.QUERY_ADMISSION_MAX_BACKOFF, settings.QUERY_ADMISSION_BACKOFF * 2 ** retries)
+    return max(backoff, wait_time) * random.uniform(1, 1.25)
+
+
 # We could have created this as a celery.Task derived class, and act as the task itself. But this might result in weird
 # issues as the task class created once per process, so decided to have a plain object instead.
 class QueryExecutor(object):
@@ -371,6 +663,7 @@ class QueryExecutor(object):
         self.metadata = metadata
         self.data_source = self._load_data_source()
         self.query_hash = gen_query_hash(self.query)
+        self._progress_reported_at = 0
         # Load existing tracker or create a new one if the job was created before code update:
         self.tracker = QueryTaskTracker.get_by_task_id(task.request.id) or QueryTaskTracker.create(task.request.id,
                                                                                                    'created',
@@ -380,12 +673,18 @@ class QueryExecutor(object):
 
     def run(self):
         signal.signal(signal.SIGINT, signal_handler)
-        self.tracker.update(started_at=time.time(), state='started')
+        started_at = time.time()
+        wait_time = started_at - self.tracker.created_at
+        statsd_client.timing('manager.queue_wait.{}'.format(self.tracker.data.get('priority', 'unknown')),
+                             wait_time * 1000)
+        self.tracker.update(started_at=started_at, wait_time=wait_time, state='started')
+        _update_job_status(self.task.request.id, status=JOB_STARTED, started_at=started_at)
 
         logger.debug("Executing query:\n%s", self.query)
         self._log_progress('executing_query')
 
         query_runner = self.data_source.query_runner
+        query_runner.progress_callback = self._report_progress
         annotated_query = self._annotate_query(query_runner)
         data, error = query_runner.run_query(annotated_query)
         run_time = time.time() - self.tracker.started_at
@@ -397,6 +696,11 @@ class QueryExecutor(object):
 
         if error:
             self.tracker.update(state='failed')
+            # The results of the failed queries weren't updated, so they would be due again on the next tick:
+            if self.tracker.data.get('scheduled'):
+                models.Query.postpone_schedules(self.query_hash, self.data_source.id,
+                                                settings.SCHEDULE_FAILURE_RETRY_DELAY)
+            _update_job_status(self.task.request.id, status=JOB_FAILED, error=error, state='failed')
             result = QueryExecutionError(error)
         else:
             query_result, updated_query_ids = models.QueryResult.store_result(self.data_source.org_id, self.data_source.id,
@@ -405,7 +709,7 @@ class QueryExecutor(object):
             self._log_progress('checking_alerts')
             for query_id in updated_query_ids:
                 check_alerts_for_query.delay(query_id)
-            self._log_progress('finished')
+            self._log_progress('finished', status=JOB_FINISHED, query_result_id=query_result.id)
 
             result = query_result.id
 
@@ -423,18 +727,52 @@ class QueryExecutor(object):
             annotated_query = self.query
         return annotated_query
 
-    def _log_progress(self, state):
+    def _log_progress(self, state, **status):
         logger.info(u"task=execute_query state=%s query_hash=%s type=%s ds_id=%d task_id=%s queue=%s query_id=%s username=%s",
                     state,
                     self.query_hash, self.data_source.type, self.data_source.id, self.task.request.id, self.task.request.delivery_info['routing_key'],
                     self.metadata.get('Query ID', 'unknown'), self.metadata.get('Username', 'unknown'))
         self.tracker.update(state=state)
+        _update_job_status(self.task.request.id, state=state, **status)
+
+    def _report_progress(self, progress):
+        now = time.time()
+        if now - self._progress_reported_at < PROGRESS_REPORT_INTERVAL:
+            return
+
+        self._progress_reported_at = now
+        self.tracker.update(progress=progress)
+        _update_job_status(self.task.request.id, progress=progress)
 
     def _load_data_source(self):
         logger.info("task=execute_query state=load_ds ds_id=%d", self.data_source_id)
         return models.DataSource.get_by_id(self.data_source_id)
 
 
-@celery.task(name="redash.tasks.execute_query", bind=True, base=BaseTask, track_started=True)
+# The job's status is kept in its status hash (see _update_job_status), so the result backend isn't needed.
+@celery.task(name="redash.tasks.execute_query", bind=True, base=BaseTask, ignore_result=True)
 def execute_query(self, query, data_source_id, metadata):
-    return QueryExecutor(self, query, data_source_id, metadata).run()
+    executor = QueryExecutor(self, query, data_source_id, metadata)
+
+    # Jobs over the data source's limits are deferred, instead of waiting for a slot while holding a worker:
+    wait_time = _admit_query(executor.data_source, self.request.id)
+    if wait_time is not None:
+        executor.tracker.update(state='deferred', retries=self.request.retries + 1)
+        raise self.retry(countdown=_admission_backoff(self.request.retries, wait_time), max_retries=None)
+
+    try:
+        return executor.run()
+    finally:
+        _release_query_slot(executor.data_source, self.request.id)
+
+        queue_name = (self.request.delivery_info or {}).get('routing_key')
+        if settings.FAIR_QUEUE_MAX_IN_FLIGHT and queue_name:
+            FairQueue(queue_name).release(self.request.id)
+            dispatch_queued_queries(queue_name)
+
+
+@task_failure.connect
+def _job_failed(sender=None, task_id=None, exception=None, **kwargs):
+    # Errors of the query itself are handled by QueryExecutor, this is for unexpected ones (i.e. a missing data source).
+    if sender is execute_query:
+        _update_job_status(task_id, status=JOB_FAILED, error=exception.message)
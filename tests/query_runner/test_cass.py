@@ -0,0 +1,86 @@
+import json
+from unittest import TestCase
+
+from mock import MagicMock, patch
+
+from redash.query_runner import cass
+from redash.query_runner.cass import Cassandra
+
+
+def _rows(count):
+    for i in range(count):
+        yield (i, 'name %d' % i)
+
+    raise AssertionError("Fetched more rows than needed")
+
+
+class TestCassandraRunQuery(TestCase):
+    def setUp(self):
+        self.session = MagicMock()
+        self.cluster = MagicMock()
+        self.cluster.connect.return_value = self.session
+        self.create_cluster = patch.object(Cassandra, '_create_cluster', return_value=self.cluster)
+        self.create_cluster.start()
+        self.statement = patch('redash.query_runner.cass.SimpleStatement', create=True)
+        self.statement.start()
+        cass._sessions.clear()
+
+    def tearDown(self):
+        self.create_cluster.stop()
+        self.statement.stop()
+        cass._sessions.clear()
+
+    def _result(self, rows):
+        result = MagicMock(column_names=['id', 'name'])
+        result.__iter__.return_value = rows
+        return result
+
+    def test_pages_through_results(self):
+        self.session.execute.return_value = self._result(iter([(1, 'a'), (2, 'b')]))
+        runner = Cassandra({'host': 'localhost', 'keyspace': 'test', 'fetchSize': 100})
+
+        data, error = runner.run_query('SELECT id, name FROM t')
+
+        self.assertIsNone(error)
+        cass.SimpleStatement.assert_called_once_with('SELECT id, name FROM t', fetch_size=100)
+        self.assertEqual([{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}], json.loads(data)['rows'])
+
+    def test_stops_paging_at_max_rows(self):
+        # The row past the cap is read to tell that the result was truncated:
+        self.session.execute.return_value = self._result(_rows(3))
+        runner = Cassandra({'host': 'localhost', 'keyspace': 'test', 'maxRows': 2})
+
+        data, error = runner.run_query('SELECT id, name FROM t')
+
+        self.assertIsNone(error)
+        data = json.loads(data)
+        self.assertEqual([0, 1], [row['id'] for row in data['rows']])
+        self.assertTrue(data['truncated'])
+
+    def test_result_within_max_rows_isnt_truncated(self):
+        self.session.execute.return_value = self._result(iter([(1, 'a'), (2, 'b')]))
+        runner = Cassandra({'host': 'localhost', 'keyspace': 'test', 'maxRows': 2})
+
+        data, error = runner.run_query('SELECT id, name FROM t')
+
+        self.assertIsNone(error)
+        self.assertNotIn('truncated', json.loads(data))
+
+    def test_reuses_session(self):
+        self.session.execute.side_effect = lambda statement: self._result(iter([]))
+        runner = Cassandra({'host': 'localhost', 'keyspace': 'test'})
+
+        runner.run_query('SELECT 1')
+        runner.run_query('SELECT 1')
+
+        self.assertEqual(1, self.cluster.connect.call_count)
+
+    def test_discards_session_of_parent_process(self):
+        self.session.execute.side_effect = lambda statement: self._result(iter([]))
+        runner = Cassandra({'host': 'localhost', 'keyspace': 'test'})
+
+        runner.run_query('SELECT 1')
+        with patch('redash.query_runner.cass.os.getpid', return_value=-1):
+            runner.run_query('SELECT 1')
+
+        self.assertEqual(2, self.cluster.connect.call_count)
@@ -0,0 +1,103 @@
+import json
+import signal
+import time
+from unittest import TestCase
+
+from mock import MagicMock, patch
+
+from redash.query_runner import InterruptException
+from redash.query_runner.dynamodb_sql import DynamoDBSQL
+
+
+class FakeScan(object):
+    def __init__(self, items, delay=0):
+        self.items = items
+        self.delay = delay
+        self.capacity = 0
+        self.read_count = 0
+
+    def __iter__(self):
+        for item in self.items:
+            time.sleep(self.delay)
+            self.capacity += 1
+            self.read_count += 1
+            yield item
+
+
+class TestDynamoDBRunQuery(TestCase):
+    def _run_query(self, items, **configuration):
+        engine = MagicMock()
+        engine.execute.return_value = iter(items)
+        runner = DynamoDBSQL(configuration)
+
+        with patch.object(DynamoDBSQL, '_connect', return_value=(engine, MagicMock())):
+            data, error = runner.run_query('SCAN * FROM table WHERE id > 1')
+
+        self.assertIsNone(error)
+        return json.loads(data)
+
+    def test_marks_result_cut_at_max_rows_as_truncated(self):
+        data = self._run_query([{'id': i} for i in range(5)], max_rows=3)
+
+        self.assertEqual([0, 1, 2], [row['id'] for row in data['rows']])
+        self.assertTrue(data['truncated'])
+
+    def test_result_within_max_rows_isnt_truncated(self):
+        data = self._run_query([{'id': i} for i in range(3)], max_rows=3)
+
+        self.assertEqual(3, len(data['rows']))
+        self.assertNotIn('truncated', data)
+
+
+class TestDynamoDBParallelScan(TestCase):
+    def _scan(self, segments, scans, limit=None, **configuration):
+        connection = MagicMock()
+        connection.scan2.side_effect = lambda table, segment, **kwargs: scans[segment]
+        runner = DynamoDBSQL(dict(configuration, scan_segments=segments))
+
+        return connection, runner._parallel_scan(connection, 'table', limit)
+
+    def test_merges_segments(self):
+        scans = [FakeScan([{'id': 1}, {'id': 2}]), FakeScan([{'id': 3, 'name': 'x'}])]
+
+        connection, data = self._scan(2, scans)
+
+        data = json.loads(data)
+        self.assertEqual([1, 2, 3], sorted(row['id'] for row in data['rows']))
+        self.assertEqual(set(['id', 'name']), set(c['name'] for c in data['columns']))
+        self.assertEqual(set([0, 1]), set(call[1]['segment'] for call in connection.scan2.call_args_list))
+        self.assertTrue(all(call[1]['total_segments'] == 2 for call in connection.scan2.call_args_list))
+
+    def test_stops_segments_at_limit(self):
+        scans = [FakeScan([{'id': i} for i in range(100)]) for segment in range(2)]
+
+        connection, data = self._scan(2, scans, limit=10)
+
+        data = json.loads(data)
+        self.assertEqual(10, len(data['rows']))
+        self.assertNotIn('truncated', data)
+        self.assertLess(sum(scan.read_count for scan in scans), 200)
+
+    def test_marks_result_cut_at_max_rows_as_truncated(self):
+        scans = [FakeScan([{'id': i} for i in range(100)]) for segment in range(2)]
+
+        connection, data = self._scan(2, scans, limit=50, max_rows=10)
+
+        data = json.loads(data)
+        self.assertEqual(10, len(data['rows']))
+        self.assertTrue(data['truncated'])
+
+    def test_can_be_interrupted(self):
+        def interrupt(*args):
+            raise InterruptException
+
+        scans = [FakeScan([{'id': i} for i in range(100)], delay=0.05) for segment in range(2)]
+        previous_handler = signal.signal(signal.SIGALRM, interrupt)
+        signal.setitimer(signal.ITIMER_REAL, 0.2)
+        started_at = time.time()
+        try:
+            self.assertRaises(InterruptException, self._scan, 2, scans)
+        finally:
+            signal.signal(signal.SIGALRM, previous_handler)
+
+        self.assertLess(time.time() - started_at, 2)
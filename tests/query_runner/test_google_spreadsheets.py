@@ -4,8 +4,10 @@ from unittest import TestCase
 
 from mock import Mock, MagicMock
 
-from redash.query_runner.google_spreadsheets import _guess_type, _value_eval_list, TYPE_STRING, TYPE_BOOLEAN
-from redash.query_runner.google_spreadsheets import parse_worksheet, parse_spreadsheet, WorksheetNotFoundError
+from redash.query_runner.google_spreadsheets import _guess_type, _guess_column_type, _value_eval_list
+from redash.query_runner.google_spreadsheets import TYPE_STRING, TYPE_BOOLEAN, TYPE_INTEGER, TYPE_FLOAT, TYPE_DATETIME
+from redash.query_runner.google_spreadsheets import parse_worksheet, parse_spreadsheet, WorksheetNotFoundError, \
+    TYPE_INFERENCE_SAMPLE_SIZE
 
 
 class TestGuessType(TestCase):
@@ -21,6 +23,32 @@ class TestGuessType(TestCase):
         self.assertEqual(_guess_type('FALSE'), TYPE_BOOLEAN)
 
 
+    def test_detects_numbers(self):
+        self.assertEqual(_guess_type('42'), TYPE_INTEGER)
+        self.assertEqual(_guess_type('-4.2'), TYPE_FLOAT)
+
+    def test_detects_datetime(self):
+        self.assertEqual(_guess_type('2016-08-01 10:00'), TYPE_DATETIME)
+        self.assertEqual(_guess_type('01/08/2016'), TYPE_DATETIME)
+
+    def test_doesnt_treat_words_as_datetime(self):
+        self.assertEqual(_guess_type('March'), TYPE_STRING)
+        self.assertEqual(_guess_type('Monday morning'), TYPE_STRING)
+
+
+class TestGuessColumnType(TestCase):
+    def test_ignores_empty_values(self):
+        self.assertEqual(_guess_column_type(['', '1', None, '2']), TYPE_INTEGER)
+        self.assertEqual(_guess_column_type(['', None]), TYPE_STRING)
+
+    def test_widens_integers_to_float(self):
+        self.assertEqual(_guess_column_type(['1', '2.5', '3']), TYPE_FLOAT)
+
+    def test_falls_back_to_string_on_mixed_values(self):
+        self.assertEqual(_guess_column_type(['1', 'TRUE']), TYPE_STRING)
+        self.assertEqual(_guess_column_type(['2016-08-01', 'A']), TYPE_STRING)
+
+
 class TestValueEvalList(TestCase):
     def test_handles_unicode(self):
         values = [u'יוניקוד', 'test', 'value']
@@ -59,3 +87,24 @@ class TestParseWorksheet(TestCase):
     def test_parse_regular_worksheet(self):
         parse_worksheet(regular_worksheet)
 
+
+    def test_parse_regular_worksheet_types(self):
+        data = parse_worksheet(regular_worksheet)
+
+        self.assertEqual([TYPE_STRING, TYPE_BOOLEAN, TYPE_INTEGER], [c['type'] for c in data['columns']])
+        self.assertEqual({'String Column': 'A', 'Boolean Column': True, 'Number Column': 1}, data['rows'][0])
+
+    def test_parse_worksheet_infers_type_from_all_sampled_rows(self):
+        worksheet = [['Mixed Column', 'Float Column'], ['1', '1'], ['2', '1.5'], ['A', '']]
+        data = parse_worksheet(worksheet)
+
+        self.assertEqual([TYPE_STRING, TYPE_FLOAT], [c['type'] for c in data['columns']])
+        self.assertEqual(['1', '2', 'A'], [r['Mixed Column'] for r in data['rows']])
+        self.assertEqual([1.0, 1.5, None], [r['Float Column'] for r in data['rows']])
+
+    def test_parse_worksheet_samples_non_empty_values_of_sparse_columns(self):
+        rows = [['1', ''] for i in range(TYPE_INFERENCE_SAMPLE_SIZE)] + [['2', '5'], ['3', '7']]
+        data = parse_worksheet([['Number Column', 'Sparse Column']] + rows)
+
+        self.assertEqual([TYPE_INTEGER, TYPE_INTEGER], [c['type'] for c in data['columns']])
+        self.assertEqual([5, 7], [r['Sparse Column'] for r in data['rows'][-2:]])
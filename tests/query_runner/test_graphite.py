@@ -0,0 +1,62 @@
+import json
+import urlparse
+from unittest import TestCase
+
+from mock import MagicMock, patch
+
+from redash.query_runner.graphite import Graphite
+
+
+def _response(series, status_code=200):
+    response = MagicMock(status_code=status_code)
+    response.json.return_value = series
+    return response
+
+
+def _render(url, **kwargs):
+    target = urlparse.parse_qs(urlparse.urlparse(url).query)['target']
+    return _response([{'target': name, 'datapoints': [[1.0, 1467072000]]} for name in target])
+
+
+class TestGraphiteRunQuery(TestCase):
+    def setUp(self):
+        self.session = MagicMock()
+        self.session.get.side_effect = _render
+        self.get_session = patch('redash.query_runner.graphite._get_session', return_value=self.session)
+        self.get_session.start()
+
+    def tearDown(self):
+        self.get_session.stop()
+
+    def _run_query(self, query, **configuration):
+        runner = Graphite(dict(configuration, url='http://graphite'))
+        return runner.run_query(query)
+
+    def test_fetches_targets_in_one_request_by_default(self):
+        data, error = self._run_query("target=a\ntarget=b\nfrom=-1d")
+
+        self.assertIsNone(error)
+        self.assertEqual(1, self.session.get.call_count)
+        self.assertEqual(['a', 'b'], [r['name::series'] for r in json.loads(data)['rows']])
+
+    def test_fetches_targets_concurrently(self):
+        data, error = self._run_query("target=a\ntarget=b\ntarget=c\nfrom=-1d", concurrency=2)
+
+        self.assertIsNone(error)
+        urls = sorted(call[0][0] for call in self.session.get.call_args_list)
+        self.assertEqual(['http://graphite/render?format=json&target=%s&from=-1d' % t for t in 'abc'], urls)
+        self.assertEqual(['a', 'b', 'c'], [r['name::series'] for r in json.loads(data)['rows']])
+
+    def test_adds_max_data_points(self):
+        self._run_query("target=a", maxDataPoints=100)
+
+        self.assertEqual('http://graphite/render?format=json&target=a&maxDataPoints=100',
+                         self.session.get.call_args[0][0])
+
+    def test_returns_error_of_failed_target(self):
+        self.session.get.side_effect = lambda url, **kwargs: _response([], 500) if 'target=b' in url else _render(url)
+
+        data, error = self._run_query("target=a\ntarget=b", concurrency=2)
+
+        self.assertIsNone(data)
+        self.assertEqual("Failed getting results (500)", error)
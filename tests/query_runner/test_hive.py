@@ -0,0 +1,58 @@
+import json
+from unittest import TestCase
+
+from mock import MagicMock, patch
+
+from redash.query_runner import InterruptException
+from redash.query_runner.hive_ds import Hive
+from redash.utils.configuration import ConfigurationContainer
+
+
+class FakeCursor(object):
+    """Behaves like the cursor of PyHive 0.1.6, which executes queries synchronously and is iterated row by row."""
+    description = [('id', 'BIGINT_TYPE', None, None, None, None, True),
+                   ('name', 'STRING_TYPE', None, None, None, None, True)]
+
+    def __init__(self, rows):
+        self.executed = []
+        self._rows = rows
+
+    def execute(self, operation, parameters=None):
+        self.executed.append(operation)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class TestHiveRunQuery(TestCase):
+    def setUp(self):
+        self.runner = Hive(ConfigurationContainer({'host': 'hive'}))
+        self.patch = patch('redash.query_runner.hive_ds.hive', create=True)
+        self.connect = self.patch.start().connect
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def _run_query(self, cursor):
+        self.connect.return_value.cursor.return_value = cursor
+        return self.runner.run_query('SELECT id, name FROM t')
+
+    def test_returns_all_rows(self):
+        cursor = FakeCursor([(1, 'a'), (2, 'b'), (3, 'c')])
+
+        data, error = self._run_query(cursor)
+
+        self.assertIsNone(error)
+        self.assertEqual(['SELECT id, name FROM t'], cursor.executed)
+        self.connect.assert_called_once_with(host='hive')
+        self.assertEqual([{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}, {'id': 3, 'name': 'c'}],
+                         json.loads(data)['rows'])
+
+    def test_closes_connection_to_cancel_query(self):
+        cursor = FakeCursor([])
+        cursor.execute = MagicMock(side_effect=InterruptException)
+
+        data, error = self._run_query(cursor)
+
+        self.assertEqual("Query cancelled by user.", error)
+        self.connect.return_value.close.assert_called_once_with()
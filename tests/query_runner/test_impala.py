@@ -0,0 +1,83 @@
+import json
+from unittest import TestCase
+
+from mock import MagicMock, patch
+
+from redash.query_runner import InterruptException
+from redash.query_runner.impala_ds import Impala
+from redash.utils.configuration import ConfigurationContainer
+
+
+class FakeCursor(object):
+    """Behaves like the cursor of impyla 0.10.0: setting arraysize sets the fetch buffer size, and buffersize itself is
+    read only."""
+    description = [('id', 'BIGINT', None, None, None, None, None), ('name', 'STRING', None, None, None, None, None)]
+
+    def __init__(self, rows):
+        self.arraysize = 1
+        self.executed = []
+        self.cancelled = False
+        self._rows = rows
+
+    @property
+    def buffersize(self):
+        return self.arraysize
+
+    def execute(self, operation):
+        self.executed.append(operation)
+
+    def fetchmany(self, size=None):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def cancel_operation(self):
+        self.cancelled = True
+
+    def close(self):
+        pass
+
+
+class DatabaseError(Exception):
+    pass
+
+
+class TestImpalaRunQuery(TestCase):
+    def setUp(self):
+        self.runner = Impala(ConfigurationContainer({'host': 'impala', 'fetch_size': 2}))
+        self.patches = [patch('redash.query_runner.impala_ds.connect', create=True),
+                        patch('redash.query_runner.impala_ds.DatabaseError', DatabaseError, create=True),
+                        patch('redash.query_runner.impala_ds.RPCError', DatabaseError, create=True)]
+        self.connect = self.patches[0].start()
+        for p in self.patches[1:]:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def _run_query(self, cursor):
+        self.connect.return_value.cursor.return_value = cursor
+        return self.runner.run_query('SELECT id, name FROM t')
+
+    def test_fetches_rows_in_batches(self):
+        cursor = FakeCursor([(1, 'a'), (2, 'b'), (3, 'c')])
+        cursor.fetchmany = MagicMock(wraps=cursor.fetchmany)
+
+        data, error = self._run_query(cursor)
+
+        self.assertIsNone(error)
+        self.connect.assert_called_once_with(host='impala')
+        self.assertEqual(2, cursor.buffersize)
+        self.assertEqual(3, cursor.fetchmany.call_count)
+        data = json.loads(data)
+        self.assertEqual(['integer', 'string'], [c['type'] for c in data['columns']])
+        self.assertEqual([1, 2, 3], [row['id'] for row in data['rows']])
+
+    def test_cancels_operation(self):
+        cursor = FakeCursor([])
+        cursor.execute = MagicMock(side_effect=InterruptException)
+
+        data, error = self._run_query(cursor)
+
+        self.assertEqual("Query cancelled by user.", error)
+        self.assertTrue(cursor.cancelled)
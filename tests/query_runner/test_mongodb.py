@@ -1,10 +1,13 @@
 import datetime
 import json
 from unittest import TestCase
+from mock import MagicMock, patch
 from pytz import utc
-from redash.query_runner.mongodb import parse_query_json
+from redash.query_runner.mongodb import parse_query_json, MongoDB
+from redash.query_runner import TYPE_INTEGER, TYPE_STRING
 
 from redash.utils import parse_human_time
+from tests import BaseTestCase
 
 
 class TestParseQueryJson(TestCase):
@@ -106,3 +109,79 @@ class TestParseQueryJson(TestCase):
 
 
 
+
+
+class TestMongoDBRunQuery(TestCase):
+    def setUp(self):
+        self.runner = MongoDB({'connectionString': 'mongodb://localhost', 'dbName': 'test'})
+        self.collection = MagicMock()
+        db = {'users': self.collection}
+        self.get_db = patch.object(MongoDB, '_get_db', return_value=db)
+        self.get_db.start()
+
+    def tearDown(self):
+        self.get_db.stop()
+
+    def test_discovers_columns_across_documents(self):
+        self.collection.find.return_value = [{'a': 1}, {'a': 2, 'b': 'x'}]
+
+        data, error = self.runner.run_query(json.dumps({'collection': 'users'}))
+        data = json.loads(data)
+
+        self.assertIsNone(error)
+        self.assertEqual([('a', TYPE_INTEGER), ('b', TYPE_STRING)], [(c['name'], c['type']) for c in data['columns']])
+        self.assertEqual([{'a': 1}, {'a': 2, 'b': 'x'}], data['rows'])
+
+    def test_orders_columns_by_fields(self):
+        self.collection.find.return_value = [{'a': 1, 'b': 2}]
+
+        data, error = self.runner.run_query(json.dumps({'collection': 'users', 'fields': {'b': 1, 'a': 2}}))
+
+        self.assertEqual(['b', 'a'], [c['name'] for c in json.loads(data)['columns']])
+
+    def test_projects_fields_in_aggregate(self):
+        self.collection.aggregate.return_value = [{'a': 1}]
+        query = {'collection': 'users', 'aggregate': [{'$match': {}}], 'fields': {'a': 1}, 'batchSize': 500}
+
+        self.runner.run_query(json.dumps(query))
+
+        self.collection.aggregate.assert_called_with([{'$match': {}}, {'$project': {'a': 1}}], batchSize=500)
+
+    def test_keeps_out_stage_last_in_aggregate(self):
+        self.collection.aggregate.return_value = [{'a': 1, 'b': 2}]
+        query = {'collection': 'users', 'aggregate': [{'$match': {}}, {'$out': 'results'}], 'fields': {'a': 1}}
+
+        data, error = self.runner.run_query(json.dumps(query))
+
+        self.collection.aggregate.assert_called_with([{'$match': {}}, {'$out': 'results'}])
+        self.assertEqual(['a'], [c['name'] for c in json.loads(data)['columns']])
+
+
+class TestMongoDBGetSchema(BaseTestCase):
+    def setUp(self):
+        super(TestMongoDBGetSchema, self).setUp()
+        self.runner = MongoDB({'connectionString': 'mongodb://localhost', 'dbName': 'test', 'schemaSampleSize': 50})
+        self.db = MagicMock()
+        self.db.collection_names.return_value = ['users']
+        self.db.command.return_value = {'count': 2, 'avgObjSize': 40}
+        self.collection = self.db.__getitem__.return_value
+        self.collection.aggregate.return_value = [{'a': 1}, {'b': 2}]
+
+    def get_schema(self):
+        with patch.object(MongoDB, '_get_db', return_value=self.db):
+            return self.runner.get_schema()
+
+    def test_infers_fields_from_sample(self):
+        self.assertEqual([{'name': 'users', 'columns': ['a', 'b']}], self.get_schema())
+        self.collection.aggregate.assert_called_once_with([{'$sample': {'size': 50}}])
+
+    def test_skips_unchanged_collections(self):
+        self.get_schema()
+        self.assertEqual([{'name': 'users', 'columns': ['a', 'b']}], self.get_schema())
+        self.assertEqual(1, self.collection.aggregate.call_count)
+
+    def test_samples_again_when_stats_change(self):
+        self.get_schema()
+        self.db.command.return_value = {'count': 3, 'avgObjSize': 40}
+        self.get_schema()
+        self.assertEqual(2, self.collection.aggregate.call_count)
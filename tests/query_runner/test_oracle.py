@@ -0,0 +1,111 @@
+import json
+from unittest import TestCase
+
+from mock import MagicMock, patch
+
+from redash.query_runner.oracle import Oracle
+
+
+class FakeCxOracle(object):
+    """The parts of the cx_Oracle module used by the runner."""
+    NUMBER, STRING, CLOB, BLOB = 'NUMBER', 'STRING', 'CLOB', 'BLOB'
+
+    class DatabaseError(Exception):
+        pass
+
+    makedsn = MagicMock(return_value='dsn')
+    connect = MagicMock()
+
+
+class FakeLob(object):
+    def __init__(self, value):
+        self.value = value
+        self.reads = []
+
+    def size(self):
+        return len(self.value)
+
+    def read(self, offset, amount):
+        self.reads.append((offset, amount))
+        return self.value[offset - 1:offset - 1 + amount]
+
+
+class FakeCursor(object):
+    def __init__(self, description, rows):
+        self.description = description
+        self.arraysize = 100
+        self._rows = rows
+        self.fetch_count = 0
+
+    def execute(self, query):
+        pass
+
+    def fetchmany(self):
+        self.fetch_count += 1
+        rows, self._rows = self._rows[:self.arraysize], self._rows[self.arraysize:]
+        return rows
+
+
+class TestOracleRunQuery(TestCase):
+    def setUp(self):
+        self.patches = [patch('redash.query_runner.oracle.cx_Oracle', FakeCxOracle, create=True),
+                        patch('redash.query_runner.oracle.TYPES_MAP', {'STRING': 'string', 'CLOB': 'string'},
+                              create=True),
+                        patch('redash.query_runner.oracle.LOB_CHUNK_SIZE', 4)]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def _run_query(self, cursor, **configuration):
+        FakeCxOracle.connect.return_value.cursor.return_value = cursor
+        runner = Oracle(dict(configuration, host='oracle', port=1521, servicename='orcl', user='u', password='p'))
+        return runner.run_query('SELECT * FROM t')
+
+    def test_fetches_in_arraysize_batches(self):
+        cursor = FakeCursor([('ID', 'NUMBER', None, None, None, 0, None)], [(i,) for i in range(5)])
+
+        data, error = self._run_query(cursor, arraysize=2)
+
+        self.assertIsNone(error)
+        self.assertEqual(2, cursor.arraysize)
+        self.assertEqual(4, cursor.fetch_count)
+        self.assertEqual(range(5), [row['ID'] for row in json.loads(data)['rows']])
+
+    def test_uses_default_arraysize(self):
+        cursor = FakeCursor([('ID', 'NUMBER', None, None, None, 0, None)], [])
+
+        self._run_query(cursor)
+
+        self.assertEqual(1000, cursor.arraysize)
+
+    def test_sets_prefetchrows_when_supported(self):
+        cursor = FakeCursor([('ID', 'NUMBER', None, None, None, 0, None)], [])
+        self._run_query(cursor, prefetchrows=50)
+        self.assertFalse(hasattr(cursor, 'prefetchrows'))
+
+        cursor.prefetchrows = 2
+        self._run_query(cursor, prefetchrows=50)
+        self.assertEqual(50, cursor.prefetchrows)
+
+    def test_streams_lobs_in_chunks(self):
+        lob = FakeLob('0123456789')
+        cursor = FakeCursor([('ID', 'NUMBER', None, None, None, 0, None), ('BODY', 'CLOB', None, None, None, 0, None)],
+                            [(1, lob), (2, None)])
+
+        data, error = self._run_query(cursor)
+
+        self.assertIsNone(error)
+        self.assertEqual([(1, 4), (5, 4), (9, 2)], lob.reads)
+        self.assertEqual(['0123456789', None], [row['BODY'] for row in json.loads(data)['rows']])
+
+    def test_truncates_lobs(self):
+        lob = FakeLob('0123456789')
+        cursor = FakeCursor([('BODY', 'CLOB', None, None, None, 0, None)], [(lob,)])
+
+        data, error = self._run_query(cursor, lobMode='truncate', lobMaxSize=6)
+
+        self.assertEqual([(1, 4), (5, 2)], lob.reads)
+        self.assertEqual('012345', json.loads(data)['rows'][0]['BODY'])
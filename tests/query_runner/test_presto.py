@@ -0,0 +1,107 @@
+import json
+from unittest import TestCase
+
+from mock import MagicMock, patch
+
+from redash.query_runner import InterruptException
+from redash.query_runner.presto import Presto
+
+
+def _response(**data):
+    response = MagicMock()
+    response.json.return_value = data
+    return response
+
+
+class FakeCursor(object):
+    """Behaves like the cursor of PyHive 0.1.6: it processes a response from Presto per status or page of results
+    (both while the query runs and while fetching), and has neither poll() nor cancel()."""
+    def __init__(self, responses):
+        self._responses = responses
+        self._nextUri = None
+        self._columns = None
+        self._data = []
+
+    def execute(self, operation):
+        self._process_response(self._responses.pop(0))
+
+    def _fetch_more(self):
+        self._process_response(self._responses.pop(0))
+
+    def _process_response(self, response):
+        response_json = response.json()
+        self._nextUri = response_json.get('nextUri')
+        self._columns = response_json.get('columns') or self._columns
+        self._data += response_json.get('data', [])
+
+    @property
+    def description(self):
+        while self._columns is None and self._nextUri:
+            self._fetch_more()
+
+        return [(c['name'], c['type'], None, None, None, None, True) for c in self._columns]
+
+    def fetchmany(self, size):
+        while len(self._data) < size and self._nextUri:
+            self._fetch_more()
+
+        rows, self._data = self._data[:size], self._data[size:]
+        return rows
+
+
+COLUMNS = [{'name': 'id', 'type': 'bigint'}, {'name': 'name', 'type': 'varchar'}]
+
+
+def _stats(state, completed_splits):
+    return {'state': state, 'completedSplits': completed_splits, 'totalSplits': 4, 'processedRows': 10,
+            'processedBytes': 100}
+
+
+class TestPrestoRunQuery(TestCase):
+    def setUp(self):
+        self.runner = Presto({'host': 'presto'})
+        self.presto = patch('redash.query_runner.presto.presto', create=True)
+        self.connect = self.presto.start().connect
+
+    def tearDown(self):
+        self.presto.stop()
+
+    def _run_query(self, responses):
+        cursor = FakeCursor(responses)
+        self.runner.progress_callback = MagicMock()
+        self.connect.return_value.cursor.return_value = cursor
+
+        return self.runner.run_query('SELECT id, name FROM t')
+
+    def test_fetches_result_pages(self):
+        data, error = self._run_query([
+            _response(nextUri='http://presto/1', stats=_stats('QUEUED', 0)),
+            _response(nextUri='http://presto/2', columns=COLUMNS, data=[[1, 'a']], stats=_stats('RUNNING', 2)),
+            _response(columns=COLUMNS, data=[[2, 'b']], stats=_stats('FINISHED', 4)),
+        ])
+
+        self.assertIsNone(error)
+        data = json.loads(data)
+        self.assertEqual(['id', 'name'], [c['name'] for c in data['columns']])
+        self.assertEqual([{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}], data['rows'])
+
+    def test_reports_progress_of_each_response(self):
+        self._run_query([
+            _response(nextUri='http://presto/1', stats=_stats('QUEUED', 0)),
+            _response(columns=COLUMNS, data=[[1, 'a']], stats=_stats('FINISHED', 4)),
+        ])
+
+        progress = [call[0][0] for call in self.runner.progress_callback.call_args_list]
+        self.assertEqual(['QUEUED', 'FINISHED'], [p['state'] for p in progress])
+        self.assertEqual([0, 4], [p['completed_splits'] for p in progress])
+
+    def test_cancels_query_by_deleting_next_uri(self):
+        def interrupt():
+            raise InterruptException
+
+        with patch('redash.query_runner.presto.requests.delete') as delete, \
+                patch.object(FakeCursor, '_fetch_more', side_effect=interrupt):
+            data, error = self._run_query([_response(nextUri='http://presto/1')])
+
+        self.assertEqual("Query cancelled by user.", error)
+        delete.assert_called_once_with('http://presto/1')
@@ -0,0 +1,207 @@
+import json
+import multiprocessing
+import signal
+import time
+from unittest import TestCase
+
+from mock import patch
+from RestrictedPython.Guards import safe_builtins
+
+from redash import settings
+from redash.query_runner import InterruptException
+from redash.query_runner.python import Python, CompiledCodeCache
+from redash.utils.configuration import ConfigurationContainer
+from tests import BaseTestCase
+
+
+class TestCompiledCodeCache(TestCase):
+    def test_reuses_compiled_code(self):
+        cache = CompiledCodeCache(2)
+        self.assertIs(cache.get("a = 1"), cache.get("a = 1"))
+
+    def test_evicts_least_recently_used(self):
+        cache = CompiledCodeCache(2)
+        code = cache.get("a = 1")
+        cache.get("b = 1")
+        cache.get("a = 1")
+        cache.get("c = 1")
+
+        self.assertIs(code, cache.get("a = 1"))
+        self.assertEqual(2, len(cache._cache))
+
+
+def _run_query_in_process(script, results):
+    results.put(Python({}).run_query(script))
+
+
+def _run_query_in_daemonic_process(script):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_query_in_process, args=(script, results))
+    process.daemon = True
+    process.start()
+    try:
+        return results.get(timeout=10)
+    finally:
+        process.terminate()
+        process.join()
+
+
+class TestPythonRunQuery(TestCase):
+    def setUp(self):
+        self.runner = Python({})
+        self.pool_size = patch.object(settings, 'PYTHON_RUNNER_POOL_SIZE', 1)
+        self.pool_size.start()
+
+    def tearDown(self):
+        self.pool_size.stop()
+
+    def test_runs_script_in_pool(self):
+        script = "add_result_column(result, 'a', 'A', TYPE_INTEGER)\nadd_result_row(result, {'a': 1})"
+        data, error = self.runner.run_query(script)
+
+        self.assertIsNone(error)
+        self.assertEqual([{'a': 1}], json.loads(data)['rows'])
+
+    def test_returns_script_errors(self):
+        data, error = self.runner.run_query("import os")
+
+        self.assertIsNone(data)
+        self.assertIn("not configured as a supported import module", error)
+
+    def test_stops_scripts_exceeding_time_limit(self):
+        with patch.object(settings, 'PYTHON_RUNNER_TIMEOUT', 1):
+            data, error = self.runner.run_query("while True:\n    pass")
+
+        self.assertIsNone(data)
+        self.assertIn("time limit", error)
+
+    def test_runs_script_in_daemonic_process(self):
+        data, error = _run_query_in_daemonic_process("a = 1")
+
+        self.assertIsNone(error)
+        self.assertEqual([], json.loads(data)['rows'])
+
+    def test_stops_scripts_exceeding_time_limit_in_daemonic_process(self):
+        with patch.object(settings, 'PYTHON_RUNNER_TIMEOUT', 1):
+            data, error = _run_query_in_daemonic_process("while True:\n    pass")
+
+        self.assertIsNone(data)
+        self.assertIn("time limit", error)
+
+    def test_doesnt_modify_safe_builtins(self):
+        with patch.object(settings, 'PYTHON_RUNNER_POOL_SIZE', 0):
+            self.runner.run_query("a = 1")
+
+        self.assertNotIn('_getiter_', safe_builtins)
+
+
+class TestPythonResultHelpers(TestCase):
+    def setUp(self):
+        self.runner = Python({})
+        self.result = {"rows": [], "columns": []}
+
+    def _result(self):
+        return json.loads(self.runner._finish_result(self.result).to_json())
+
+    def test_add_result_rows(self):
+        self.runner.add_result_column(self.result, 'a', 'A', 'integer')
+        self.runner.add_result_column(self.result, 'b', 'B', 'string')
+        self.runner.add_result_rows(self.result, [(1, 'x'), (2, 'y')])
+
+        self.assertEqual([{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'y'}], self._result()['rows'])
+
+    def test_add_result_rows_keeps_order_of_rows(self):
+        self.runner.add_result_column(self.result, 'a', 'A', 'integer')
+        self.runner.add_result_row(self.result, {'a': 1})
+        self.runner.add_result_rows(self.result, [(2,), (3,)])
+        self.runner.add_result_row(self.result, {'a': 4})
+
+        self.assertEqual([1, 2, 3, 4], [row['a'] for row in self._result()['rows']])
+
+    def test_set_result_columns(self):
+        self.runner.add_result_row(self.result, {'c': 1})
+        self.runner.set_result_columns(self.result, [('a', [1, 2]), ('b', [None, 'y'])])
+
+        result = self._result()
+        self.assertEqual([('a', 'integer'), ('b', 'string')], [(c['name'], c['type']) for c in result['columns']])
+        self.assertEqual([{'a': 1, 'b': None}, {'a': 2, 'b': 'y'}], result['rows'])
+
+    def test_set_result_columns_sorts_dict_columns(self):
+        self.runner.set_result_columns(self.result, {'c': [1], 'a': [2], 'b': [3]})
+
+        self.assertEqual(['a', 'b', 'c'], [c['name'] for c in self.result['columns']])
+
+    def test_set_result_columns_with_types(self):
+        self.runner.set_result_columns(self.result, {'a': [1.0]}, types={'a': 'float'})
+
+        self.assertEqual('float', self.result['columns'][0]['type'])
+
+    def test_set_result_columns_requires_equal_lengths(self):
+        self.assertRaises(Exception, self.runner.set_result_columns, self.result, [('a', [1, 2]), ('b', [1])])
+
+    def test_script_result_includes_bulk_rows_and_log(self):
+        data, error = Python({}).run_script("set_result_columns(result, [('a', [1, 2])])\nprint 'done'")
+
+        self.assertIsNone(error)
+        data = json.loads(data)
+        self.assertEqual([{'a': 1}, {'a': 2}], data['rows'])
+        self.assertEqual(1, len(data['log']))
+
+    def test_dataframe_helper_requires_pandas(self):
+        data, error = Python({}).run_script("add_result_dataframe(result, None)")
+        self.assertIn("add_result_dataframe", error)
+
+
+class TestPythonExecuteQuery(BaseTestCase):
+    def setUp(self):
+        super(TestPythonExecuteQuery, self).setUp()
+        self.data_source = self.factory.create_data_source(type='python', options=ConfigurationContainer({}))
+        self.runner = Python({})
+
+    def test_returns_result_object(self):
+        result = self.runner.execute_query(self.data_source.id, "add_result_row(result, {'a': 1})")
+
+        self.assertEqual([{'a': 1}], result['rows'])
+
+    def test_returns_rows_added_by_bulk_helpers(self):
+        result = self.runner.execute_query(self.data_source.id, "set_result_columns(result, [('a', [1, 2])])")
+
+        self.assertEqual([{'a': 1}, {'a': 2}], result['rows'])
+
+    def test_caches_results(self):
+        query = "add_result_row(result, {'a': 1})"
+        with patch.object(Python, 'run_query_data', wraps=self.data_source.query_runner.run_query_data) as run_query_data:
+            result = self.runner.execute_query(self.data_source.id, query)
+            self.assertIs(result, self.runner.execute_query(self.data_source.id, query))
+
+        self.assertEqual(1, run_query_data.call_count)
+
+    def test_execute_queries_returns_results_in_order(self):
+        results = self.runner.execute_queries([(self.data_source.id, "add_result_row(result, {'a': %d})" % i)
+                                               for i in range(4)])
+
+        self.assertEqual([[{'a': i}] for i in range(4)], [r['rows'] for r in results])
+
+    def test_execute_queries_can_be_interrupted(self):
+        def interrupt(*args):
+            raise InterruptException
+
+        previous_handler = signal.signal(signal.SIGALRM, interrupt)
+        signal.setitimer(signal.ITIMER_REAL, 0.2)
+        started_at = time.time()
+        try:
+            with patch.object(Python, 'execute_query', side_effect=lambda *args: time.sleep(2)):
+                self.assertRaises(InterruptException, self.runner.execute_queries, [(1, 'a'), (1, 'b')])
+        finally:
+            signal.signal(signal.SIGALRM, previous_handler)
+
+        self.assertLess(time.time() - started_at, 1.5)
+
+    def test_get_query_result(self):
+        query_result = self.factory.create_query_result(data='{"columns": [], "rows": [{"a": 1}]}')
+        query = self.factory.create_query(latest_query_data=query_result)
+
+        result = self.runner.get_query_result(query.id)
+
+        self.assertEqual([{'a': 1}], result['rows'])
+        self.assertIs(result, self.runner.get_query_result(query.id))
@@ -0,0 +1,59 @@
+import json
+from unittest import TestCase
+
+from mock import MagicMock, patch
+
+from redash.query_runner import InterruptException
+from redash.query_runner.treasuredata import TreasureData
+
+
+class TestTreasureDataRunQuery(TestCase):
+    def setUp(self):
+        self.runner = TreasureData({'apikey': 'key', 'db': 'sample_db'})
+        self.client = MagicMock()
+        self.client.query.return_value = MagicMock(job_id='1')
+        self.tdclient = patch('redash.query_runner.treasuredata.tdclient', create=True)
+        self.tdclient.start().Client.return_value = self.client
+        self.sleep = patch('redash.query_runner.treasuredata.time.sleep')
+        self.sleep.start()
+
+    def tearDown(self):
+        self.tdclient.stop()
+        self.sleep.stop()
+
+    def test_polls_job_and_streams_result(self):
+        self.client.api.show_job.side_effect = [
+            {'status': 'queued'},
+            {'status': 'running', 'debug': {'cmdout': 'Stage-1 map = 50%'}},
+            {'status': 'success', 'hive_result_schema': [['id', 'bigint'], ['name', 'string']]},
+        ]
+        self.client.job_result_format_each.return_value = iter([[1, 'a'], [2, 'b']])
+        progress = []
+        self.runner.progress_callback = progress.append
+
+        data, error = self.runner.run_query('SELECT id, name FROM t')
+
+        self.assertIsNone(error)
+        data = json.loads(data)
+        self.assertEqual(['id', 'name'], [c['name'] for c in data['columns']])
+        self.assertEqual('integer', data['columns'][0]['type'])
+        self.assertEqual([{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}], data['rows'])
+        self.client.job_result_format_each.assert_called_once_with('1', 'msgpack')
+        self.assertEqual(['queued', 'running'], [p['state'] for p in progress])
+        self.assertEqual('Stage-1 map = 50%', progress[1]['log'])
+
+    def test_returns_error_of_failed_job(self):
+        self.client.api.show_job.return_value = {'status': 'error', 'debug': {'stderr': 'syntax error'}}
+
+        data, error = self.runner.run_query('SELEC 1')
+
+        self.assertIsNone(data)
+        self.assertIn('syntax error', error)
+
+    def test_kills_job_on_interrupt(self):
+        self.client.api.show_job.side_effect = InterruptException
+
+        data, error = self.runner.run_query('SELECT 1')
+
+        self.assertIsNone(data)
+        self.client.kill.assert_called_once_with('1')
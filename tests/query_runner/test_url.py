@@ -0,0 +1,58 @@
+from mock import MagicMock, patch
+
+from redash.query_runner.url import Url
+from tests import BaseTestCase
+
+
+def make_response(status_code=200, content='{"rows": []}', headers=None):
+    response = MagicMock(status_code=status_code, content=content, reason='')
+    response.headers = headers or {}
+    return response
+
+
+class TestUrlRunQuery(BaseTestCase):
+    def setUp(self):
+        super(TestUrlRunQuery, self).setUp()
+        self.runner = Url({'url': 'http://example.com'})
+        self.session = MagicMock()
+        self.get_session = patch('redash.query_runner.url._get_session', return_value=self.session)
+        self.get_session.start()
+
+    def tearDown(self):
+        self.get_session.stop()
+        super(TestUrlRunQuery, self).tearDown()
+
+    def test_returns_response_content(self):
+        self.session.get.return_value = make_response()
+
+        self.assertEqual(('{"rows": []}', None), self.runner.run_query('/data'))
+
+    def test_returns_error_for_failed_requests(self):
+        self.session.get.return_value = make_response(status_code=500)
+
+        data, error = self.runner.run_query('/data')
+
+        self.assertIsNone(data)
+        self.assertIn('500', error)
+
+    def test_reuses_fresh_response(self):
+        self.session.get.return_value = make_response(headers={'Cache-Control': 'max-age=600'})
+
+        self.runner.run_query('/data')
+        self.assertEqual(('{"rows": []}', None), self.runner.run_query('/data'))
+        self.assertEqual(1, self.session.get.call_count)
+
+    def test_revalidates_with_etag(self):
+        self.session.get.return_value = make_response(headers={'ETag': '"v1"'})
+        self.runner.run_query('/data')
+
+        self.session.get.return_value = make_response(status_code=304, content='')
+        self.assertEqual(('{"rows": []}', None), self.runner.run_query('/data'))
+        self.assertEqual({'If-None-Match': '"v1"'}, self.session.get.call_args[1]['headers'])
+
+    def test_doesnt_cache_no_store_responses(self):
+        self.session.get.return_value = make_response(headers={'Cache-Control': 'no-store, max-age=600'})
+
+        self.runner.run_query('/data')
+        self.runner.run_query('/data')
+        self.assertEqual(2, self.session.get.call_count)
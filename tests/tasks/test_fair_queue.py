@@ -0,0 +1,140 @@
+from mock import patch
+
+from tests import BaseTestCase
+from redash.tasks.fair_queue import FairQueue
+from redash.tasks.queries import enqueue_query, execute_query, dispatch_queued_queries, PRIORITY_BACKFILL, \
+    PRIORITY_DASHBOARD
+from tests.tasks.test_queries import gen_result
+
+
+class TestFairQueue(BaseTestCase):
+    def setUp(self):
+        super(TestFairQueue, self).setUp()
+        self.queue = FairQueue('queries')
+
+    def _pop_all(self, max_wait=300):
+        job_ids = []
+        job = self.queue.pop(100, max_wait)
+        while job:
+            job_ids.append(job['job_id'])
+            job = self.queue.pop(100, max_wait)
+        return job_ids
+
+    def test_alternates_between_tenants(self):
+        for i in range(3):
+            self.queue.push('a{}'.format(i), '1:a', {})
+        self.queue.push('b0', '1:b', {})
+
+        self.assertEqual(['a0', 'b0', 'a1', 'a2'], self._pop_all())
+
+    def test_respects_weights(self):
+        for i in range(4):
+            self.queue.push('a{}'.format(i), '1:a', {}, weight=2)
+            self.queue.push('b{}'.format(i), '1:b', {})
+
+        self.assertEqual(['a0', 'b0', 'a1', 'a2', 'b1', 'a3', 'b2', 'b3'], self._pop_all())
+
+    def test_dispatches_long_waiting_jobs_first(self):
+        self.queue.push('a0', '1:a', {})
+        self.queue.push('a1', '1:a', {})
+        self.queue.push('b0', '1:b', {})
+
+        self.assertEqual(['a0', 'a1', 'b0'], self._pop_all(max_wait=0))
+
+    def test_limits_jobs_in_flight(self):
+        self.queue.push('a0', '1:a', {})
+        self.queue.push('a1', '1:a', {})
+
+        self.assertEqual('a0', self.queue.pop(1, 300)['job_id'])
+        self.assertIsNone(self.queue.pop(1, 300))
+
+        self.queue.release('a0')
+        self.assertEqual('a1', self.queue.pop(1, 300)['job_id'])
+
+    def test_status(self):
+        self.queue.push('a0', '1:a', {})
+        self.queue.push('a1', '1:a', {})
+        self.queue.pop(10, 300)
+
+        status = self.queue.status()
+
+        self.assertEqual(1, status['in_flight'])
+        self.assertEqual(1, status['lanes'][0]['1:a']['queued'])
+        self.assertEqual(['queries'], [queue.name for queue in FairQueue.all()])
+
+
+class TestFairQueueLanes(BaseTestCase):
+    def setUp(self):
+        super(TestFairQueueLanes, self).setUp()
+        self.queue = FairQueue('queries', lanes=3)
+
+    def test_prefers_higher_priority_lanes(self):
+        self.queue.push('scheduled', 'scheduled', {}, lane=2)
+        self.queue.push('dashboard', 'user', {}, lane=1)
+        self.queue.push('interactive', 'user', {}, lane=0)
+
+        self.assertEqual(['interactive', 'dashboard', 'scheduled'],
+                         [self.queue.pop(10, 300, aging=60)['job_id'] for i in range(3)])
+
+    def test_ages_lower_priority_lanes(self):
+        with patch('redash.tasks.fair_queue.time.time', return_value=1000):
+            self.queue.push('scheduled', 'scheduled', {}, lane=2)
+
+        with patch('redash.tasks.fair_queue.time.time', return_value=1130):
+            self.queue.push('interactive', 'user', {}, lane=0)
+            self.assertEqual('scheduled', self.queue.pop(10, 300, aging=60)['job_id'])
+
+        self.assertEqual(3, len(self.queue.status()['lanes']))
+
+
+class TestFairDispatch(BaseTestCase):
+    def setUp(self):
+        super(TestFairDispatch, self).setUp()
+        self.settings = patch('redash.settings.FAIR_QUEUE_MAX_IN_FLIGHT', 1)
+        self.settings.start()
+        self.apply_async = patch.object(execute_query, 'apply_async', side_effect=gen_result)
+        self.apply_async.start()
+
+    def tearDown(self):
+        self.apply_async.stop()
+        self.settings.stop()
+        super(TestFairDispatch, self).tearDown()
+
+    def test_dispatches_when_there_is_room(self):
+        data_source = self.factory.create_data_source()
+        first = enqueue_query('SELECT 1', data_source, metadata={'Username': 'a'})
+        second = enqueue_query('SELECT 2', data_source, metadata={'Username': 'b'})
+
+        self.assertEqual(1, execute_query.apply_async.call_count)
+        self.assertEqual(first.id, execute_query.apply_async.call_args[1]['task_id'])
+
+        FairQueue(data_source.queue_name).release(first.id)
+        dispatch_queued_queries(data_source.queue_name)
+
+        self.assertEqual(2, execute_query.apply_async.call_count)
+        self.assertEqual(second.id, execute_query.apply_async.call_args[1]['task_id'])
+
+    def test_skips_cancelled_jobs(self):
+        data_source = self.factory.create_data_source()
+        first = enqueue_query('SELECT 1', data_source, metadata={'Username': 'a'})
+        second = enqueue_query('SELECT 2', data_source, metadata={'Username': 'b'})
+        with patch('celery.app.control.Control.revoke'):
+            second.cancel()
+
+        FairQueue(data_source.queue_name).release(first.id)
+        dispatch_queued_queries(data_source.queue_name)
+
+        self.assertEqual(1, execute_query.apply_async.call_count)
+
+    def test_uses_priority_lanes(self):
+        data_source = self.factory.create_data_source()
+        first = enqueue_query('SELECT 1', data_source, metadata={'Username': 'a'})
+        enqueue_query('SELECT 2', data_source, scheduled=True, metadata={'Username': 'Scheduled'})
+        enqueue_query('SELECT 3', data_source, metadata={'Username': 'b'}, priority=PRIORITY_BACKFILL)
+        dashboard = enqueue_query('SELECT 4', data_source, metadata={'Username': 'c'}, priority=PRIORITY_DASHBOARD)
+
+        FairQueue(data_source.queue_name).release(first.id)
+        dispatch_queued_queries(data_source.queue_name)
+
+        self.assertEqual(dashboard.id, execute_query.apply_async.call_args[1]['task_id'])
+        self.assertEqual(3, execute_query.apply_async.call_args[1]['priority'])
@@ -1,9 +1,13 @@
 from tests import BaseTestCase
 from redash import redis_connection
-from redash.tasks.queries import QueryTaskTracker, enqueue_query, execute_query
+from redash.tasks.queries import QueryTaskTracker, QueryTask, enqueue_query, enqueue_queries, execute_query, \
+    _admit_query, _release_query_slot, _admission_backoff, _update_job_status, _get_job_statuses, \
+    cleanup_tasks, JOB_FINISHED, JOB_FAILED, JOB_STARTED
 from unittest import TestCase
-from mock import MagicMock
+from mock import MagicMock, patch
 from collections import namedtuple
+import threading
+import time
 import uuid
 
 
@@ -35,6 +39,44 @@ class TestPrune(TestCase):
             self.assertFalse(redis_connection.exists(k))
 
 
+class TestQueryTaskTracker(BaseTestCase):
+    def _tracker(self):
+        tracker = QueryTaskTracker.create('task', 'created', 'hash', 1, False, {'Username': 'Arik', 'Query ID': 1})
+        tracker.save()
+        return tracker
+
+    def test_saves_tracker_as_hash(self):
+        self._tracker()
+
+        tracker = QueryTaskTracker.get_by_task_id('task')
+        self.assertEqual('created', tracker.state)
+        self.assertEqual('Arik', tracker.username)
+        self.assertIsNone(tracker.run_time)
+        self.assertEqual(1, redis_connection.zcard(QueryTaskTracker.WAITING_LIST))
+
+    def test_update_writes_given_fields(self):
+        tracker = self._tracker()
+        # Changed by someone else, i.e. the cleanup task:
+        redis_connection.hset(QueryTaskTracker._key_name('task'), 'retries', 2)
+
+        tracker.update(progress={'percent': 10})
+
+        saved = QueryTaskTracker.get_by_task_id('task')
+        self.assertEqual({'percent': 10}, saved.progress)
+        self.assertEqual(2, saved.retries)
+
+    def test_update_moves_tracker_between_lists(self):
+        tracker = self._tracker()
+
+        tracker.update(state='executing_query')
+        self.assertEqual(0, redis_connection.zcard(QueryTaskTracker.WAITING_LIST))
+        self.assertEqual(1, redis_connection.zcard(QueryTaskTracker.IN_PROGRESS_LIST))
+
+        tracker.update(state='finished')
+        self.assertEqual(0, redis_connection.zcard(QueryTaskTracker.IN_PROGRESS_LIST))
+        self.assertEqual(['task'], [t.task_id for t in QueryTaskTracker.all(QueryTaskTracker.DONE_LIST)])
+
+
 FakeResult = namedtuple('FakeResult', 'id')
 
 
@@ -68,3 +110,251 @@ class TestEnqueueTask(BaseTestCase):
         self.assertEqual(3, redis_connection.zcard(QueryTaskTracker.WAITING_LIST))
         self.assertEqual(0, redis_connection.zcard(QueryTaskTracker.IN_PROGRESS_LIST))
         self.assertEqual(0, redis_connection.zcard(QueryTaskTracker.DONE_LIST))
+
+
+def gen_result(*args, **kwargs):
+    return FakeResult(kwargs.get('task_id') or uuid.uuid4().hex)
+
+
+class TestEnqueueQueries(BaseTestCase):
+    def setUp(self):
+        super(TestEnqueueQueries, self).setUp()
+        self.query = self.factory.create_query()
+        self.apply_async = patch.object(execute_query, 'apply_async', side_effect=gen_result)
+        self.apply_async.start()
+
+    def tearDown(self):
+        self.apply_async.stop()
+        super(TestEnqueueQueries, self).tearDown()
+
+    def _queries(self, *texts):
+        return [(text, self.query.data_source, {'Username': 'Scheduled', 'Query ID': self.query.id}) for text in texts]
+
+    def test_enqueues_each_query_once(self):
+        jobs = enqueue_queries(self._queries('SELECT 1', 'SELECT 2'), scheduled=True)
+        enqueue_queries(self._queries('SELECT 1', 'SELECT 2'), scheduled=True)
+
+        self.assertEqual(2, execute_query.apply_async.call_count)
+        self.assertEqual(2, len(set(job.id for job in jobs)))
+        self.assertEqual(2, redis_connection.zcard(QueryTaskTracker.WAITING_LIST))
+        self.assertEqual(self.query.data_source.scheduled_queue_name,
+                         execute_query.apply_async.call_args[1]['queue'])
+
+    def test_returns_existing_job(self):
+        job = enqueue_query('SELECT 1', self.query.data_source, True, {'Username': 'Arik', 'Query ID': self.query.id})
+
+        jobs = enqueue_queries(self._queries('SELECT 1'))
+
+        self.assertEqual(1, execute_query.apply_async.call_count)
+        self.assertEqual(job.id, jobs[0].id)
+
+    def test_replaces_finished_job(self):
+        job = enqueue_queries(self._queries('SELECT 1'))[0]
+        _update_job_status(job.id, status=JOB_FINISHED)
+
+        new_job = enqueue_queries(self._queries('SELECT 1'))[0]
+
+        self.assertEqual(2, execute_query.apply_async.call_count)
+        self.assertNotEqual(job.id, new_job.id)
+
+
+class TestEnqueueQuery(BaseTestCase):
+    def setUp(self):
+        super(TestEnqueueQuery, self).setUp()
+        self.query = self.factory.create_query()
+        self.apply_async = patch.object(execute_query, 'apply_async', side_effect=gen_result)
+        self.apply_async.start()
+
+    def tearDown(self):
+        self.apply_async.stop()
+        super(TestEnqueueQuery, self).tearDown()
+
+    def _enqueue(self):
+        return enqueue_query(self.query.query, self.query.data_source, False, {'Username': 'Arik'})
+
+    def test_returns_running_job(self):
+        job = self._enqueue()
+
+        self.assertEqual(job.id, self._enqueue().id)
+        self.assertEqual(1, execute_query.apply_async.call_count)
+
+    def test_replaces_job_marked_ready(self):
+        job = self._enqueue()
+        _update_job_status(job.id, status=JOB_FINISHED)
+
+        new_job = self._enqueue()
+
+        self.assertNotEqual(job.id, new_job.id)
+        self.assertEqual(2, execute_query.apply_async.call_count)
+
+    def test_replaces_cancelled_job(self):
+        job = self._enqueue()
+        with patch('celery.app.control.Control.revoke'):
+            QueryTask(job_id=job.id).cancel()
+
+        self.assertNotEqual(job.id, self._enqueue().id)
+
+    def test_releases_lock_when_publishing_fails(self):
+        execute_query.apply_async.side_effect = Exception("Broker is down")
+
+        self.assertIsNone(self._enqueue())
+
+        tracker = QueryTaskTracker.all(QueryTaskTracker.DONE_LIST)[0]
+        self.assertEqual('failed', tracker.state)
+        execute_query.apply_async.side_effect = gen_result
+        self.assertIsNotNone(self._enqueue())
+
+
+class TestQueryAdmission(BaseTestCase):
+    def test_admits_everything_without_limits(self):
+        data_source = self.factory.create_data_source()
+
+        for i in range(10):
+            self.assertIsNone(_admit_query(data_source, str(i)))
+
+    def test_limits_concurrent_queries(self):
+        data_source = self.factory.create_data_source(max_concurrent_queries=2)
+
+        self.assertIsNone(_admit_query(data_source, 'a'))
+        self.assertIsNone(_admit_query(data_source, 'b'))
+        self.assertEqual(0, _admit_query(data_source, 'c'))
+
+        _release_query_slot(data_source, 'a')
+        self.assertIsNone(_admit_query(data_source, 'c'))
+
+    def test_limits_queries_per_minute(self):
+        data_source = self.factory.create_data_source(max_queries_per_minute=2)
+
+        self.assertIsNone(_admit_query(data_source, 'a'))
+        self.assertIsNone(_admit_query(data_source, 'b'))
+
+        wait_time = _admit_query(data_source, 'c')
+        self.assertGreater(wait_time, 25)
+        self.assertLessEqual(wait_time, 30)
+
+    def test_uses_default_limits(self):
+        data_source = self.factory.create_data_source()
+
+        with patch('redash.settings.DATA_SOURCE_MAX_CONCURRENT_QUERIES', 1):
+            self.assertIsNone(_admit_query(data_source, 'a'))
+            self.assertEqual(0, _admit_query(data_source, 'b'))
+
+    def test_backoff_grows_up_to_max(self):
+        with patch('redash.settings.QUERY_ADMISSION_BACKOFF', 5), patch('redash.settings.QUERY_ADMISSION_MAX_BACKOFF', 60):
+            self.assertTrue(5 <= _admission_backoff(0, 0) <= 6.25)
+            self.assertTrue(20 <= _admission_backoff(2, 0) <= 25)
+            self.assertTrue(60 <= _admission_backoff(10, 0) <= 75)
+            self.assertTrue(90 <= _admission_backoff(0, 90) <= 112.5)
+
+    def test_defers_job_over_limits(self):
+        data_source = self.factory.create_data_source()
+        job_id = str(uuid.uuid4())
+        QueryTaskTracker.create(job_id, 'created', 'hash', data_source.id, True, {}).save()
+
+        with patch('redash.tasks.queries._admit_query', return_value=12) as admit_query, \
+                patch('redash.tasks.queries.random.uniform', return_value=1), \
+                patch('redash.tasks.queries.QueryExecutor.run') as run, \
+                patch.object(execute_query, 'retry', return_value=Exception("Retry")) as retry:
+            execute_query.push_request(id=job_id, retries=0, delivery_info={})
+            try:
+                self.assertRaisesRegexp(Exception, "Retry", execute_query.run, 'SELECT 1', data_source.id, {})
+            finally:
+                execute_query.pop_request()
+
+        admit_query.assert_called_once_with(data_source, job_id)
+        retry.assert_called_once_with(countdown=12, max_retries=None)
+        self.assertFalse(run.called)
+        tracker = QueryTaskTracker.get_by_task_id(job_id)
+        self.assertEqual('deferred', tracker.data['state'])
+        self.assertEqual(1, tracker.data['retries'])
+
+
+class TestWaitForUpdate(BaseTestCase):
+    def test_returns_right_away_when_ready(self):
+        job = QueryTask(job_id='job')
+
+        with patch.object(QueryTask, 'ready', return_value=True):
+            started_at = time.time()
+            job.wait_for_update(10)
+
+        self.assertLess(time.time() - started_at, 1)
+
+    def test_returns_on_update(self):
+        job = QueryTask(job_id='job')
+        publisher = threading.Timer(0.2, _update_job_status, args=('job',), kwargs={'state': 'executing_query'})
+
+        with patch.object(QueryTask, 'ready', return_value=False):
+            started_at = time.time()
+            publisher.start()
+            job.wait_for_update(10)
+
+        self.assertLess(time.time() - started_at, 5)
+
+    def test_times_out_without_updates(self):
+        job = QueryTask(job_id='job')
+
+        with patch.object(QueryTask, 'ready', return_value=False):
+            started_at = time.time()
+            job.wait_for_update(0.3)
+
+        self.assertGreaterEqual(time.time() - started_at, 0.3)
+
+
+class TestJobStatus(BaseTestCase):
+    def test_pending_without_status(self):
+        job = QueryTask('job')
+
+        self.assertEqual(1, job.to_dict()['status'])
+        self.assertFalse(job.ready())
+
+    def test_reports_progress_of_started_job(self):
+        _update_job_status('job', status=JOB_STARTED, progress={'percent': 50})
+
+        self.assertEqual({'percent': 50}, QueryTask('job').to_dict()['progress'])
+
+    def test_reports_result_of_finished_job(self):
+        _update_job_status('job', status=JOB_FINISHED, query_result_id=10)
+        job = QueryTask('job')
+
+        self.assertTrue(job.ready())
+        self.assertEqual(10, job.to_dict()['query_result_id'])
+        self.assertIsNone(job.to_dict()['progress'])
+
+    def test_cancel_marks_job_failed(self):
+        job = QueryTask('job')
+        with patch('celery.app.control.Control.revoke') as revoke:
+            job.cancel()
+
+        revoke.assert_called_once_with('job', terminate=True, signal='SIGINT')
+        self.assertEqual(JOB_FAILED, job.to_dict()['status'])
+        self.assertEqual('Query execution cancelled.', job.to_dict()['error'])
+
+    def test_cancel_keeps_finished_job(self):
+        _update_job_status('job', status=JOB_FINISHED, query_result_id=10)
+        with patch('celery.app.control.Control.revoke') as revoke:
+            QueryTask('job').cancel()
+
+        self.assertFalse(revoke.called)
+        self.assertEqual([JOB_FINISHED, None], _get_job_statuses(['job', 'unknown']))
+
+
+class TestCleanupTasks(BaseTestCase):
+    def _tracker(self, task_id, state):
+        tracker = QueryTaskTracker.create(task_id, state, 'hash-' + task_id, 1, False, {})
+        tracker.save()
+        return tracker
+
+    def test_updates_trackers_by_job_status(self):
+        self._tracker('lost', 'executing_query')
+        self._tracker('finished', 'executing_query')
+        self._tracker('running', 'executing_query')
+        self._tracker('waiting', 'created')
+        _update_job_status('finished', status=JOB_FINISHED)
+        _update_job_status('running', status=JOB_STARTED)
+
+        cleanup_tasks()
+
+        self.assertEqual('cancelled', QueryTaskTracker.get_by_task_id('lost').state)
+        self.assertEqual('finished', QueryTaskTracker.get_by_task_id('finished').state)
+        self.assertEqual('executing_query', QueryTaskTracker.get_by_task_id('running').state)
+        self.assertEqual('created', QueryTaskTracker.get_by_task_id('waiting').state)
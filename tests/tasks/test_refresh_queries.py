@@ -1,8 +1,11 @@
 import datetime
-from mock import patch, call, ANY
+import uuid
+from mock import patch, ANY, MagicMock, PropertyMock
 from tests import BaseTestCase
+from redash import models
 from redash.utils import utcnow
 from redash.tasks import refresh_queries
+from redash.tasks.queries import QueryExecutor, QueryTaskTracker, _acquire_job_lock, _update_job_status, JOB_STARTED
 
 
 # TODO: this test should be split into two:
@@ -17,9 +20,9 @@ class TestRefreshQueries(BaseTestCase):
         query.latest_query_data = query_result
         query.save()
 
-        with patch('redash.tasks.queries.enqueue_query') as add_job_mock:
+        with patch('redash.tasks.queries.enqueue_queries') as add_job_mock:
             refresh_queries()
-            add_job_mock.assert_called_with(query.query, query.data_source, scheduled=True, metadata=ANY)
+            add_job_mock.assert_called_with([(query.query, query.data_source, ANY)], scheduled=True)
 
     def test_doesnt_enqueue_outdated_queries_for_paused_data_source(self):
         query = self.factory.create_query(schedule="60")
@@ -31,15 +34,15 @@ class TestRefreshQueries(BaseTestCase):
 
         query.data_source.pause()
 
-        with patch('redash.tasks.queries.enqueue_query') as add_job_mock:
+        with patch('redash.tasks.queries.enqueue_queries') as add_job_mock:
             refresh_queries()
-            add_job_mock.assert_not_called()
+            add_job_mock.assert_called_with([], scheduled=True)
 
         query.data_source.resume()
 
-        with patch('redash.tasks.queries.enqueue_query') as add_job_mock:
+        with patch('redash.tasks.queries.enqueue_queries') as add_job_mock:
             refresh_queries()
-            add_job_mock.assert_called_with(query.query, query.data_source, scheduled=True, metadata=ANY)
+            add_job_mock.assert_called_with([(query.query, query.data_source, ANY)], scheduled=True)
 
     def test_skips_fresh_queries(self):
         query = self.factory.create_query(schedule="1200")
@@ -47,9 +50,9 @@ class TestRefreshQueries(BaseTestCase):
         query_result = self.factory.create_query_result(retrieved_at=retrieved_at, query=query.query,
                                                    query_hash=query.query_hash)
 
-        with patch('redash.tasks.queries.enqueue_query') as add_job_mock:
+        with patch('redash.tasks.queries.enqueue_queries') as add_job_mock:
             refresh_queries()
-            self.assertFalse(add_job_mock.called)
+            add_job_mock.assert_called_with([], scheduled=True)
 
     def test_skips_queries_with_no_ttl(self):
         query = self.factory.create_query(schedule=None)
@@ -57,9 +60,9 @@ class TestRefreshQueries(BaseTestCase):
         query_result = self.factory.create_query_result(retrieved_at=retrieved_at, query=query.query,
                                                    query_hash=query.query_hash)
 
-        with patch('redash.tasks.queries.enqueue_query') as add_job_mock:
+        with patch('redash.tasks.queries.enqueue_queries') as add_job_mock:
             refresh_queries()
-            self.assertFalse(add_job_mock.called)
+            add_job_mock.assert_called_with([], scheduled=True)
 
     def test_enqueues_query_only_once(self):
         query = self.factory.create_query(schedule="60")
@@ -72,9 +75,9 @@ class TestRefreshQueries(BaseTestCase):
         query.save()
         query2.save()
 
-        with patch('redash.tasks.queries.enqueue_query') as add_job_mock:
+        with patch('redash.tasks.queries.enqueue_queries') as add_job_mock:
             refresh_queries()
-            add_job_mock.assert_called_once_with(query.query, query.data_source, scheduled=True, metadata=ANY)#{'Query ID': query.id, 'Username': 'Scheduled'})
+            add_job_mock.assert_called_once_with([(query.query, query.data_source, ANY)], scheduled=True)
 
     def test_enqueues_query_with_correct_data_source(self):
         query = self.factory.create_query(schedule="60", data_source=self.factory.create_data_source())
@@ -87,12 +90,11 @@ class TestRefreshQueries(BaseTestCase):
         query.save()
         query2.save()
 
-        with patch('redash.tasks.queries.enqueue_query') as add_job_mock:
+        with patch('redash.tasks.queries.enqueue_queries') as add_job_mock:
             refresh_queries()
-            add_job_mock.assert_has_calls([call(query2.query, query2.data_source, scheduled=True, metadata=ANY),
-                                           call(query.query, query.data_source, scheduled=True, metadata=ANY)],
-                                          any_order=True)
-            self.assertEquals(2, add_job_mock.call_count)
+            enqueued = add_job_mock.call_args[0][0]
+            self.assertItemsEqual([(query2.query, query2.data_source.id), (query.query, query.data_source.id)],
+                                  [(q, data_source.id) for q, data_source, metadata in enqueued])
 
     def test_enqueues_only_for_relevant_data_source(self):
         query = self.factory.create_query(schedule="60")
@@ -106,6 +108,64 @@ class TestRefreshQueries(BaseTestCase):
         query.save()
         query2.save()
 
-        with patch('redash.tasks.queries.enqueue_query') as add_job_mock:
+        with patch('redash.tasks.queries.enqueue_queries') as add_job_mock:
             refresh_queries()
-            add_job_mock.assert_called_once_with(query.query, query.data_source, scheduled=True, metadata=ANY)
+            add_job_mock.assert_called_once_with([(query.query, query.data_source, ANY)], scheduled=True)
+
+    def _create_outdated_queries(self, count):
+        queries = []
+        for i in range(count):
+            # The first queries are the longest overdue ones, so they're enqueued first.
+            retrieved_at = utcnow() - datetime.timedelta(minutes=10 + count - i)
+            query = self.factory.create_query(schedule="60", query="SELECT {}".format(i))
+            query_result = self.factory.create_query_result(retrieved_at=retrieved_at, query=query.query,
+                                                            query_hash=query.query_hash)
+            query.latest_query_data = query_result
+            query.save()
+            queries.append(query)
+
+        return queries
+
+    def _run_failing_job(self, query):
+        job_id = str(uuid.uuid4())
+        QueryTaskTracker.create(job_id, 'created', query.query_hash, query.data_source.id, True,
+                                {'Query ID': query.id, 'Username': 'Scheduled'}).save()
+        task = MagicMock()
+        task.request.id = job_id
+        task.request.delivery_info = {'routing_key': query.data_source.scheduled_queue_name}
+        query_runner = MagicMock()
+        query_runner.annotate_query.return_value = False
+        query_runner.run_query.return_value = (None, "Connection refused")
+
+        with patch.object(models.DataSource, 'query_runner', new_callable=PropertyMock, return_value=query_runner):
+            QueryExecutor(task, query.query, query.data_source.id, {'Query ID': query.id}).run()
+
+    def _enqueued_queries(self):
+        with patch('redash.settings.SCHEDULE_MAX_QUERIES_PER_DATA_SOURCE', 2), \
+                patch('redash.tasks.queries.enqueue_queries') as add_job_mock:
+            refresh_queries()
+            return [q for q, data_source, metadata in add_job_mock.call_args[0][0]]
+
+    def test_caps_enqueued_queries_per_data_source(self):
+        self._create_outdated_queries(3)
+
+        with patch('redash.settings.SCHEDULE_MAX_QUERIES_PER_DATA_SOURCE', 2), \
+                patch('redash.tasks.queries.enqueue_queries') as add_job_mock:
+            refresh_queries()
+            self.assertEquals(2, len(add_job_mock.call_args[0][0]))
+
+    def test_running_queries_dont_count_towards_cap(self):
+        queries = self._create_outdated_queries(3)
+        acquired, job_id = _acquire_job_lock(queries[0].query_hash, queries[0].data_source.id, str(uuid.uuid4()))
+        _update_job_status(job_id, status=JOB_STARTED)
+
+        self.assertEqual([queries[1].query, queries[2].query], self._enqueued_queries())
+
+    def test_failing_queries_dont_block_cap(self):
+        queries = self._create_outdated_queries(3)
+        self.assertEqual([queries[0].query, queries[1].query], self._enqueued_queries())
+
+        self._run_failing_job(queries[0])
+        self._run_failing_job(queries[1])
+
+        self.assertEqual([queries[2].query], self._enqueued_queries())
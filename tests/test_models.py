@@ -1,11 +1,13 @@
 #encoding: utf8
+import calendar
 import datetime
 import json
+import time
 from unittest import TestCase
 import mock
 from dateutil.parser import parse as date_parse
 from tests import BaseTestCase
-from redash import models
+from redash import models, redis_connection
 from redash.utils import gen_query_hash, utcnow
 
 
@@ -192,6 +194,23 @@ class ShouldScheduleNextTest(TestCase):
         self.assertTrue(models.should_schedule_next(previous, now, schedule))
 
 
+class ScheduleJitterTest(TestCase):
+    def test_no_jitter_by_default(self):
+        self.assertEqual(0, models.schedule_jitter(1, "3600"))
+
+    @mock.patch('redash.settings.SCHEDULE_JITTER_WINDOW', 600)
+    def test_jitter_is_fixed_per_query_and_within_window(self):
+        jitters = [models.schedule_jitter(query_id, "23:00") for query_id in range(100)]
+
+        self.assertEqual(jitters, [models.schedule_jitter(query_id, "23:00") for query_id in range(100)])
+        self.assertTrue(all(0 <= jitter < 600 for jitter in jitters))
+        self.assertGreater(len(set(jitters)), 1)
+
+    @mock.patch('redash.settings.SCHEDULE_JITTER_WINDOW', 600)
+    def test_jitter_is_capped_for_interval_schedules(self):
+        self.assertTrue(all(models.schedule_jitter(query_id, "300") < 30 for query_id in range(100)))
+
+
 class QueryOutdatedQueriesTest(BaseTestCase):
     # TODO: this test can be refactored to use mock version of should_schedule_next to simplify it.
     def test_outdated_queries_skips_unscheduled_queries(self):
@@ -231,6 +250,77 @@ class QueryOutdatedQueriesTest(BaseTestCase):
         self.assertIn(query, queries)
 
 
+class QueryScheduleIndexTest(BaseTestCase):
+    def _create_scheduled_query(self, schedule="3600", retrieved_at=None, **kwargs):
+        if retrieved_at is None:
+            retrieved_at = utcnow() - datetime.timedelta(hours=2)
+        query = self.factory.create_query(schedule=schedule, **kwargs)
+        query_result = self.factory.create_query_result(query=query, retrieved_at=retrieved_at)
+        query.latest_query_data = query_result
+        query.save()
+        return query
+
+    def test_indexes_next_run_time_on_save(self):
+        retrieved_at = utcnow() - datetime.timedelta(hours=2)
+        query = self._create_scheduled_query(retrieved_at=retrieved_at)
+
+        score = redis_connection.zscore(models.Query.SCHEDULE_KEY, query.id)
+        self.assertEqual(calendar.timegm(retrieved_at.utctimetuple()) + 3600, score)
+
+    def test_removes_unscheduled_query_from_index(self):
+        query = self._create_scheduled_query()
+
+        query.schedule = None
+        query.save()
+
+        self.assertIsNone(redis_connection.zscore(models.Query.SCHEDULE_KEY, query.id))
+        self.assertNotIn(query, models.Query.outdated_queries())
+
+    def test_store_result_moves_next_run_time(self):
+        query = self._create_scheduled_query()
+        self.assertIn(query, models.Query.outdated_queries())
+
+        models.QueryResult.store_result(query.org, query.data_source.id, query.query_hash, query.query, "1", 123,
+                                        utcnow())
+
+        self.assertGreater(redis_connection.zscore(models.Query.SCHEDULE_KEY, query.id), time.time())
+        self.assertNotIn(query, models.Query.outdated_queries())
+
+    def test_rebuilds_missing_index(self):
+        query = self._create_scheduled_query()
+        redis_connection.delete(models.Query.SCHEDULE_KEY, models.Query.SCHEDULE_INDEXED_KEY)
+
+        self.assertIn(query, models.Query.outdated_queries())
+        self.assertIsNotNone(redis_connection.zscore(models.Query.SCHEDULE_KEY, query.id))
+
+    def test_rebuilds_index_with_queries_indexed_on_their_own(self):
+        query = self._create_scheduled_query()
+        redis_connection.delete(models.Query.SCHEDULE_KEY, models.Query.SCHEDULE_INDEXED_KEY)
+        other_query = self._create_scheduled_query(query="SELECT 2")
+
+        outdated_queries = models.Query.outdated_queries()
+
+        self.assertIn(query, outdated_queries)
+        self.assertIn(other_query, outdated_queries)
+
+    def test_builds_index_once(self):
+        self._create_scheduled_query()
+        models.Query.outdated_queries()
+
+        with mock.patch.object(models.Query, 'update_schedule') as update_schedule:
+            models.Query.outdated_queries()
+
+        self.assertFalse(update_schedule.called)
+
+    def test_removes_stale_ids_from_index(self):
+        self._create_scheduled_query()
+        redis_connection.zadd(models.Query.SCHEDULE_KEY, 0, 12345)
+
+        models.Query.outdated_queries()
+
+        self.assertIsNone(redis_connection.zscore(models.Query.SCHEDULE_KEY, 12345))
+
+
 class QueryArchiveTest(BaseTestCase):
     def setUp(self):
         super(QueryArchiveTest, self).setUp()
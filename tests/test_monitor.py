@@ -0,0 +1,22 @@
+from tests import BaseTestCase
+from redash import redis_connection
+from redash.monitor import get_queue_sizes, get_status
+
+
+class TestQueueSizes(BaseTestCase):
+    def test_counts_messages_of_all_priorities(self):
+        redis_connection.lpush('queries', 'message')
+        redis_connection.lpush('queries\x06\x163', 'message')
+        redis_connection.lpush('queries\x06\x169', 'message', 'message')
+        redis_connection.lpush('scheduled_queries\x06\x166', 'message')
+
+        self.assertEqual([4, 1, 0], get_queue_sizes(['queries', 'scheduled_queries', 'other']))
+
+    def test_status_includes_queue_sizes(self):
+        data_source = self.factory.create_data_source()
+        redis_connection.lpush(data_source.scheduled_queue_name + '\x06\x163', 'message')
+
+        queues = get_status()['manager']['queues']
+
+        self.assertEqual(1, queues[data_source.scheduled_queue_name]['size'])
+        self.assertEqual(0, queues[data_source.queue_name]['size'])